@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""オフラインの負荷ベンチ（Discord にも本物の Ollama にも繋がない）。
+
+konnichiwaDbot の on_message に合成メッセージを一定レートで流し込み、
+ローカルの Ollama もどき・Web ページもどきを相手に次を計測する:
+  - スループット（処理したメッセージ数/秒）
+  - 返信の p50/p99（最初の送信まで・完了まで）
+  - イベントループの遅れ（p50/p99/max）
+  - メモリ（RSS）の増加
+結果は data/bench/ に JSON で保存し、--compare で版ごとに比べられる。
+
+  python bench/load_bench.py --rate 50 --duration 20
+  python bench/load_bench.py --env OLLAMA_CONCURRENCY=2 --posts-per-window 8
+  python bench/load_bench.py --compare data/bench/old.json data/bench/new.json
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from bench.stubs import CURRENT, FakeGuild, FakeMessage, FakeUser, StubOllama, StubPages
+
+MODEL = "qwen2.5:0.5b-instruct"
+
+
+# ===== 計測ユーティリティ =====
+def pct(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(p * len(s)))]
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource     # Linux 以外は最大 RSS で代用
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+async def watch_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.01):
+    """interval 秒の sleep がどれだけ遅れて戻るか（= 他の処理がループを塞いだ時間）"""
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - t - interval))
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, timeout=10).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, timeout=30).stdout.strip()
+        return (rev or "unknown") + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+# ===== 本体 =====
+def load_bot(args, ollama_port: int, tmp: str):
+    """スタブへ向けた設定を環境変数で与えてから konnichiwaDbot を読み込む"""
+    os.environ.update({
+        "OLLAMA_BACKENDS": f"127.0.0.1:{ollama_port}",
+        "OLLAMA_AUTOSTART": "false",
+        "SUMMARY_CACHE_DB": os.path.join(tmp, "summary.sqlite3"),
+        "RATE_STATE_DB": os.path.join(tmp, "ratelimit.sqlite3"),
+        "RETRIEVAL_ENABLED": "true" if args.retrieval else "false",
+        "RETRIEVAL_INDEX": os.path.join(tmp, "retrieval"),
+        "METRICS_ENABLED": "false",
+    })
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        os.environ[k] = v
+    bot_mod = importlib.import_module("konnichiwaDbot")
+    bot_mod.STREAM_REPLIES = not args.no_stream
+    bot_mod.STREAM_EDIT_INTERVAL = args.edit_interval
+    if args.posts_per_window or args.window:
+        from lib.rate_state import make_rate_state
+        bot_mod.RATE_STATE.close()
+        bot_mod.POSTS_PER_WINDOW = args.posts_per_window or bot_mod.POSTS_PER_WINDOW
+        bot_mod.WINDOW_SECONDS = args.window or bot_mod.WINDOW_SECONDS
+        bot_mod.RATE_STATE = make_rate_state(
+            bot_mod.RATE_STATE_BACKEND, bot_mod.POSTS_PER_WINDOW, bot_mod.WINDOW_SECONDS,
+            bot_mod.VIOLATION_WINDOW, algorithm=bot_mod.RATE_LIMIT_ALGORITHM,
+            path=os.environ["RATE_STATE_DB"], clock=bot_mod._now)
+    return bot_mod
+
+def make_world(args, me: FakeUser, counters: dict):
+    guilds = [FakeGuild(1000 + g, f"guild-{g}", me, args.channels, args.discord_latency, counters)
+              for g in range(args.guilds)]
+    users = []
+    for g in guilds:
+        for u in range(args.users):
+            user = FakeUser(g.id * 10_000 + u, f"user-{g.id}-{u}")
+            g.members[user.id] = user
+            users.append((g, user))
+    return guilds, users
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    ollama = StubOllama(MODEL, tokens=args.tokens, token_latency=args.token_latency,
+                        prefill=args.prefill, parallel=args.ollama_parallel)
+    pages = StubPages(page_kb=args.page_kb, latency=args.page_latency)
+    ollama_port = await ollama.start()
+    pages_port = await pages.start()
+    tmp = tempfile.mkdtemp(prefix="discollama-bench-")
+    devnull = open(os.devnull, "w")
+    with contextlib.redirect_stdout(devnull):
+        bot_mod = load_bot(args, ollama_port, tmp)
+        me = FakeUser(1, "discollama", bot=True)
+        bot_mod.bot._connection.user = me
+
+        async def no_commands(message):     # コマンドは流さない（Context の組み立てに本物の接続状態が要る）
+            return None
+        bot_mod.bot.process_commands = no_commands
+        counters: dict = {}
+        guilds, users = make_world(args, me, counters)
+        bot_mod.LOG_CHANNELS.build(guilds)
+        # 連投役: 少数のユーザーがメッセージの spam_ratio を占める
+        spammers = rng.sample(users, min(len(users), args.spammers)) if args.spam_ratio > 0 else []
+
+        records: list = []
+        lag: list = []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(watch_loop_lag(lag, stop))
+        rss_start = rss_bytes()
+        rss_peak = rss_start
+
+        async def one(msg, kind: str):
+            rec = {"kind": kind, "start": time.perf_counter(), "first_output": None}
+            CURRENT.set(rec)
+            try:
+                await bot_mod.on_message(msg)
+            except Exception as e:
+                rec["error"] = f"{type(e).__name__}: {e}"
+            rec["end"] = time.perf_counter()
+            records.append(rec)
+
+        total = int(args.rate * args.duration)
+        tasks = []
+        started = time.perf_counter()
+        for i in range(total):
+            # 開ループ: 処理が追いつかなくても予定時刻どおりに投げる
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if spammers and rng.random() < args.spam_ratio:
+                guild, user = rng.choice(spammers)
+            else:
+                guild, user = rng.choice(users)
+            channel = rng.choice(guild.chat_channels)
+            r = rng.random()
+            if r < args.url_ratio:
+                kind = "url"
+                content = f"{me.mention} http://127.0.0.1:{pages_port}/page/{rng.randrange(args.url_pool)} まとめて"
+            elif r < args.url_ratio + args.mention_ratio:
+                kind = "mention"
+                content = f"{me.mention} 質問 {rng.randrange(args.prompt_pool)} について教えて"
+            else:
+                kind = "chat"
+                content = f"雑談 {i}"
+            tasks.append(asyncio.create_task(one(FakeMessage(user, channel, content), kind)))
+            if i % 200 == 0:
+                rss_peak = max(rss_peak, rss_bytes())
+        sent_at = time.perf_counter()
+        done, pending = await asyncio.wait(tasks, timeout=args.drain) if tasks else (set(), set())
+        for t in pending:
+            t.cancel()
+        finished = time.perf_counter()
+        await asyncio.sleep(bot_mod.LOG_SINK.interval + 0.5)    # まとめ送りされるログも数に入れる
+        rss_end = rss_bytes()
+        stop.set()
+        await lag_task
+        stages = {stage: {"count": n,
+                          "p50": bot_mod.STAGE_SECONDS.quantile(0.5, stage),
+                          "p99": bot_mod.STAGE_SECONDS.quantile(0.99, stage)}
+                  for (stage,), n in bot_mod.STAGE_SECONDS.counts().items()}
+        moderation = {f"{a}:{r}": v for (a, r), v in bot_mod.MODERATION_ACTIONS.values().items()}
+        scheduler = bot_mod.OLLAMA_SCHEDULER.stats()
+        await bot_mod.bot.close()
+    devnull.close()
+    await ollama.stop()
+    await pages.stop()
+
+    def latency(kind=None, field="end"):
+        return [r[field] - r["start"] for r in records
+                if (kind is None or r["kind"] == kind) and r.get(field) is not None]
+
+    per_kind = {}
+    for kind in ("chat", "mention", "url"):
+        done_lat = latency(kind)
+        first = latency(kind, "first_output")
+        per_kind[kind] = {"count": len(done_lat),
+                          "p50": round(pct(done_lat, 0.5), 4), "p99": round(pct(done_lat, 0.99), 4),
+                          "first_output_p50": round(pct(first, 0.5), 4),
+                          "first_output_p99": round(pct(first, 0.99), 4)}
+    elapsed = finished - started
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "args": vars(args),
+        "summary": {
+            "messages": total,
+            "completed": len(records),
+            "timed_out": len(pending),
+            "errors": sum(1 for r in records if "error" in r),
+            "send_seconds": round(sent_at - started, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_per_s": round(len(records) / elapsed, 2) if elapsed else 0.0,
+            "reply_p50": round(pct(latency(), 0.5), 4),
+            "reply_p99": round(pct(latency(), 0.99), 4),
+            "loop_lag_p50_ms": round(pct(lag, 0.5) * 1000, 2),
+            "loop_lag_p99_ms": round(pct(lag, 0.99) * 1000, 2),
+            "loop_lag_max_ms": round(max(lag, default=0.0) * 1000, 2),
+            "rss_start_mb": round(rss_start / 2**20, 1),
+            "rss_peak_mb": round(max(rss_peak, rss_end) / 2**20, 1),
+            "rss_growth_mb": round((rss_end - rss_start) / 2**20, 1),
+        },
+        "by_kind": per_kind,
+        "stages": stages,
+        "moderation": moderation,
+        "discord_api_calls": counters,
+        "ollama_requests": ollama.requests,
+        "page_requests": pages.requests,
+        "scheduler": scheduler,
+        "errors_sample": [r["error"] for r in records if "error" in r][:5],
+    }
+
+
+# ===== 結果の保存・比較 =====
+COMPARE_KEYS = ("throughput_per_s", "reply_p50", "reply_p99", "loop_lag_p50_ms", "loop_lag_p99_ms",
+                "loop_lag_max_ms", "rss_growth_mb", "errors", "timed_out")
+
+def compare(old_path: str, new_path: str):
+    old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in (old_path, new_path))
+    print(f"{'metric':<20}{old['revision']:>16}{new['revision']:>16}{'change':>10}")
+    rows = [(k, old["summary"].get(k, 0), new["summary"].get(k, 0)) for k in COMPARE_KEYS]
+    for kind in ("mention", "url"):
+        for k in ("p50", "p99", "first_output_p50"):
+            rows.append((f"{kind}.{k}", old["by_kind"].get(kind, {}).get(k, 0), new["by_kind"].get(kind, {}).get(k, 0)))
+    for name, a, b in rows:
+        change = f"{(b - a) / a * 100:+.1f}%" if a else "-"
+        print(f"{name:<20}{a:>16}{b:>16}{change:>10}")
+
+def print_report(result: dict):
+    s = result["summary"]
+    print(f"rev={result['revision']}  {s['completed']}/{s['messages']} msgs in {s['elapsed_seconds']}s "
+          f"→ {s['throughput_per_s']} msg/s (errors={s['errors']}, timed_out={s['timed_out']})")
+    print(f"reply p50={s['reply_p50']}s p99={s['reply_p99']}s | loop lag p50={s['loop_lag_p50_ms']}ms "
+          f"p99={s['loop_lag_p99_ms']}ms max={s['loop_lag_max_ms']}ms | rss +{s['rss_growth_mb']}MB "
+          f"(peak {s['rss_peak_mb']}MB)")
+    for kind, k in result["by_kind"].items():
+        if k["count"]:
+            print(f"  {kind:<8} n={k['count']:<6} p50={k['p50']}s p99={k['p99']}s first_output p50={k['first_output_p50']}s")
+    for stage, st in sorted(result["stages"].items()):
+        print(f"  stage {stage:<13} n={st['count']:<6} p50≤{st['p50']}s p99≤{st['p99']}s")
+    print(f"  moderation: {result['moderation']}")
+    print(f"  discord api calls: {result['discord_api_calls']}  ollama requests: {result['ollama_requests']}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rate", type=float, default=30, help="1秒あたりのメッセージ数")
+    ap.add_argument("--duration", type=float, default=10, help="送り続ける秒数")
+    ap.add_argument("--drain", type=float, default=120, help="送り終えてから処理完了を待つ上限（秒）")
+    ap.add_argument("--guilds", type=int, default=4)
+    ap.add_argument("--channels", type=int, default=3, help="ギルド毎のチャンネル数")
+    ap.add_argument("--users", type=int, default=50, help="ギルド毎のユーザー数")
+    ap.add_argument("--mention-ratio", type=float, default=0.1, help="メンション（LLM 質問）の割合")
+    ap.add_argument("--url-ratio", type=float, default=0.05, help="URL 要約依頼の割合")
+    ap.add_argument("--url-pool", type=int, default=20, help="URL の種類（少ないほど要約キャッシュが効く）")
+    ap.add_argument("--prompt-pool", type=int, default=50, help="質問文の種類")
+    ap.add_argument("--spam-ratio", type=float, default=0.1, help="連投役のユーザーが占める割合")
+    ap.add_argument("--spammers", type=int, default=3)
+    ap.add_argument("--posts-per-window", type=int, default=0, help="POSTS_PER_WINDOW を上書き")
+    ap.add_argument("--window", type=float, default=0, help="WINDOW_SECONDS を上書き")
+    ap.add_argument("--tokens", type=int, default=40, help="Ollama もどきが返すトークン数")
+    ap.add_argument("--token-latency", type=float, default=0.01)
+    ap.add_argument("--prefill", type=float, default=0.05)
+    ap.add_argument("--ollama-parallel", type=int, default=1, help="Ollama もどきの同時処理数")
+    ap.add_argument("--page-kb", type=int, default=20)
+    ap.add_argument("--page-latency", type=float, default=0.02)
+    ap.add_argument("--discord-latency", type=float, default=0.03, help="Discord API 1回の所要秒数")
+    ap.add_argument("--edit-interval", type=float, default=1.2, help="STREAM_EDIT_INTERVAL を上書き")
+    ap.add_argument("--no-stream", action="store_true", help="ストリーミング返信を無効化")
+    ap.add_argument("--retrieval", action="store_true", help="過去ログ検索も有効化（numpy が必要）")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                    help="設定の上書き（例: OLLAMA_CONCURRENCY=2, FETCH_CONCURRENCY=4）")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default=str(ROOT / "data" / "bench"), help="結果 JSON の保存先ディレクトリ")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="保存済みの結果2つを比較して終了")
+    args = ap.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = asyncio.run(run(args))
+    print_report(result)
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{result['revision']}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"saved: {path}")
+
+if __name__ == "__main__":
+    main()
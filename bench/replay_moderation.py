@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""記録した受信イベント（trace.enabled で保存した JSONL）を連投対策に流し直すリプレイ。
+
+konnichiwaDbot の on_message（is_rate_limited → try_delete → record_violation_and_escalate）を
+スタブの Discord 相手に実行する。RATE_STATE の時計は trace の時刻で進む仮想時計なので、
+10分の荒らしでも数秒で再生でき、各イベントの判定とコスト（CPU 時間）を出力する。
+制限値やアルゴリズムを変えて同じ trace を流せば、実際の荒らしに対する効果を比べられる。
+
+  python bench/replay_moderation.py data/traces/messages.jsonl.gz
+  python bench/replay_moderation.py raid.jsonl.gz --algorithm token_bucket --posts-per-window 6
+  python bench/replay_moderation.py /tmp/raid.jsonl.gz --synthesize    # 合成した荒らしで試す
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from bench.load_bench import git_revision, pct
+from bench.stubs import FakeGuild, FakeMessage, FakeUser
+from lib.traffic_trace import VirtualClock, read_trace
+
+
+def synthesize(path: str, seed: int = 1, users: int = 200, raiders: int = 30,
+               duration: float = 300, raid_start: float = 120, raid_length: float = 60):
+    """普段の会話（全体で約2件/秒）に、raiders 人が 0.3〜1.2 秒おきに投稿する荒らしを重ねる"""
+    rng = random.Random(seed)
+    t0 = 1_700_000_000.0
+    events = []
+    t = 0.0
+    while t < duration:
+        t += rng.expovariate(2.0)
+        events.append({"t": t0 + t, "g": 1, "c": 10 + rng.randrange(5), "u": 1000 + rng.randrange(users),
+                       "n": rng.randrange(5, 200)})
+    for r in range(raiders):
+        t = raid_start + rng.random() * 5
+        while t < raid_start + raid_length:
+            events.append({"t": t0 + t, "g": 1, "c": 10 + rng.randrange(5), "u": 90_000 + r,
+                           "n": rng.randrange(1, 40)})
+            t += rng.uniform(0.3, 1.2)
+    events.sort(key=lambda e: e["t"])
+    with gzip.open(path, "wt", encoding="utf-8") if path.endswith(".gz") else open(path, "w", encoding="utf-8") as f:
+        for i, ev in enumerate(events):
+            ev["m"] = 5_000_000 + i
+            ev["t"] = round(ev["t"], 3)
+            f.write(json.dumps(ev, separators=(",", ":")) + "\n")
+    print(f"synthesized {len(events)} events ({raiders} raiders) → {path}")
+
+
+def load_bot(args, clock: VirtualClock, tmp: str):
+    os.environ.update({
+        "OLLAMA_BACKENDS": "127.0.0.1:9",      # 使わない（メンションは本文を持たないので発火しない）
+        "OLLAMA_AUTOSTART": "false",
+        "SUMMARY_CACHE_DB": os.path.join(tmp, "summary.sqlite3"),
+        "RETRIEVAL_ENABLED": "false",
+        "METRICS_ENABLED": "false",
+        "TRACE_ENABLED": "false",
+    })
+    if args.algorithm:
+        os.environ["RATE_LIMIT_ALGORITHM"] = args.algorithm
+    if args.backend:
+        os.environ["RATE_STATE_BACKEND"] = args.backend
+    import konnichiwaDbot as bot_mod
+    from lib.rate_state import make_rate_state
+    bot_mod.POSTS_PER_WINDOW = args.posts_per_window or bot_mod.POSTS_PER_WINDOW
+    bot_mod.WINDOW_SECONDS = args.window or bot_mod.WINDOW_SECONDS
+    bot_mod.VIOLATION_WINDOW = args.violation_window or bot_mod.VIOLATION_WINDOW
+    bot_mod.KICK_AFTER_DELETES = args.kick_after or bot_mod.KICK_AFTER_DELETES
+    bot_mod.BAN_AFTER_DELETES = args.ban_after or bot_mod.BAN_AFTER_DELETES
+    bot_mod.RATE_STATE.close()
+    bot_mod.RATE_STATE = make_rate_state(
+        bot_mod.RATE_STATE_BACKEND, bot_mod.POSTS_PER_WINDOW, bot_mod.WINDOW_SECONDS,
+        bot_mod.VIOLATION_WINDOW, algorithm=bot_mod.RATE_LIMIT_ALGORITHM,
+        path=os.path.join(tmp, "ratelimit.sqlite3"), clock=clock)
+    bot_mod.BULK_DELETER.window = 0         # 仮想時計では待たずにその場で削除する
+    return bot_mod
+
+
+async def replay(args) -> dict:
+    events = list(read_trace(args.trace))
+    if not events:
+        raise SystemExit(f"no events in {args.trace}")
+    clock = VirtualClock(events[0]["t"])
+    tmp = tempfile.mkdtemp(prefix="discollama-replay-")
+    counters: dict = {}
+    decisions_out = open(args.decisions, "w", encoding="utf-8") if args.decisions else None
+    devnull = open(os.devnull, "w")
+    with contextlib.redirect_stdout(devnull):
+        bot_mod = load_bot(args, clock, tmp)
+        me = FakeUser(1, "discollama", bot=True)
+        bot_mod.bot._connection.user = me
+
+        async def no_commands(message):
+            return None
+        bot_mod.bot.process_commands = no_commands
+        acts = bot_mod.MODERATION_ACTIONS
+        guilds: dict = {}
+        channels: dict = {}
+        users: dict = {}
+        costs = []
+        summary = {"ok": 0, "limited": 0, "kick": 0, "ban": 0, "skipped_banned": 0,
+                   "mismatch_vs_recorded": 0, "recorded_limited": 0}
+        first_seen: dict = {}
+        limited_users: set = set()
+        time_to_limit = []
+        wall_start = time.perf_counter()
+        for ev in events:
+            clock.advance_to(ev["t"])
+            gid, cid, uid = ev.get("g", 0), ev.get("c", 0), ev["u"]
+            guild = guilds.get(gid)
+            if guild is None:
+                guild = guilds[gid] = FakeGuild(gid, f"guild-{gid}", me, 0, args.discord_latency, counters)
+                bot_mod.LOG_CHANNELS.add_guild(guild)
+            channel = channels.get(cid)
+            if channel is None:
+                channel = channels[cid] = guild.add_channel(cid)
+            user = users.get(uid)
+            if user is None:
+                user = users[uid] = FakeUser(uid, f"user-{uid}")
+                guild.members[uid] = user
+            if uid in guild.banned:
+                summary["skipped_banned"] += 1      # Ban 済みのユーザーはもう投稿できない
+                continue
+            first_seen.setdefault(uid, ev["t"])
+            msg = FakeMessage(user, channel, "x" * ev.get("n", 1))
+            msg.id = ev.get("m", msg.id)
+
+            before = (acts.get("violation", "ok"), acts.get("kick", "ok"), acts.get("ban", "ok"))
+            t0 = time.perf_counter()
+            await bot_mod.on_message(msg)
+            cost = time.perf_counter() - t0
+            costs.append(cost)
+            violated = acts.get("violation", "ok") > before[0]
+            decision = "limited" if violated else "ok"
+            if acts.get("ban", "ok") > before[2]:
+                decision += "+ban"
+                summary["ban"] += 1
+            elif acts.get("kick", "ok") > before[1]:
+                decision += "+kick"
+                summary["kick"] += 1
+            summary["limited" if violated else "ok"] += 1
+            if violated and uid not in limited_users:
+                limited_users.add(uid)
+                time_to_limit.append(ev["t"] - first_seen[uid])
+            recorded = ev.get("d")
+            if recorded:
+                summary["recorded_limited"] += recorded == "limited"
+                summary["mismatch_vs_recorded"] += (recorded == "limited") != violated
+            if decisions_out:
+                decisions_out.write(json.dumps({"m": ev.get("m"), "u": uid, "t": ev["t"], "d": decision,
+                                                "recorded": recorded, "cost_us": round(cost * 1e6, 1)},
+                                               separators=(",", ":")) + "\n")
+        wall = time.perf_counter() - wall_start
+        await asyncio.sleep(0)
+        await bot_mod.bot.close()
+    devnull.close()
+    if decisions_out:
+        decisions_out.close()
+
+    span = events[-1]["t"] - events[0]["t"]
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "trace": str(args.trace),
+        "limiter": {"algorithm": bot_mod.RATE_LIMIT_ALGORITHM, "backend": bot_mod.RATE_STATE_BACKEND,
+                    "posts_per_window": bot_mod.POSTS_PER_WINDOW, "window": bot_mod.WINDOW_SECONDS,
+                    "violation_window": bot_mod.VIOLATION_WINDOW,
+                    "kick_after": bot_mod.KICK_AFTER_DELETES, "ban_after": bot_mod.BAN_AFTER_DELETES},
+        "events": len(events),
+        "users": len(users),
+        "limited_users": len(limited_users),
+        "decisions": summary,
+        "trace_seconds": round(span, 3),
+        "wall_seconds": round(wall, 3),
+        "speedup": round(span / wall, 1) if wall else 0.0,
+        "cost_us": {"mean": round(sum(costs) / len(costs) * 1e6, 1) if costs else 0.0,
+                    "p50": round(pct(costs, 0.5) * 1e6, 1), "p99": round(pct(costs, 0.99) * 1e6, 1),
+                    "max": round(max(costs, default=0.0) * 1e6, 1)},
+        "time_to_first_limit_s": {"p50": round(pct(time_to_limit, 0.5), 2),
+                                  "max": round(max(time_to_limit, default=0.0), 2)},
+        "discord_api_calls": counters,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("trace", help="JSONL / JSONL.gz の trace")
+    ap.add_argument("--synthesize", action="store_true", help="trace のパスへ合成の荒らしを書いてから再生")
+    ap.add_argument("--algorithm", choices=("sliding", "token_bucket"), help="RATE_LIMIT_ALGORITHM を上書き")
+    ap.add_argument("--backend", choices=("memory", "sqlite"), help="RATE_STATE_BACKEND を上書き")
+    ap.add_argument("--posts-per-window", type=int, default=0)
+    ap.add_argument("--window", type=float, default=0)
+    ap.add_argument("--violation-window", type=float, default=0)
+    ap.add_argument("--kick-after", type=int, default=0)
+    ap.add_argument("--ban-after", type=int, default=0)
+    ap.add_argument("--discord-latency", type=float, default=0.0, help="Discord API 1回の所要秒数（実時間）")
+    ap.add_argument("--decisions", help="イベント毎の判定とコストを書き出す JSONL")
+    ap.add_argument("--out", default=str(ROOT / "data" / "bench"), help="結果 JSON の保存先ディレクトリ")
+    args = ap.parse_args()
+
+    if args.synthesize:
+        synthesize(args.trace)
+    result = asyncio.run(replay(args))
+    d, c = result["decisions"], result["cost_us"]
+    print(f"rev={result['revision']}  {result['events']} events / {result['users']} users, "
+          f"{result['trace_seconds']}s of traffic in {result['wall_seconds']}s (×{result['speedup']})")
+    print(f"limiter: {result['limiter']}")
+    print(f"decisions: ok={d['ok']} limited={d['limited']} kick={d['kick']} ban={d['ban']} "
+          f"skipped_after_ban={d['skipped_banned']} | limited users={result['limited_users']} "
+          f"first limit after p50={result['time_to_first_limit_s']['p50']}s")
+    if d["recorded_limited"] or d["mismatch_vs_recorded"]:
+        print(f"vs recorded: recorded_limited={d['recorded_limited']} mismatches={d['mismatch_vs_recorded']}")
+    print(f"cost per event: mean={c['mean']}us p50={c['p50']}us p99={c['p99']}us max={c['max']}us")
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    path = out_dir / f"replay-{datetime.datetime.now():%Y%m%d-%H%M%S}-{result['revision']}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"saved: {path}")
+
+if __name__ == "__main__":
+    main()
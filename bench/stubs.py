@@ -0,0 +1,268 @@
+# stubs.py
+"""ベンチ用のスタブ: Discord のメッセージ/チャンネル/ギルドもどきと、ローカルの Ollama・Web サーバー"""
+from __future__ import annotations
+import asyncio
+import contextvars
+import datetime
+import itertools
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+# on_message 1件分の計測記録（返信の送信時刻をここへ書く。gather の子タスクにも引き継がれる）
+CURRENT: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("bench_current", default=None)
+
+_ids = itertools.count(10**17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+# ===== Discord もどき =====
+class FakeUser:
+    def __init__(self, uid: int, name: str, bot: bool = False) -> None:
+        self.id = uid
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{uid}>"
+        self.kicked = False
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def kick(self, reason: str = "") -> None:
+        self.kicked = True
+
+
+class FakeSent:
+    """Bot が送ったメッセージ（edit / delete の回数だけ数える）"""
+
+    def __init__(self, channel: "FakeChannel", content: str) -> None:
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str) -> None:
+        await self.channel.api_call("edit")
+        self.content = content
+        self.channel.note_output()
+
+    async def delete(self) -> None:
+        await self.channel.api_call("delete")
+
+
+class _Perms:
+    """全部許可（チャンネルの閲覧権限チェック用）"""
+    read_message_history = True
+    manage_threads = True
+
+
+class _Typing:
+    async def __aenter__(self) -> None:
+        return None
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", name: str, api_latency: float, counters: Dict[str, int],
+                 cid: Optional[int] = None) -> None:
+        self.id = next_id() if cid is None else cid
+        self.name = name
+        self.guild = guild
+        self.position = 0
+        self.api_latency = api_latency
+        self.counters = counters
+
+    async def api_call(self, kind: str) -> None:
+        self.counters[kind] = self.counters.get(kind, 0) + 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    def note_output(self) -> None:
+        rec = CURRENT.get()
+        if rec is not None and rec.get("first_output") is None:
+            rec["first_output"] = time.perf_counter()
+
+    async def send(self, content: str = "") -> FakeSent:
+        await self.api_call("send")
+        self.note_output()
+        return FakeSent(self, content)
+
+    async def delete_messages(self, messages: List[Any]) -> None:
+        await self.api_call("bulk_delete")
+
+    def typing(self) -> _Typing:
+        return _Typing()
+
+    def permissions_for(self, obj: Any) -> _Perms:
+        return _Perms()
+
+
+class FakeGuild:
+    def __init__(self, gid: int, name: str, me: FakeUser, channels: int, api_latency: float,
+                 counters: Dict[str, int]) -> None:
+        self.id = gid
+        self.name = name
+        self.me = me
+        self.members: Dict[int, FakeUser] = {}
+        self.text_channels = [FakeChannel(self, "bot", api_latency, counters)]
+        self.text_channels += [FakeChannel(self, f"general-{i}", api_latency, counters) for i in range(channels)]
+        self.counters = counters
+        self.api_latency = api_latency
+        self.banned: set = set()
+        self.threads: List[Any] = []
+        self.default_role = FakeUser(gid, "@everyone")
+        self._by_id = {c.id: c for c in self.text_channels}
+
+    def add_channel(self, cid: int) -> FakeChannel:
+        ch = FakeChannel(self, f"ch-{cid}", self.api_latency, self.counters, cid)
+        self.text_channels.append(ch)
+        self._by_id[cid] = ch
+        return ch
+
+    @property
+    def channels(self) -> List[FakeChannel]:
+        return self.text_channels
+
+    @property
+    def chat_channels(self) -> List[FakeChannel]:
+        return self.text_channels[1:]
+
+    def get_channel(self, cid: int) -> Optional[FakeChannel]:
+        return self._by_id.get(cid)
+
+    def get_member(self, uid: int) -> Optional[FakeUser]:
+        return self.members.get(uid)
+
+    async def ban(self, user: Any, reason: str = "", delete_message_seconds: int = 0) -> None:
+        self.counters["ban"] = self.counters.get("ban", 0) + 1
+        self.banned.add(user.id)
+
+
+class FakeMessage:
+    def __init__(self, author: FakeUser, channel: FakeChannel, content: str,
+                 created_at: Optional[datetime.datetime] = None) -> None:
+        self.id = next_id()
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.created_at = created_at or datetime.datetime.now(datetime.timezone.utc)
+        self.attachments: List[Any] = []
+        self.mentions: List[Any] = []
+
+    async def delete(self) -> None:
+        await self.channel.api_call("delete")
+
+
+# ===== ローカルの Ollama もどき =====
+class StubOllama:
+    """/api/generate（ストリーム/一括）・/api/embed・/api/version・/api/ps に答える。
+    prefill 秒 + トークン毎に token_latency 秒かかり、同時に parallel 件までしか処理しない"""
+
+    def __init__(self, model: str, tokens: int = 40, token_latency: float = 0.01,
+                 prefill: float = 0.05, parallel: int = 1, embed_dim: int = 64) -> None:
+        self.model = model
+        self.tokens = tokens
+        self.token_latency = token_latency
+        self.prefill = prefill
+        self.embed_dim = embed_dim
+        self.parallel = parallel
+        self.requests = 0
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def _generate(self, req: web.Request) -> web.StreamResponse:
+        body = await req.json()
+        if not body.get("prompt"):         # keep_alive 付きの空生成（事前読み込み）
+            return web.json_response({"response": "", "done": True})
+        self.requests += 1
+        async with self._sem:
+            await asyncio.sleep(self.prefill)
+            if not body.get("stream"):
+                await asyncio.sleep(self.token_latency * self.tokens)
+                return web.json_response({"response": "要約 " * self.tokens, "done": True})
+            res = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await res.prepare(req)
+            for _ in range(self.tokens):
+                await asyncio.sleep(self.token_latency)
+                await res.write(b'{"response":"\\u8981\\u7d04 ","done":false}\n')
+            await res.write(b'{"response":"","done":true}\n')
+            return res
+
+    async def _embed(self, req: web.Request) -> web.Response:
+        body = await req.json()
+        inputs = body.get("input") or []
+        return web.json_response({"embeddings": [[(hash(t) >> i & 0xFF) / 255 for i in range(self.embed_dim)]
+                                                 for t in inputs]})
+
+    async def _version(self, req: web.Request) -> web.Response:
+        return web.json_response({"version": "bench-stub"})
+
+    async def _ps(self, req: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": self.model}]})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._sem = asyncio.Semaphore(self.parallel)
+        app = web.Application()
+        app.router.add_post("/api/generate", self._generate)
+        app.router.add_post("/api/embed", self._embed)
+        app.router.add_get("/api/version", self._version)
+        app.router.add_get("/api/ps", self._ps)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# ===== ローカルの Web ページ =====
+class StubPages:
+    """/page/<n> で page_kb KB 程度の記事 HTML を返す（ETag 付き、If-None-Match なら 304）"""
+
+    def __init__(self, page_kb: int = 20, latency: float = 0.02) -> None:
+        self.page_kb = page_kb
+        self.latency = latency
+        self.requests = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    def _html(self, n: str) -> str:
+        para = f"<p>これはページ {n} の本文です。負荷試験用の文章が続きます。Lorem ipsum dolor sit amet.</p>\n"
+        body = para * max(1, self.page_kb * 1024 // len(para.encode("utf-8")))
+        return (f"<html><head><title>page {n}</title></head><body><nav>menu</nav>"
+                f"<article><h1>page {n}</h1>{body}</article><footer>footer</footer></body></html>")
+
+    async def _page(self, req: web.Request) -> web.Response:
+        self.requests += 1
+        n = req.match_info["n"]
+        etag = f'"p{n}"'
+        await asyncio.sleep(self.latency)
+        if req.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=self._html(n), content_type="text/html", headers={"ETag": etag})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        app = web.Application()
+        app.router.add_get("/page/{n}", self._page)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
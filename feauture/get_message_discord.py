@@ -1,62 +1,224 @@
+"""チャンネルの保存・全文検索（/getch /archive /search）。
+
+config/config.yaml の features.enabled に archive を書くと、Bot 本体（konnichiwaDbot.py）が
+起動時に discord.py の extension として読み込む（同じログイン・同じ gateway 接続で動く）。
+このファイルを直接実行した場合も、本体を archive だけ有効にして起動する。
+"""
 import discord
 from discord import app_commands
 from discord.ext import commands
+import asyncio
 import os
-import re
-from datetime import datetime
-
-TOKEN = "YOUR_BOT_TOKEN"
-SAVE_DIR = "./downloads"
-
-intents = discord.Intents.default()
-intents.guilds = True
-intents.messages = True
-intents.message_content = True  # メッセージ本文取得に必須
-
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-def sanitize(name: str) -> str:
-    return re.sub(r'[\\/:*?"<>|]+', "_", name).strip()
-
-@bot.tree.command(name="getch", description="指定チャンネルのメッセージと画像URLを保存します")
-@app_commands.describe(channel_id="保存したいチャンネルのID")
-async def getch(interaction: discord.Interaction, channel_id: str):
-    await interaction.response.defer(thinking=True)
-    try:
-        channel = bot.get_channel(int(channel_id))
-        if channel is None:
-            await interaction.followup.send("⚠️ そのチャンネルにアクセスできません。")
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lib.config_loader import getenv_or_cfg
+from lib.exporter import ChannelExporter, sanitize
+from lib.archive import GuildArchiver
+from lib.attachments import AttachmentDownloader
+from lib.search_index import SearchIndex
+
+SAVE_DIR = getenv_or_cfg("ARCHIVE_DIR", "archive.save_dir", "./downloads")
+MAX_ATTACHMENT_BYTES = int(getenv_or_cfg("ARCHIVE_MAX_ATTACHMENT_BYTES", "archive.max_attachment_bytes",
+                                         25_000_000))  # 25MB（これより大きい添付は保存しない）
+
+
+def readable_channel_ids(guild: discord.Guild, member: discord.Member) -> set[int]:
+    """member が履歴を読めるチャンネル・スレッドの ID。
+
+    アーカイブ済みのスレッドはキャッシュに無いので含めない。非公開スレッドは
+    作成者かスレッド管理権限のある人だけ（参加者かどうかはキャッシュから分からないため）。
+    """
+    ids = set()
+    for ch in guild.channels:
+        if not isinstance(ch, discord.CategoryChannel) and ch.permissions_for(member).read_message_history:
+            ids.add(ch.id)
+    for th in guild.threads:
+        perms = th.permissions_for(member)
+        if perms.read_message_history and (not th.is_private() or perms.manage_threads or th.owner_id == member.id):
+            ids.add(th.id)
+    return ids
+
+
+class Archive(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.search_index = SearchIndex(os.path.join(SAVE_DIR, "search.db"))
+        self.synced = False
+
+    def cog_unload(self):
+        self.search_index.close()
+
+    async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if isinstance(error, (app_commands.MissingPermissions, app_commands.NoPrivateMessage)):
+            msg = "⚠️ このコマンドはサーバーの管理者だけが使えます。"
+            if interaction.response.is_done():
+                await interaction.followup.send(msg, ephemeral=True)
+            else:
+                await interaction.response.send_message(msg, ephemeral=True)
+            return
+        raise error
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # スラッシュコマンドの同期は最初の接続時だけ（再接続のたびには送らない）
+        if self.synced:
             return
+        try:
+            synced = await self.bot.tree.sync()
+            self.synced = True
+            print(f"Slash commands synced: {len(synced)}")
+        except Exception as e:
+            print(f"同期エラー: {e}")
 
-        os.makedirs(SAVE_DIR, exist_ok=True)
-        log_path = os.path.join(SAVE_DIR, f"{sanitize(channel.name)}_log.txt")
+    async def export_structured(self, interaction: discord.Interaction, channel, fmt: str, save_files: bool = False):
+        """JSONL（gzip 可）で前回の続きから書き出し、途中経過をメッセージ編集で知らせる"""
+        status = await interaction.followup.send(f"⏳ `{channel.name}` をエクスポート中…", wait=True)
+        downloader = AttachmentDownloader(SAVE_DIR, MAX_ATTACHMENT_BYTES) if save_files else None
 
-        with open(log_path, "w", encoding="utf-8") as f:
-            async for msg in channel.history(limit=None, oldest_first=True):
-                timestamp = msg.created_at.strftime("%Y-%m-%d %H:%M:%S")
-                f.write(f"[{timestamp}] {msg.author.display_name}: {msg.content}\n")
+        async def progress(count: int):
+            try:
+                await status.edit(content=f"⏳ `{channel.name}` をエクスポート中… {count} 件")
+            except discord.HTTPException:
+                pass
 
-                # 添付画像をURLで残す
-                for att in msg.attachments:
-                    if att.content_type and att.content_type.startswith("image/"):
-                        f.write(f"  📷 {att.url}\n")
+        try:
+            result = await ChannelExporter(SAVE_DIR, fmt, attachments=downloader).export(channel, progress)
+        finally:
+            if downloader:
+                await downloader.close()
+        indexed = await asyncio.to_thread(self.search_index.ingest_file, result.path)
+        resumed = f"（ID {result.resumed_from} の続きから）" if result.resumed_from else ""
+        files = f"\n添付: {downloader.stats()}" if downloader else ""
+        await status.edit(content=f"✅ {result.count} 件を追記しました{resumed}（検索索引に {indexed} 件追加）。"
+                                  f"\n保存先: `{result.path}`{files}")
 
-                f.write("\n")
+    @app_commands.command(name="getch", description="指定チャンネルのメッセージと画像URLを保存します")
+    @app_commands.describe(channel_id="保存したいチャンネルのID",
+                           format="txt: 全件を書き直し / jsonl・jsonl.gz: 前回の続きから追記",
+                           save_files="jsonl 形式のとき添付ファイルの実体も保存（同じ内容は1つだけ）")
+    @app_commands.choices(format=[
+        app_commands.Choice(name="txt", value="txt"),
+        app_commands.Choice(name="jsonl", value="jsonl"),
+        app_commands.Choice(name="jsonl.gz", value="jsonl.gz"),
+    ])
+    # 非公開チャンネルの履歴や添付もホストへ書き出すので管理者だけ（!ragindex と同じ）
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.checks.has_permissions(administrator=True)
+    async def getch(self, interaction: discord.Interaction, channel_id: str, format: str = "txt",
+                    save_files: bool = False):
+        await interaction.response.defer(thinking=True)
+        try:
+            channel = self.bot.get_channel(int(channel_id))
+            if channel is None or getattr(channel, "guild", None) != interaction.guild:
+                await interaction.followup.send("⚠️ そのチャンネルにアクセスできません。")
+                return
 
-        await interaction.followup.send(f"✅ ログを保存しました。\n保存先: `{log_path}`")
+            if format != "txt":
+                await self.export_structured(interaction, channel, format, save_files)
+                return
 
-    except Exception as e:
-        await interaction.followup.send(f"⚠️ エラーが発生しました:\n```{e}```")
+            os.makedirs(SAVE_DIR, exist_ok=True)
+            log_path = os.path.join(SAVE_DIR, f"{sanitize(channel.name)}_log.txt")
+
+            with open(log_path, "w", encoding="utf-8") as f:
+                async for msg in channel.history(limit=None, oldest_first=True):
+                    timestamp = msg.created_at.strftime("%Y-%m-%d %H:%M:%S")
+                    f.write(f"[{timestamp}] {msg.author.display_name}: {msg.content}\n")
+
+                    # 添付画像をURLで残す
+                    for att in msg.attachments:
+                        if att.content_type and att.content_type.startswith("image/"):
+                            f.write(f"  📷 {att.url}\n")
+
+                    f.write("\n")
+
+            await interaction.followup.send(f"✅ ログを保存しました。\n保存先: `{log_path}`")
+
+        except Exception as e:
+            await interaction.followup.send(f"⚠️ エラーが発生しました:\n```{e}```")
+
+    @app_commands.command(name="archive", description="サーバー内の全テキストチャンネルとスレッドを並行して保存します")
+    @app_commands.describe(concurrency="同時に取得するチャンネル数（既定3）",
+                           save_files="添付ファイルの実体も保存（同じ内容は1つだけ）")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.checks.has_permissions(administrator=True)
+    async def archive(self, interaction: discord.Interaction, concurrency: app_commands.Range[int, 1, 8] = 3,
+                      save_files: bool = False):
+        await interaction.response.defer(thinking=True)
+        guild = interaction.guild
+        if guild is None:
+            await interaction.followup.send("⚠️ サーバー内で実行してください。")
+            return
+        try:
+            downloader = AttachmentDownloader(SAVE_DIR, MAX_ATTACHMENT_BYTES) if save_files else None
+            archiver = GuildArchiver(SAVE_DIR, "jsonl.gz", concurrency, attachments=downloader)
+            tasks = await archiver.collect(guild)
+            status = await interaction.followup.send(f"⏳ {len(tasks)} チャンネル/スレッドを保存中…", wait=True)
+
+            async def progress(st: dict):
+                try:
+                    await status.edit(content=f"⏳ 保存中… 完了 {st['done']}/{st['total']}"
+                                              f"（実行中 {st['running']} / 失敗 {st['failed']}）{st['exported']} 件")
+                except discord.HTTPException:
+                    pass
+
+            try:
+                manifest_path = await archiver.run(guild, progress)
+            finally:
+                if downloader:
+                    await downloader.close()
+            indexed = await asyncio.to_thread(self.search_index.ingest_dir, os.path.dirname(manifest_path))
+            st = archiver.summary()
+            failed = "".join(f"\n・{t.channel.name}: {t.error}" for t in archiver.tasks if t.state == "failed")
+            await status.edit(content=(f"✅ {st['done']}/{st['total']} 件のチャンネルを保存（{st['exported']} メッセージ）"
+                                       f"\nマニフェスト: `{manifest_path}`\n検索索引に {indexed} 件追加" + (f"\n失敗:{failed}" if failed else ""))[:2000])
+        except Exception as e:
+            await interaction.followup.send(f"⚠️ エラーが発生しました:\n```{e}```")
+
+    @app_commands.command(name="search", description="保存済みのメッセージを全文検索します")
+    @app_commands.describe(query="検索語（空白区切りで AND）", channel="このチャンネルだけを検索",
+                           limit="表示件数（既定10）")
+    async def search(self, interaction: discord.Interaction, query: str,
+                     channel: discord.TextChannel | None = None,
+                     limit: app_commands.Range[int, 1, 25] = 10):
+        await interaction.response.defer(thinking=True)
+        guild = interaction.guild
+        if guild is None or not isinstance(interaction.user, discord.Member):
+            await interaction.followup.send("⚠️ サーバー内で実行してください。")
+            return
+        # 実行した人が読めないチャンネルの発言は出さない
+        allowed = readable_channel_ids(guild, interaction.user)
+        if channel is not None and channel.id not in allowed:
+            await interaction.followup.send("⚠️ そのチャンネルの履歴を読む権限がありません。")
+            return
+        try:
+            started = time.perf_counter()
+            hits = await asyncio.to_thread(
+                self.search_index.search, query,
+                guild.id, channel.id if channel else None, limit, allowed)
+            elapsed = (time.perf_counter() - started) * 1000
+            if not hits:
+                await interaction.followup.send(f"🔍 「{query}」に一致するメッセージはありません（{elapsed:.0f}ms）")
+                return
+            lines = [f"🔍 「{query}」 {len(hits)} 件（{elapsed:.0f}ms）"]
+            for h in hits:
+                snippet = h.snippet.replace("\n", " ")[:200]
+                lines.append(f"・{h.created_at[:16].replace('T', ' ')} {h.author}: {snippet}\n  {h.jump_url}")
+            await interaction.followup.send("\n".join(lines)[:2000])
+        except Exception as e:
+            await interaction.followup.send(f"⚠️ エラーが発生しました:\n```{e}```")
 
-@bot.event
-async def on_ready():
-    print(f"✅ ログイン完了: {bot.user}")
-    try:
-        synced = await bot.tree.sync()
-        print(f"Slash commands synced: {len(synced)}")
-    except Exception as e:
-        print(f"同期エラー: {e}")
 
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Archive(bot))
 
-bot.run(TOKEN)
 
+if __name__ == "__main__":
+    os.environ.setdefault("FEATURES", "archive")
+    import konnichiwaDbot
+    konnichiwaDbot.main()
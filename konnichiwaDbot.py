@@ -4,32 +4,83 @@
 import os
 import re
 import time
+BOOT_STARTED = time.perf_counter()            # 起動時間の計測用（重い import より前に記録）
 import asyncio
-import aiohttp
-from bs4 import BeautifulSoup
 import discord
 from discord.ext import commands
 import datetime
+from typing import Mapping
+
+from lib.ollama_client import OllamaError, OllamaConnectionError
+from lib.ollama_pool import OllamaPool, parse_backends
+from lib.discord_stream import StreamingReply
+from lib.scheduler import FairScheduler, QueueFull, JobCancelled
+from lib.config_loader import getenv_or_cfg, get_config
+from lib.summary_cache import SummaryCache, normalize_url, content_hash
+from lib.fetcher import UrlFetcher
+from lib.extract import ContentExtractor
+from lib.rate_state import make_rate_state
+from lib.log_sink import LogSink
+from lib.bulk_delete import BulkDeleter
+from lib.log_channels import LogChannelIndex
+from lib.retrieval import Retriever, HAS_NUMPY
+from lib.conversation import ConversationMemory
+from lib.longdoc import LongDocSummarizer
+from lib.llm_cache import LLMCache
+from lib.metrics import MetricsRegistry, MetricsServer
+from lib.traffic_trace import TraceRecorder
+from lib.plugins import FeatureLoader, parse_features
 
 # ===== Bot環境設定 =====
 TOKEN = os.getenv("DISCORD_BOT_AI")          # export DISCORD_BOT_AI="xxx"
 MODEL = "qwen2.5:0.5b-instruct"              # 軽量モデルを直書き
 OLLAMA_HOST = "127.0.0.1"
 OLLAMA_PORT = 11434
+STREAM_REPLIES = True                        # 生成途中のテキストを逐次編集で表示
+STREAM_EDIT_INTERVAL = 1.2                   # 編集間隔（秒）: Discord のレート制限対策
+
+CONFIG = get_config()
+
+# ===== 機能（すべて1つの Bot・1つの gateway 接続で動かす）=====
+# moderation / chat は本体に組み込み、それ以外（archive など）は起動時に extension として読み込む
+FEATURES = FeatureLoader(parse_features(getenv_or_cfg("FEATURES", "features.enabled", "moderation,chat")))
+MODERATION_ENABLED = FEATURES.enabled("moderation")
+CHAT_ENABLED = FEATURES.enabled("chat")
+# 連投制限とメンション応答を行うチャンネル（空なら全チャンネル。コマンドはどこでも使える）
+BOT_CHANNELS = {int(c) for c in parse_features(getenv_or_cfg("BOT_CHANNELS", "features.channels", None))}
 
 # ===== 連投制限（全チャンネル対象）=====
-POSTS_PER_WINDOW = 4      # 1分に許可する投稿数
-WINDOW_SECONDS = 10
-_user_window: dict[int, list[float]] = {}  # user_id -> [timestamps]
+# config.yaml を書き換えると再起動せずに反映される（下の _apply_live_config）
+POSTS_PER_WINDOW = int(getenv_or_cfg("POSTS_PER_WINDOW", "ratelimit.posts_per_window", 4))   # WINDOW_SECONDS 秒に許可する投稿数
+WINDOW_SECONDS = float(getenv_or_cfg("WINDOW_SECONDS", "ratelimit.window_seconds", 10))
+RATE_LIMIT_ALGORITHM = getenv_or_cfg("RATE_LIMIT_ALGORITHM", "ratelimit.algorithm", "sliding")  # sliding | token_bucket
+RATE_STATE_BACKEND = getenv_or_cfg("RATE_STATE_BACKEND", "ratelimit.backend", "memory")        # memory | sqlite（複数プロセスで共有）
 
 # ===== 違反のエスカレーション（Kick / Ban）=====
-VIOLATION_WINDOW  = 10 * 60   # 10分間の違反数で判定
-KICK_AFTER_DELETES = 3        # 10分で3回削除 → Kick
-BAN_AFTER_DELETES  = 6        # 10分で5回削除 → Ban
-_user_violations: dict[int, list[float]] = {}  # user_id -> [deleted_timestamps]
+VIOLATION_WINDOW  = float(getenv_or_cfg("VIOLATION_WINDOW", "moderation.violation_window", 10 * 60))  # 10分間の違反数で判定
+KICK_AFTER_DELETES = int(getenv_or_cfg("KICK_AFTER_DELETES", "moderation.kick_after", 3))   # 10分で3回削除 → Kick
+BAN_AFTER_DELETES  = int(getenv_or_cfg("BAN_AFTER_DELETES", "moderation.ban_after", 6))     # 10分で6回削除 → Ban
+ESCALATE = CONFIG.get_bool("moderation.escalate", True, "MODERATION_ESCALATE")  # false なら削除のみ
 
 # ===== ログ送信先（ギルドごとに“bot”系チャンネルを自動検出）=====
-_guild_log_channel: dict[int, int] = {}   # guild_id -> channel_id
+# 起動時に索引を作り、以降はチャンネルの作成/更新/削除イベントで更新する
+LOG_CHANNELS = LogChannelIndex(getenv_or_cfg("LOG_CHANNEL_NAME", "discord.channels.bot", "bot"))
+
+# ===== メトリクス（各段の所要時間・件数。GET /metrics で Prometheus 形式）=====
+METRICS = MetricsRegistry(prefix="discollama_")
+STAGE_SECONDS = METRICS.histogram(
+    "stage_seconds", "Latency of each reply pipeline stage "
+    "(fetch, extract, queue_wait, first_token, generate, discord_send, reply, ratelimit)", ("stage",))
+STAGE_ERRORS = METRICS.counter("stage_errors_total", "Failures per pipeline stage", ("stage",))
+MESSAGES = METRICS.counter("messages_total", "Messages seen by on_message", ("kind",))
+MODERATION_ACTIONS = METRICS.counter("moderation_actions_total",
+                                     "Anti-spam actions (delete / violation / kick / ban)", ("action", "result"))
+METRICS_ENABLED = CONFIG.get_bool("metrics.enabled", True, "METRICS_ENABLED")
+METRICS_SERVER = MetricsServer(
+    METRICS,
+    host=getenv_or_cfg("METRICS_HOST", "metrics.host", "127.0.0.1"),
+    port=int(getenv_or_cfg("METRICS_PORT", "metrics.port", 9464)),
+)
 
 # URL抽出用
 URL_RE = re.compile(r"https?://\S+")
@@ -39,85 +90,285 @@ intents = discord.Intents.none()
 intents.guilds = True
 intents.messages = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
 
-# ===== Ollama 起動確認 =====
-async def _http_ready_check(host, port, path="/api/version") -> bool:
-    try:
-        reader, writer = await asyncio.open_connection(host, port)
-        req = f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n"
-        writer.write(req.encode()); await writer.drain()
-        data = await reader.read(4096)
-        writer.close(); await writer.wait_closed()
-        return b"version" in data.lower()
-    except Exception:
-        return False
-
-async def ensure_ollama_serve(timeout_sec=20):
-    if await _http_ready_check(OLLAMA_HOST, OLLAMA_PORT):
-        print("✅ ollama serve already running"); return
-    print("🚀 starting ollama serve…")
-    import subprocess, os as _os
-    subprocess.Popen(
-        ["nohup", "ollama", "serve"],
-        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-        preexec_fn=_os.setpgrp
-    )
-    for i in range(timeout_sec):
-        await asyncio.sleep(1)
-        if await _http_ready_check(OLLAMA_HOST, OLLAMA_PORT):
-            print(f"✅ ollama ready ({i+1}s)"); return
-    print("⚠️ ollama not responding, continuing…")
+class DiscollamaBot(commands.Bot):
+    async def setup_hook(self):
+        # ログイン後・gateway 接続前に1回だけ呼ばれる
+        await FEATURES.load_all(self)
+        if RETRIEVER:
+            # numpy と保存済み索引の読み込みは接続と並行してスレッドで済ませる
+            self.retriever_warm = asyncio.create_task(RETRIEVER.warm())
+
+    async def close(self):
+        CONFIG.stop_watching()
+        await METRICS_SERVER.stop()
+        await LOG_SINK.close()
+        await OLLAMA.close()
+        await FETCHER.close()
+        EXTRACTOR.close()
+        SUMMARY_CACHE.close()
+        RATE_STATE.close()
+        if TRACE:
+            TRACE.close()
+        if RETRIEVER:
+            await RETRIEVER.close()
+        await MEMORY.close()
+        await super().close()
+
+bot = DiscollamaBot(command_prefix="!", intents=intents)
 
 # ===== URL本文取得（サイズ/リダイレクト制限付き）=====
 MAX_BYTES = 2_000_000  # 2MB
 MAX_REDIRECTS = 3
 
-async def fetch_url_text(url: str, maxlen: int = 4000) -> str:
+FETCHER = UrlFetcher(   # 共有セッション（接続再利用・DNSキャッシュ・同時取得数上限）
+    max_bytes=MAX_BYTES, max_redirects=MAX_REDIRECTS,
+    concurrency=int(getenv_or_cfg("FETCH_CONCURRENCY", "fetch.concurrency", 8)),
+    limit_per_host=int(getenv_or_cfg("FETCH_LIMIT_PER_HOST", "fetch.limit_per_host", 2)),
+)
+
+async def fetch_url_page(url: str, headers: dict | None = None) -> tuple[int, str, Mapping[str, str]]:
+    """(status, html, response headers) を返す。304 のときは html が空"""
+    try:
+        with STAGE_SECONDS.time("fetch"):
+            res = await FETCHER.fetch(url, headers)
+    except Exception:
+        STAGE_ERRORS.inc("fetch")
+        raise
+    return res.status, res.text(), res.headers
+
+EXTRACTOR = ContentExtractor(   # 本文抽出はイベントループ外で実行
+    backend=getenv_or_cfg("EXTRACT_BACKEND", "extract.backend", "auto"),
+    executor=getenv_or_cfg("EXTRACT_EXECUTOR", "extract.executor", "thread"),
+    workers=int(getenv_or_cfg("EXTRACT_WORKERS", "extract.workers", 2)),
+)
+
+async def html_to_text(html: str, maxlen: int = 4000) -> str:
+    with STAGE_SECONDS.time("extract"):
+        return await EXTRACTOR.extract(html, maxlen)
+
+# ===== URL要約キャッシュ（TTL + 条件付きGET + SQLite 永続化）=====
+SUMMARY_CACHE = SummaryCache(
+    path=getenv_or_cfg("SUMMARY_CACHE_DB", "cache.summary_db", "data/summary_cache.sqlite3"),
+    ttl=float(getenv_or_cfg("SUMMARY_CACHE_TTL", "cache.summary_ttl", 24 * 3600)),
+    max_entries=int(getenv_or_cfg("SUMMARY_CACHE_MAX", "cache.summary_max_entries", 1000)),
+)
+
+LONGDOC_MAX_CHARS = int(getenv_or_cfg("LONGDOC_MAX_CHARS", "longdoc.max_chars", 60000))  # 要約対象にする本文の上限
+MAX_URLS_PER_MESSAGE = int(getenv_or_cfg("MAX_URLS_PER_MESSAGE", "fetch.max_urls_per_message", 5))
+
+async def prepare_url_summary(url: str) -> tuple[str | None, str, dict | None]:
+    """キャッシュ命中なら (要約, "", None)、未命中なら (None, 本文, 保存用メタ)"""
+    key = normalize_url(url)
+    entry = SUMMARY_CACHE.get(key)
+    if entry and SUMMARY_CACHE.is_fresh(entry):
+        SUMMARY_CACHE.hits += 1
+        return entry.summary, "", None
+
+    headers = {}
+    if entry and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
     try:
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
-            async with session.get(url, timeout=15, max_redirects=MAX_REDIRECTS) as res:
-                total = 0; chunks = []
-                async for chunk, _ in res.content.iter_chunks():
-                    if not chunk: continue
-                    total += len(chunk)
-                    if total > MAX_BYTES:
-                        chunks.append("cut big size...".encode("utf-8")); break
-                    chunks.append(chunk)
-                html = b"".join(chunks).decode(errors="ignore")
+        status, html, res_headers = await fetch_url_page(url, headers)
     except Exception as e:
-        return f"（URL取得失敗: {e}）"
-    soup = BeautifulSoup(html, "html.parser")
-    text = " ".join(soup.stripped_strings)
-    return text[:maxlen] + " ...（省略）" if len(text) > maxlen else text
-
-# ===== Ollama 実行（30分タイムアウト・同時1本）=====
-OLLAMA_SEMAPHORE = asyncio.Semaphore(1)
-
-async def run_ollama(prompt: str, timeout: int = 1800) -> str:
-    async with OLLAMA_SEMAPHORE:
-        cmd = ["ollama", "run", MODEL]
+        return None, f"（URL取得失敗: {e}）", None
+    etag, last_modified = res_headers.get("ETag"), res_headers.get("Last-Modified")
+    if status == 304 and entry:
+        SUMMARY_CACHE.touch(entry, etag, last_modified)
+        SUMMARY_CACHE.hits += 1
+        return entry.summary, "", None
+
+    page_text = await html_to_text(html, LONGDOC_MAX_CHARS)
+    digest = content_hash(page_text)
+    summary = entry.summary if entry and entry.content_hash == digest else SUMMARY_CACHE.get_by_hash(digest)
+    if summary is not None:
+        # 本文が変わっていなければ LLM を呼ばずに再利用
+        SUMMARY_CACHE.put(key, summary, digest, etag, last_modified)
+        SUMMARY_CACHE.hits += 1
+        return summary, "", None
+    SUMMARY_CACHE.misses += 1
+    meta = {"url": key, "digest": digest, "etag": etag, "last_modified": last_modified}
+    return None, page_text, meta
+
+def _is_cacheable(reply: str) -> bool:
+    return bool(reply) and reply != "(出力なし)" and not any(m in reply for m in ("❌", "⌛", "🚦"))
+
+# ===== Ollama 実行（30分タイムアウト・ギルド/ユーザー間で公平に順番待ち）=====
+OLLAMA_SCHEDULER = FairScheduler(
+    concurrency=int(getenv_or_cfg("OLLAMA_CONCURRENCY", "ollama.concurrency", 1)),
+    max_queue=int(getenv_or_cfg("OLLAMA_MAX_QUEUE", "ollama.max_queue", 50)),
+    max_per_user=int(getenv_or_cfg("OLLAMA_MAX_PER_USER", "ollama.max_per_user", 3)),
+)
+BUSY_REPLY = "🚦 混雑しています。しばらくしてからもう一度お試しください。"
+# 設定の backends へ振り分け（空なら OLLAMA_HOST:OLLAMA_PORT の1台。keep-alive 接続を使い回す）
+OLLAMA = OllamaPool(
+    parse_backends(getenv_or_cfg("OLLAMA_BACKENDS", "ollama.backends", None), OLLAMA_HOST, OLLAMA_PORT,
+                   breaker_threshold=int(getenv_or_cfg("OLLAMA_BREAKER_THRESHOLD", "ollama.breaker_threshold", 3)),
+                   breaker_cooldown=float(getenv_or_cfg("OLLAMA_BREAKER_COOLDOWN", "ollama.breaker_cooldown", 30))),
+    max_attempts=int(getenv_or_cfg("OLLAMA_MAX_ATTEMPTS", "ollama.max_attempts", 3)),
+)
+OLLAMA_KEEP_ALIVE = str(getenv_or_cfg("OLLAMA_KEEP_ALIVE", "ollama.keep_alive", "30m"))  # モデルをメモリに留める時間
+OLLAMA_DOWN_REPLY = "❌ Ollama サーバーが応答していません（再起動中）。しばらくしてからお試しください。"
+
+# 各台の死活監視・MODEL の事前読み込み（落ちたら再起動するのはローカルの台だけ）
+SUPERVISORS = OLLAMA.supervise(
+    MODEL,
+    interval=float(getenv_or_cfg("OLLAMA_HEALTH_INTERVAL", "ollama.health_interval", 15)),
+    keep_alive=OLLAMA_KEEP_ALIVE,
+    autostart=CONFIG.get_bool("ollama.autostart", True, "OLLAMA_AUTOSTART"),
+)
+
+async def _run_ollama_cli(prompt: str, timeout: int) -> str:
+    """HTTP API に繋がらないときのフォールバック（`ollama run` をサブプロセス起動）"""
+    cmd = ["ollama", "run", MODEL]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return "❌ `ollama` が見つかりません。"
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            proc.communicate(prompt.encode()), timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        return "⌛ Ollama 実行が30分超過しタイムアウトしました。"
+    out = (stdout or b"").decode(errors="ignore").strip()
+    err = (stderr or b"").decode(errors="ignore").strip()
+    if proc.returncode != 0:
+        return f"❌ Ollama エラー:\n```\n{err or out}\n```"
+    return out or "(出力なし)"
+
+async def _generate(prompt: str, timeout: int, options: dict | None) -> str:
+    try:
+        out = await OLLAMA.generate(MODEL, prompt, options=options, keep_alive=OLLAMA_KEEP_ALIVE, timeout=timeout)
+    except OllamaConnectionError as e:
+        STAGE_ERRORS.inc("generate")
+        print(f"(ollama HTTP unavailable, fallback to CLI): {e}")
+        return await _run_ollama_cli(prompt, timeout)
+    except asyncio.TimeoutError:
+        STAGE_ERRORS.inc("generate")
+        return "⌛ Ollama 実行が30分超過しタイムアウトしました。"
+    except OllamaError as e:
+        STAGE_ERRORS.inc("generate")
+        return f"❌ Ollama エラー:\n```\n{e}\n```"
+    return out.strip() or "(出力なし)"
+
+# 同じ (MODEL, プロンプト, options) の生成は1本にまとめ、直近の結果は使い回す
+LLM_CACHE = LLMCache(
+    max_entries=int(getenv_or_cfg("LLM_CACHE_MAX", "llm_cache.max_entries", 256)),
+    ttl=float(getenv_or_cfg("LLM_CACHE_TTL", "llm_cache.ttl", 600)),
+    is_ok=_is_cacheable,
+)
+
+async def run_ollama(prompt: str, timeout: int = 1800, options: dict | None = None, *,
+                     guild_id: int = 0, user_id: int = 0, job_id=None, on_position=None) -> str:
+    """スケジューラの順番を待ってから生成（取り消し時は JobCancelled）"""
+    if not OLLAMA.serving(MODEL):
+        return OLLAMA_DOWN_REPLY
+
+    async def produce():
+        queued = time.perf_counter()
         try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-        except FileNotFoundError:
-            return "❌ `ollama` が見つかりません。"
+            async with OLLAMA_SCHEDULER.slot(guild_id, user_id, job_id=job_id, on_position=on_position):
+                STAGE_SECONDS.observe(time.perf_counter() - queued, "queue_wait")
+                with STAGE_SECONDS.time("generate"):
+                    out = await _generate(prompt, timeout, options)
+                yield out
+        except QueueFull:
+            STAGE_ERRORS.inc("queue_wait")
+            yield BUSY_REPLY
+
+    return await LLM_CACHE.run(LLMCache.key(MODEL, prompt, options), produce, job_id)
+
+async def _generate_stream(prompt: str, timeout: int, options: dict | None):
+    started = False
+    t0 = time.perf_counter()
+    try:
+        async for chunk in OLLAMA.generate_stream(MODEL, prompt, options=options,
+                                                  keep_alive=OLLAMA_KEEP_ALIVE, timeout=timeout):
+            if not started:
+                STAGE_SECONDS.observe(time.perf_counter() - t0, "first_token")
+            started = True
+            yield chunk
+    except OllamaConnectionError as e:
+        STAGE_ERRORS.inc("generate")
+        if started:
+            yield f"\n❌ Ollama 接続が切断されました: {e}"
+            return
+        print(f"(ollama HTTP unavailable, fallback to CLI): {e}")
+        yield await _run_ollama_cli(prompt, timeout)
+    except asyncio.TimeoutError:
+        STAGE_ERRORS.inc("generate")
+        yield "\n⌛ Ollama 実行が30分超過しタイムアウトしました。"
+    except OllamaError as e:
+        STAGE_ERRORS.inc("generate")
+        yield f"❌ Ollama エラー:\n```\n{e}\n```"
+
+async def stream_ollama(prompt: str, timeout: int = 1800, options: dict | None = None, *,
+                        guild_id: int = 0, user_id: int = 0, job_id=None, on_position=None):
+    """run_ollama のストリーミング版（トークンを届いた順に yield）"""
+    if not OLLAMA.serving(MODEL):
+        yield OLLAMA_DOWN_REPLY
+        return
+
+    async def produce():
+        queued = time.perf_counter()
         try:
-            stdout, stderr = await asyncio.wait_for(
-                proc.communicate(prompt.encode()), timeout=timeout
-            )
-        except asyncio.TimeoutError:
-            proc.kill()
-            return "⌛ Ollama 実行が30分超過しタイムアウトしました。"
-        out = (stdout or b"").decode(errors="ignore").strip()
-        err = (stderr or b"").decode(errors="ignore").strip()
-        if proc.returncode != 0:
-            return f"❌ Ollama エラー:\n```\n{err or out}\n```"
-        return out or "(出力なし)"
+            async with OLLAMA_SCHEDULER.slot(guild_id, user_id, job_id=job_id, on_position=on_position):
+                STAGE_SECONDS.observe(time.perf_counter() - queued, "queue_wait")
+                with STAGE_SECONDS.time("generate"):
+                    async for chunk in _generate_stream(prompt, timeout, options):
+                        yield chunk
+        except QueueFull:
+            STAGE_ERRORS.inc("queue_wait")
+            yield BUSY_REPLY
+
+    async for chunk in LLM_CACHE.stream(LLMCache.key(MODEL, prompt, options), produce, job_id):
+        yield chunk
+
+# ===== 過去ログ検索（埋め込み + NumPy 索引。numpy が無ければ無効）=====
+RETRIEVAL_ENABLED = CONFIG.get_bool("retrieval.enabled", True, "RETRIEVAL_ENABLED")
+RETRIEVER = Retriever(
+    OLLAMA,
+    getenv_or_cfg("EMBED_MODEL", "retrieval.embed_model", "nomic-embed-text"),
+    getenv_or_cfg("RETRIEVAL_INDEX", "retrieval.index_path", "data/retrieval"),
+    k=int(getenv_or_cfg("RETRIEVAL_TOP_K", "retrieval.top_k", 4)),
+    min_score=float(getenv_or_cfg("RETRIEVAL_MIN_SCORE", "retrieval.min_score", 0.35)),
+    batch_size=int(getenv_or_cfg("EMBED_BATCH", "retrieval.batch_size", 32)),
+) if CHAT_ENABLED and RETRIEVAL_ENABLED and HAS_NUMPY else None
+EXPORT_DIR = getenv_or_cfg("EXPORT_DIR", "retrieval.export_dir", "./downloads")   # getch/archive の保存先
+
+# ===== チャンネル毎の会話履歴（MODEL のコンテキスト長に収まる範囲で添える）=====
+MODEL_NUM_CTX = int(getenv_or_cfg("MODEL_NUM_CTX", "memory.num_ctx", 2048))       # Ollama 既定のコンテキスト長
+REPLY_RESERVE = int(getenv_or_cfg("MEMORY_REPLY_RESERVE", "memory.reply_reserve", 512))  # 返答用に空けておく分
+
+async def _summarize_history(key: tuple, prompt: str) -> str | None:
+    """古い会話の要約（通常の質問と同じ順番待ちに並ぶ）"""
+    reply = await run_ollama(prompt, guild_id=key[0], user_id=0)
+    return reply if _is_cacheable(reply) else None
+
+MEMORY = ConversationMemory(
+    _summarize_history,
+    budget=MODEL_NUM_CTX - REPLY_RESERVE,
+    keep_recent=int(getenv_or_cfg("MEMORY_KEEP_RECENT", "memory.keep_recent", 4)),
+    summary_tokens=int(getenv_or_cfg("MEMORY_SUMMARY_TOKENS", "memory.summary_tokens", 300)),
+    idle_ttl=float(getenv_or_cfg("MEMORY_IDLE_TTL", "memory.idle_ttl", 1800)),
+)
+
+# ===== 長文ページの分割要約（map-reduce・断片ごとに要約キャッシュ）=====
+LONGDOC = LongDocSummarizer(
+    SUMMARY_CACHE,
+    max_tokens=MODEL_NUM_CTX - REPLY_RESERVE - 200,     # 指示文の分を空けて1区間が文脈長に収まるように
+    max_chunks=int(getenv_or_cfg("LONGDOC_MAX_CHUNKS", "longdoc.max_chunks", 24)),
+    is_ok=_is_cacheable,
+)
 
 # ===== ユーティリティ =====
 def extract_after_mention(message: discord.Message) -> str:
@@ -127,50 +378,80 @@ def extract_after_mention(message: discord.Message) -> str:
 def _now() -> float:
     return time.time()
 
-def _prune(bucket: list[float], window: int):
-    now = _now()
-    while bucket and now - bucket[0] > window:
-        bucket.pop(0)
-
 def _short(s: str, n: int = 100) -> str:
     return s if len(s) <= n else s[:n] + "..."
 
+def _find_log_channel(guild: discord.Guild) -> discord.TextChannel | None:
+    return LOG_CHANNELS.get(guild)
+
+async def _deliver_log(guild_id: int, text: str):
+    """LOG_SINK がまとめたログを実際に送信する"""
+    guild = bot.get_guild(guild_id)
+    channel = _find_log_channel(guild) if guild else None
+    if channel is None:
+        print(f"(no bot-channel in {guild.name if guild else guild_id})\n{text}"); return
+    try:
+        await channel.send(text)
+    except Exception as e:
+        print(f"(log send failed in {guild.name}): {e}\n{text}")
+
+# ギルド毎にためて 2000 文字以内にまとめて送る（荒らし時の API 消費を抑える）
+LOG_SINK = LogSink(
+    _deliver_log,
+    interval=float(getenv_or_cfg("LOG_FLUSH_INTERVAL", "log_sink.flush_interval", 2.0)),
+    flush_chars=int(getenv_or_cfg("LOG_FLUSH_CHARS", "log_sink.flush_chars", 1500)),
+    max_pending=int(getenv_or_cfg("LOG_MAX_PENDING", "log_sink.max_pending", 200)),
+    concurrency=int(getenv_or_cfg("LOG_SEND_CONCURRENCY", "log_sink.concurrency", 4)),
+)
+
+LOG_TO_CHANNEL = CONFIG.get_bool("log_sink.enabled", True, "LOG_TO_CHANNEL")
+
 async def send_log(guild: discord.Guild, text: str):
-    """ギルド内の“bot”系テキストチャンネルへログ送信（見つからなければ標準出力のみ）"""
-    if not guild:
+    """ギルド内の“bot”系テキストチャンネルへログ送信（見つからない・無効なら標準出力のみ）"""
+    if not guild or not LOG_TO_CHANNEL:
         print(text); return
-    chan_id = _guild_log_channel.get(guild.id)
-    channel: discord.TextChannel | None = None
-    if chan_id:
-        channel = guild.get_channel(chan_id)
-    if channel is None:
-        # “bot”を含む名前のテキストチャンネルを探す（bot, bot-logs, bot_log 等）
-        candidates = []
-        for ch in guild.text_channels:
-            name = (ch.name or "").lower()
-            if "bot" in name:
-                candidates.append(ch)
-        # 名前が短い方が優先（"bot" > "bot-logs"）
-        candidates.sort(key=lambda c: len(c.name))
-        if candidates:
-            channel = candidates[0]
-            _guild_log_channel[guild.id] = channel.id
-    if channel:
-        try:
-            await channel.send(text)
-        except Exception as e:
-            print(f"(log send failed in {guild.name}): {e}\n{text}")
-    else:
-        print(f"(no bot-channel in {guild.name if guild else 'DM'})\n{text}")
+    if _find_log_channel(guild) is None:
+        print(f"(no bot-channel in {guild.name if guild else 'DM'})\n{text}"); return
+    LOG_SINK.submit(guild.id, text)
 
 # ===== 連投制限（全チャンネル）=====
+# 既定はプロセス内（固定長・放置ユーザーは自動破棄）、sqlite なら複数プロセスで共有
+RATE_STATE = make_rate_state(
+    RATE_STATE_BACKEND, POSTS_PER_WINDOW, WINDOW_SECONDS, VIOLATION_WINDOW,
+    algorithm=RATE_LIMIT_ALGORITHM,
+    path=getenv_or_cfg("RATE_STATE_DB", "ratelimit.sqlite_path", "data/ratelimit.sqlite3"),
+    clock=_now,
+)
+
 def is_rate_limited(user_id: int) -> bool:
-    bucket = _user_window.setdefault(user_id, [])
-    _prune(bucket, WINDOW_SECONDS)
-    if len(bucket) >= POSTS_PER_WINDOW:
-        return True
-    bucket.append(_now())
-    return False
+    return RATE_STATE.hit(user_id)
+
+# ===== 設定の即時反映（config.yaml の変更を watch して上書き。環境変数で与えた値はそのまま）=====
+def _apply_live_config(changes: dict):
+    global POSTS_PER_WINDOW, WINDOW_SECONDS, VIOLATION_WINDOW, KICK_AFTER_DELETES, BAN_AFTER_DELETES, ESCALATE
+    POSTS_PER_WINDOW = int(getenv_or_cfg("POSTS_PER_WINDOW", "ratelimit.posts_per_window", 4))
+    WINDOW_SECONDS = float(getenv_or_cfg("WINDOW_SECONDS", "ratelimit.window_seconds", 10))
+    VIOLATION_WINDOW = float(getenv_or_cfg("VIOLATION_WINDOW", "moderation.violation_window", 10 * 60))
+    KICK_AFTER_DELETES = int(getenv_or_cfg("KICK_AFTER_DELETES", "moderation.kick_after", 3))
+    BAN_AFTER_DELETES = int(getenv_or_cfg("BAN_AFTER_DELETES", "moderation.ban_after", 6))
+    ESCALATE = CONFIG.get_bool("moderation.escalate", True, "MODERATION_ESCALATE")
+    RATE_STATE.reconfigure(POSTS_PER_WINDOW, WINDOW_SECONDS, VIOLATION_WINDOW)
+    OLLAMA_SCHEDULER.reconfigure(
+        int(getenv_or_cfg("OLLAMA_CONCURRENCY", "ollama.concurrency", 1)),
+        int(getenv_or_cfg("OLLAMA_MAX_QUEUE", "ollama.max_queue", 50)),
+        int(getenv_or_cfg("OLLAMA_MAX_PER_USER", "ollama.max_per_user", 3)),
+    )
+    print(f"(config) applied: {', '.join(f'{k}={new!r}' for k, (_, new) in changes.items())}")
+
+CONFIG.subscribe(("ratelimit", "moderation", "ollama"), _apply_live_config)
+CONFIG_RELOAD_INTERVAL = float(getenv_or_cfg("CONFIG_RELOAD_INTERVAL", "config.reload_interval", 5))
+
+# 受信イベントと連投判定を JSONL に残す（bench/replay_moderation.py で再生して制限値の調整に使う）
+TRACE_ENABLED = CONFIG.get_bool("trace.enabled", False, "TRACE_ENABLED")
+TRACE = TraceRecorder(
+    getenv_or_cfg("TRACE_PATH", "trace.path", "data/traces/messages.jsonl.gz"),
+    max_bytes=int(float(getenv_or_cfg("TRACE_MAX_MB", "trace.max_mb", 200)) * 2**20),
+) if TRACE_ENABLED else None
 
 # ===== 違反記録＆エスカレーション（残り回数も計算して通知）=====
 async def record_violation_and_escalate(message: discord.Message):
@@ -178,10 +459,8 @@ async def record_violation_and_escalate(message: discord.Message):
     guild = message.guild
     if not guild:
         return
-    vbucket = _user_violations.setdefault(user.id, [])
-    _prune(vbucket, VIOLATION_WINDOW)
-    vbucket.append(_now())
-    count = len(vbucket)
+    count = RATE_STATE.record_violation(user.id)
+    MODERATION_ACTIONS.inc("violation", "ok")
 
     remain_to_kick = max(0, KICK_AFTER_DELETES - count)
     remain_to_ban  = max(0, BAN_AFTER_DELETES  - count)
@@ -191,11 +470,14 @@ async def record_violation_and_escalate(message: discord.Message):
             f"Guild: {guild.name}\n"
             f"User: {user} (ID:{user.id})\n"
             f"Action: Message deleted (violation count: {count})\n"
-            f"Remaining: Kickまで{remain_to_kick} / Banまで{remain_to_ban}\n"
-            f"Time: {ts}")
+            + (f"Remaining: Kickまで{remain_to_kick} / Banまで{remain_to_ban}\n" if ESCALATE else "")
+            + f"Time: {ts}")
     await send_log(guild, base)
+    if not ESCALATE:
+        return
 
     # 閾値到達で制裁
+    action = "ban" if count >= BAN_AFTER_DELETES else "kick"
     try:
         member = user if isinstance(user, discord.Member) else guild.get_member(user.id)
         if count >= BAN_AFTER_DELETES:
@@ -203,85 +485,396 @@ async def record_violation_and_escalate(message: discord.Message):
                 await guild.ban(member, reason="Spam/連投（自動Ban）", delete_message_seconds=0)
             else:
                 await guild.ban(user, reason="Spam/連投（自動Ban）", delete_message_seconds=0)
+            MODERATION_ACTIONS.inc("ban", "ok")
             await send_log(guild, f"🚫 BANNED: {user} (ID:{user.id})  Reason: Spam/連投（自動Ban）")
         elif count >= KICK_AFTER_DELETES:
             if member:
                 await member.kick(reason="Spam/連投（自動Kick）")
+                MODERATION_ACTIONS.inc("kick", "ok")
                 await send_log(guild, f"👢 KICKED: {user} (ID:{user.id})  Reason: Spam/連投（自動Kick）")
             else:
+                MODERATION_ACTIONS.inc("kick", "skipped")
                 await send_log(guild, f"⚠️ Kick skipped (member not found): {user} (ID:{user.id})")
     except discord.Forbidden:
+        MODERATION_ACTIONS.inc(action, "forbidden")
         await send_log(guild, f"❗制裁失敗（権限不足）: {user} (ID:{user.id})")
     except discord.HTTPException as e:
+        MODERATION_ACTIONS.inc(action, "http_error")
         await send_log(guild, f"❗制裁失敗（HTTP）: {e}")
 
 # ===== メッセージ削除（標準出力＋Discordへも通知）=====
+async def _log_delete_batch(channel, deleted: list[discord.Message], failed: int):
+    """一括削除1回につき1件のログ（1件だけなら従来どおりの形式）"""
+    if not deleted or not deleted[0].guild:
+        return
+    ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if len(deleted) == 1:
+        m = deleted[0]
+        await send_log(m.guild, f"🧹 Deleted message from {m.author} (ID:{m.author.id})\nContent: `{_short(m.content, 120)}`\nTime: {ts}")
+        return
+    per_user: dict[int, list] = {}
+    for m in deleted:
+        per_user.setdefault(m.author.id, [m.author, 0])[1] += 1
+    users = ", ".join(f"{u} (ID:{uid})×{n}" for uid, (u, n) in per_user.items())
+    await send_log(deleted[0].guild, f"🧹 Bulk deleted {len(deleted)} messages in #{getattr(channel, 'name', channel.id)}"
+                                     f"{f' ({failed} failed)' if failed else ''}\nUsers: {users}\nTime: {ts}")
+
+# 削除対象はチャンネル毎に短時間ためて一括削除（14日より古いものは1件ずつ）
+BULK_DELETER = BulkDeleter(
+    window=float(getenv_or_cfg("BULK_DELETE_WINDOW", "moderation.bulk_delete_window", 1.0)),
+    on_batch=_log_delete_batch,
+)
+
 async def try_delete(message: discord.Message):
     user = message.author
     ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        await message.delete()
+        await BULK_DELETER.delete(message)
+        MODERATION_ACTIONS.inc("delete", "ok")
         line = f"[{ts}] Deleted => {user} (ID:{user.id}) | Content: {_short(message.content)}"
         print(line)
-        if message.guild:
-            await send_log(message.guild, f"🧹 Deleted message from {user} (ID:{user.id})\nContent: `{_short(message.content, 120)}`\nTime: {ts}")
     except discord.Forbidden:
+        MODERATION_ACTIONS.inc("delete", "forbidden")
         print(f"[{ts}] Delete failed (perm) => {user} (ID:{user.id})")
         if message.guild:
             await send_log(message.guild, f"❗Delete failed (permission) for {user} (ID:{user.id})")
     except discord.HTTPException as e:
+        MODERATION_ACTIONS.inc("delete", "http_error")
         print(f"[{ts}] Delete failed (HTTP) => {e}")
         if message.guild:
             await send_log(message.guild, f"❗Delete failed (HTTP) => {e}")
 
+# ===== メトリクス: 既存の統計をそのまま公開（scrape 時に読むだけ）=====
+def _sched(key: str):
+    return lambda: OLLAMA_SCHEDULER.stats()[key]
+
+METRICS.gauge("llm_queue_depth", "LLM jobs waiting for a scheduler slot", fn=_sched("queued"))
+METRICS.gauge("llm_running", "LLM jobs currently holding a scheduler slot", fn=_sched("running"))
+METRICS.counter("llm_jobs_total", "LLM jobs by outcome", ("result",),
+                fn=lambda: {(k,): v for k, v in OLLAMA_SCHEDULER.stats().items() if k in ("served", "shed", "cancelled")})
+METRICS.gauge("ollama_inflight", "Requests in flight per Ollama backend", ("backend",),
+              fn=lambda: {(b.name,): b.outstanding for b in OLLAMA.backends})
+METRICS.gauge("ollama_backend_up", "1 if the backend is accepting requests", ("backend",),
+              fn=lambda: {(b.name,): int(b.available()) for b in OLLAMA.backends})
+METRICS.gauge("llm_cache_inflight", "Distinct generations in flight (after coalescing)",
+              fn=lambda: LLM_CACHE.stats()["inflight"])
+METRICS.counter("llm_cache_requests_total", "LLM cache lookups by result", ("result",),
+                fn=lambda: {("hit",): LLM_CACHE.hits, ("coalesced",): LLM_CACHE.coalesced, ("miss",): LLM_CACHE.misses})
+METRICS.counter("summary_cache_requests_total", "URL summary cache lookups by result", ("result",),
+                fn=lambda: {("hit",): SUMMARY_CACHE.hits, ("miss",): SUMMARY_CACHE.misses})
+METRICS.gauge("log_sink_pending", "Log lines waiting to be sent", fn=lambda: LOG_SINK.stats()["pending"])
+
+def _observe_send(seconds: float):
+    STAGE_SECONDS.observe(seconds, "discord_send")
+
+# 起動時間（import 完了まで / 最初の READY まで。extension の読み込みも含む）
+STARTUP_SECONDS = METRICS.gauge("startup_seconds", "Seconds from process start to each startup phase", ("phase",))
+STARTUP_SECONDS.set(time.perf_counter() - BOOT_STARTED, "import")
+
 # ===== Discord Hooks =====
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as: {bot.user}")
-    # 各ギルドの“bot”系チャンネルを先に探索してキャッシュ
-    for g in bot.guilds:
-        await send_log(g, f"🔔 Bot is online (model={MODEL})")
-    await ensure_ollama_serve()
+    if not STARTUP_SECONDS.get("ready"):
+        STARTUP_SECONDS.set(time.perf_counter() - BOOT_STARTED, "ready")
+        print(f"⏱️ startup: import {STARTUP_SECONDS.get('import'):.2f}s / ready {STARTUP_SECONDS.get('ready'):.2f}s "
+              f"(features: {', '.join(FEATURES.features) or 'none'})")
+    # 各ギルドの“bot”系チャンネルを一度に索引化し、起動通知は LOG_SINK から並行送信
+    LOG_CHANNELS.build(bot.guilds)
+    await asyncio.gather(*(send_log(g, f"🔔 Bot is online (model={MODEL})") for g in bot.guilds))
+    if CHAT_ENABLED:
+        for sup in SUPERVISORS:
+            sup.start()
+    if CONFIG_RELOAD_INTERVAL > 0:
+        CONFIG.start_watching(CONFIG_RELOAD_INTERVAL)
+    if METRICS_ENABLED:
+        try:
+            await METRICS_SERVER.start()
+        except OSError as e:
+            print(f"(metrics server failed to start): {e}")
 
 @bot.event
 async def on_guild_join(guild: discord.Guild):
     # 参加時にも案内
+    LOG_CHANNELS.add_guild(guild)
     await send_log(guild, f"👋 Joined guild: {guild.name}")
 
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    LOG_CHANNELS.remove_guild(guild.id)
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    if isinstance(channel, discord.TextChannel):
+        LOG_CHANNELS.upsert_channel(channel)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if isinstance(after, discord.TextChannel):
+        LOG_CHANNELS.upsert_channel(after)
+    else:
+        LOG_CHANNELS.remove_channel(after)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    LOG_CHANNELS.remove_channel(channel)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    # 元メッセージが消されたら、待機中/生成中の LLM ジョブ（URL毎・区間毎の子ジョブも）を取り消す。
+    # ほかのメッセージと合流している生成は止めず、このメッセージの分の受け取りだけやめる
+    LLM_CACHE.cancel_group(payload.message_id)
+    # 消された発言（荒らし対策・モデレーションで消したものも）は過去ログ検索にも出さない
+    if RETRIEVER:
+        RETRIEVER.forget(payload.message_id)
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    for mid in payload.message_ids:
+        LLM_CACHE.cancel_group(mid)
+        if RETRIEVER:
+            RETRIEVER.forget(mid)
+
+@bot.command(name="llmq")
+async def llm_queue_stats(ctx: commands.Context):
+    """LLM キューの状態と待ち時間（p50/p95/max）を表示"""
+    st = OLLAMA_SCHEDULER.stats()
+    await ctx.send(f"🧮 LLM queue: running={st['running']}/{st['concurrency']} queued={st['queued']} "
+                   f"served={st['served']} shed={st['shed']} cancelled={st['cancelled']}\n"
+                   f"wait p50={st['wait_p50']:.1f}s p95={st['wait_p95']:.1f}s max={st['wait_max']:.1f}s\n"
+                   f"summary cache: {SUMMARY_CACHE.stats()}\nllm cache: {LLM_CACHE.stats()}\n"
+                   f"memory: {MEMORY.stats()}")
+
+async def send_chunks(channel, text: str, limit: int = 1900):
+    for i in range(0, max(len(text), 1), limit):
+        with STAGE_SECONDS.time("discord_send"):
+            await channel.send(text[i:i + limit])
+
+async def _deliver_reply(channel, prompt: str, job: dict, gate: asyncio.Semaphore,
+                         stream: StreamingReply | None = None, header: str = "") -> str | None:
+    """生成して送信し、本文を返す（取り消されたら None）"""
+    if stream is None and not STREAM_REPLIES:
+        try:
+            async with gate, channel.typing():
+                reply = await run_ollama(prompt, **job)
+        except JobCancelled:
+            return None
+        await send_chunks(channel, header + reply)
+        return reply
+
+    if stream is None:
+        # プレースホルダーを投稿し、生成に合わせて編集していく
+        stream = StreamingReply(channel, interval=STREAM_EDIT_INTERVAL, prefix=header, on_send=_observe_send)
+        await stream.start()
+
+    async def show_position(pos: int):
+        await stream.status(f"⏳ 順番待ち: {pos}番目")
+
+    try:
+        async with gate:
+            async for chunk in stream_ollama(prompt, on_position=show_position, **job):
+                await stream.feed(chunk)
+    except JobCancelled:
+        await stream.discard()
+        return None
+    await stream.finish()
+    return stream.text
+
+async def summarize_url(message: discord.Message, url: str, index: int, job: dict,
+                        gate: asyncio.Semaphore, header: str = ""):
+    """1つの URL を要約して返信（長文は区間ごとに要約してからまとめる）"""
+    async with message.channel.typing():
+        cached, page_text, meta = await prepare_url_summary(url)
+    if cached is not None:
+        await send_chunks(message.channel, header + cached)
+        return
+
+    stream = None
+    if STREAM_REPLIES:
+        stream = StreamingReply(message.channel, interval=STREAM_EDIT_INTERVAL, prefix=header,
+                                 on_send=_observe_send)
+        await stream.start()
+    done = 0
+
+    async def generate(prompt: str, part: int) -> str:
+        nonlocal done
+        async with gate:
+            out = await run_ollama(prompt, **{**job, "job_id": (message.id, index, part)})
+        done += 1
+        if stream:
+            await stream.status(f"📄 長文を区間ごとに要約中…（{done} 区間完了）")
+        return out
+
+    try:
+        prompt = await LONGDOC.build_prompt(url, page_text, generate)
+    except JobCancelled:
+        if stream:
+            await stream.discard()
+        return
+    reply = await _deliver_reply(message.channel, prompt, {**job, "job_id": (message.id, index)},
+                                 gate, stream, header)
+    if meta and reply and _is_cacheable(reply):
+        SUMMARY_CACHE.put(meta["url"], reply.strip(), meta["digest"], meta["etag"], meta["last_modified"])
+
+def _retrieval_channels(message: discord.Message) -> set[int]:
+    """過去ログを添えてよいチャンネル: 返信先そのものと、質問者も @everyone も読めるチャンネル。
+    返信は返信先を見られる全員に見えるので、非公開チャンネルの発言は持ち出さない"""
+    allowed = {message.channel.id}
+    guild = message.guild
+    if guild is None:
+        return allowed
+    member = message.author if isinstance(message.author, discord.Member) else guild.get_member(message.author.id)
+    for ch in (*guild.channels, *guild.threads):
+        if isinstance(ch, discord.CategoryChannel) or (isinstance(ch, discord.Thread) and ch.is_private()):
+            continue
+        try:
+            if not ch.permissions_for(guild.default_role).read_message_history:
+                continue
+            if member is not None and not ch.permissions_for(member).read_message_history:
+                continue
+        except discord.ClientException:      # 親チャンネルがキャッシュに無いスレッド
+            continue
+        allowed.add(ch.id)
+    return allowed
+
+async def reply_with_llm(message: discord.Message):
+    job = dict(guild_id=message.guild.id if message.guild else 0,
+               user_id=message.author.id, job_id=message.id)
+    # 1メッセージ分の LLM ジョブを同時に並べすぎない（1ユーザーあたりの待ち行列上限に合わせる）
+    gate = asyncio.Semaphore(max(1, OLLAMA_SCHEDULER.max_per_user))
+
+    urls: dict[str, str] = {}
+    for url in URL_RE.findall(message.content):
+        urls.setdefault(normalize_url(url), url)        # 同じ URL は1回だけ
+    if urls:
+        targets = list(urls.values())[:MAX_URLS_PER_MESSAGE]
+        multi = len(targets) > 1
+        # 全 URL を並行して取得・要約し、できたものから返信する
+        await asyncio.gather(*(summarize_url(message, url, i, job, gate, f"🔗 <{url}>\n" if multi else "")
+                               for i, url in enumerate(targets)))
+        if len(urls) > len(targets):
+            await message.channel.send(f"（URL は1メッセージにつき {MAX_URLS_PER_MESSAGE} 件まで要約します）")
+        return
+
+    async with message.channel.typing():
+        prompt = user_prompt = extract_after_mention(message)
+        if RETRIEVER:
+            prompt = await RETRIEVER.augment(prompt, job["guild_id"], exclude=(message.id,),
+                                             channel_ids=_retrieval_channels(message))
+        memory_key = (job["guild_id"], message.channel.id)
+        prompt = MEMORY.build_prompt(memory_key, prompt)
+    reply = await _deliver_reply(message.channel, prompt, job, gate)
+    if reply and _is_cacheable(reply):
+        MEMORY.add_turn(memory_key, user_prompt, reply.strip())
+
+@bot.command(name="backends")
+async def backend_stats(ctx: commands.Context):
+    """Ollama バックエンド毎の処理中数・レイテンシ・エラー率・回路状態を表示"""
+    st = OLLAMA.stats()
+    lines = [f"🖥️ Ollama backends (failovers={st['failovers']})"]
+    for b in st["backends"]:
+        lines.append(f"・{b['name']} ({b['endpoint']}, w={b['weight']:g}) state={b['state']} breaker={b['breaker']} "
+                     f"inflight={b['outstanding']} req={b['requests']} err={b['error_rate']:.1%} "
+                     f"p50={b['latency_p50']}s p95={b['latency_p95']}s")
+    await ctx.send("\n".join(lines)[:2000])
+
+@bot.command(name="metrics")
+async def metrics_summary(ctx: commands.Context):
+    """段ごとの件数と p50/p95（ヒストグラムのバケットから概算）を表示"""
+    lines = ["📈 stage latency (count / p50 / p95)"]
+    for (stage,), count in sorted(STAGE_SECONDS.counts().items()):
+        lines.append(f"・{stage}: {count} / ≤{STAGE_SECONDS.quantile(0.5, stage):g}s "
+                     f"/ ≤{STAGE_SECONDS.quantile(0.95, stage):g}s (errors {STAGE_ERRORS.get(stage):g})")
+    mods = ", ".join(f"{a}:{r}={v:g}" for (a, r), v in sorted(MODERATION_ACTIONS.values().items()))
+    lines.append(f"🛡️ moderation: {mods or 'none'}")
+    if METRICS_ENABLED:
+        lines.append(f"scrape: http://{METRICS_SERVER.host}:{METRICS_SERVER.port}/metrics")
+    await ctx.send("\n".join(lines)[:2000])
+
+@bot.command(name="features")
+async def feature_stats(ctx: commands.Context):
+    """有効な機能・extension の読み込み時間・起動にかかった時間を表示"""
+    st = FEATURES.stats()
+    loaded = ", ".join(f"{k} ({v:g}ms)" for k, v in st["loaded"].items())
+    failed = "".join(f"\n・{k}: {v}" for k, v in st["failed"].items())
+    await ctx.send((f"🧩 features: {', '.join(st['enabled']) or 'none'}\n"
+                    f"extensions: {loaded or 'none'}" + (f"\nfailed:{failed}" if failed else "") +
+                    f"\nstartup: import {STARTUP_SECONDS.get('import'):.2f}s / ready {STARTUP_SECONDS.get('ready'):.2f}s"
+                    + (f"\nchannels: {', '.join(map(str, sorted(BOT_CHANNELS)))}" if BOT_CHANNELS else ""))[:2000])
+
+@bot.command(name="rlstats")
+async def rate_limit_stats(ctx: commands.Context):
+    """連投制限・違反カウンタが保持しているユーザー数とメモリ使用量を表示"""
+    await ctx.send(f"🧮 rate limit ({RATE_LIMIT_ALGORITHM}): {RATE_STATE.stats()}")
+
+@bot.command(name="forget")
+async def forget_conversation(ctx: commands.Context):
+    """このチャンネルの会話履歴を消す"""
+    gid = ctx.guild.id if ctx.guild else 0
+    done = MEMORY.reset((gid, ctx.channel.id))
+    await ctx.send("🧽 このチャンネルの会話履歴を消しました。" if done else "🧽 会話履歴はありません。")
+
+@bot.command(name="ragstats")
+async def retrieval_stats(ctx: commands.Context):
+    """過去ログ索引の件数・埋め込み速度・検索レイテンシを表示"""
+    if not RETRIEVER:
+        await ctx.send("🔎 retrieval: disabled（numpy 未導入または設定で無効）"); return
+    await ctx.send(f"🔎 retrieval: {RETRIEVER.stats()}")
+
+@bot.command(name="ragindex")
+@commands.has_permissions(administrator=True)
+async def retrieval_index(ctx: commands.Context):
+    """エクスポート済みの履歴（getch/archive の保存先）を索引へ取り込む"""
+    if not RETRIEVER:
+        await ctx.send("🔎 retrieval: disabled"); return
+    started = time.perf_counter()
+    async with ctx.typing():
+        added = await RETRIEVER.ingest_dir(EXPORT_DIR)
+    elapsed = time.perf_counter() - started
+    await ctx.send(f"🔎 {added} 件を索引に追加（{elapsed:.1f}s, {added / elapsed if elapsed else 0:.0f} 件/s）\n"
+                   f"{RETRIEVER.stats()}")
+
 @bot.event
 async def on_message(message: discord.Message):
     if message.author.bot:
         return
+    if BOT_CHANNELS and message.channel.id not in BOT_CHANNELS:
+        MESSAGES.inc("other")
+        await bot.process_commands(message)
+        return
 
     # 1) 連投制限：超過なら削除→ログ→違反カウント→残り回数通知→必要なら制裁
-    if is_rate_limited(message.author.id):
-        await try_delete(message)
-        await record_violation_and_escalate(message)
-        return
+    if MODERATION_ENABLED:
+        with STAGE_SECONDS.time("ratelimit"):
+            limited = is_rate_limited(message.author.id)
+        if TRACE:
+            TRACE.record(message, "limited" if limited else "ok", bot.user.mention in message.content)
+        if limited:
+            MESSAGES.inc("rate_limited")
+            await try_delete(message)
+            await record_violation_and_escalate(message)
+            return
 
     # 2) メンションで LLM / URL要約
-    if bot.user.mention in message.content:
-        urls = URL_RE.findall(message.content)
-        async with message.channel.typing():
-            if urls:
-                url = urls[0]
-                page_text = await fetch_url_text(url)
-                prompt = f"以下の内容を要約:\nURL:{url}\n\n{page_text}"
-            else:
-                prompt = extract_after_mention(message)
-            reply = await run_ollama(prompt)
+    if CHAT_ENABLED and bot.user.mention in message.content:
+        MESSAGES.inc("mention")
+        with STAGE_SECONDS.time("reply"):
+            await reply_with_llm(message)
+    else:
+        MESSAGES.inc("other")
 
-        MAX = 1900
-        if len(reply) <= MAX:
-            await message.channel.send(reply)
-        else:
-            for i in range(0, len(reply), MAX):
-                await message.channel.send(reply[i:i + MAX])
+    # 3) 過去ログ索引へ追加（バックグラウンドでまとめて埋め込む）
+    if RETRIEVER and message.guild and not message.content.startswith(bot.command_prefix):
+        RETRIEVER.observe(message.id, message.guild.id, message.channel.id, message.author.display_name,
+                          message.created_at.isoformat(), extract_after_mention(message))
 
     await bot.process_commands(message)
 
 # ===== 実行 =====
-if __name__ == "__main__":
+def main():
     if not TOKEN:
         raise SystemExit("環境変数 DISCORD_BOT_AI が未設定です。")
     bot.run(TOKEN)
+
+if __name__ == "__main__":
+    main()
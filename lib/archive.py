@@ -0,0 +1,125 @@
+# archive.py
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import discord
+
+from lib.exporter import ChannelExporter, sanitize
+
+
+class ChannelTask:
+    """1チャンネル（またはスレッド）分のエクスポート状態"""
+    __slots__ = ("channel", "kind", "parent_id", "state", "count", "error", "path", "elapsed")
+
+    def __init__(self, channel: Any, kind: str, parent_id: Optional[int] = None) -> None:
+        self.channel = channel
+        self.kind = kind
+        self.parent_id = parent_id
+        self.state = "pending"        # pending / running / done / failed
+        self.count = 0
+        self.error: Optional[str] = None
+        self.path: Optional[str] = None
+        self.elapsed = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.channel.id, "name": self.channel.name, "kind": self.kind,
+                "parent_id": self.parent_id, "state": self.state, "exported": self.count,
+                "path": self.path, "error": self.error, "elapsed": round(self.elapsed, 2)}
+
+
+class GuildArchiver:
+    """ギルド内の全テキストチャンネルとスレッドを並行してエクスポートする。
+
+    同時に履歴を読むチャンネル数は concurrency 本まで（Discord の履歴取得レート制限対策）。
+    各チャンネルは ChannelExporter の続きから追記し、最後にマニフェストを書き出す。
+    """
+
+    def __init__(self, save_dir: str, fmt: str = "jsonl.gz", concurrency: int = 3,
+                 attachments: Optional[Any] = None) -> None:
+        self.save_dir = save_dir
+        self.attachments = attachments
+        self.fmt = fmt
+        self.concurrency = concurrency
+        self.tasks: List[ChannelTask] = []
+
+    async def collect(self, guild: discord.Guild) -> List[ChannelTask]:
+        tasks: List[ChannelTask] = []
+        seen = set()
+        for ch in guild.text_channels:
+            tasks.append(ChannelTask(ch, "text"))
+            threads = list(ch.threads)
+            try:
+                async for th in ch.archived_threads(limit=None):
+                    threads.append(th)
+            except (discord.Forbidden, discord.HTTPException):
+                pass        # アーカイブ済みスレッドを読めないチャンネルはアクティブ分だけ
+            for th in threads:
+                if th.id not in seen:
+                    seen.add(th.id)
+                    tasks.append(ChannelTask(th, "thread", ch.id))
+        self.tasks = tasks
+        return tasks
+
+    def summary(self) -> Dict[str, int]:
+        out = {"total": len(self.tasks), "pending": 0, "running": 0, "done": 0, "failed": 0, "exported": 0}
+        for t in self.tasks:
+            out[t.state] += 1
+            out["exported"] += t.count
+        return out
+
+    async def _run_one(self, exporter: ChannelExporter, sem: asyncio.Semaphore, task: ChannelTask) -> None:
+        async with sem:
+            task.state = "running"
+            started = time.monotonic()
+
+            async def progress(count: int):
+                task.count = count
+
+            try:
+                result = await exporter.export(task.channel, progress)
+                task.count = result.count
+                task.path = result.path
+                task.state = "done"
+            except discord.Forbidden:
+                task.state, task.error = "failed", "forbidden (履歴の閲覧権限なし)"
+            except Exception as e:
+                task.state, task.error = "failed", f"{type(e).__name__}: {e}"
+            task.elapsed = time.monotonic() - started
+
+    async def run(self, guild: discord.Guild,
+                  progress: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None,
+                  progress_interval: float = 5.0) -> str:
+        """全チャンネルを書き出してマニフェストのパスを返す"""
+        out_dir = os.path.join(self.save_dir, f"{sanitize(guild.name)}_{guild.id}")
+        exporter = ChannelExporter(out_dir, self.fmt, progress_interval=1.0, attachments=self.attachments)
+        if not self.tasks:
+            await self.collect(guild)
+        sem = asyncio.Semaphore(self.concurrency)
+        started = time.time()
+        jobs = asyncio.gather(*(self._run_one(exporter, sem, t) for t in self.tasks))
+        while progress is not None and not jobs.done():
+            await asyncio.wait({jobs}, timeout=progress_interval)
+            if not jobs.done():
+                await progress(self.summary())
+        await jobs
+
+        os.makedirs(out_dir, exist_ok=True)
+        manifest_path = os.path.join(out_dir, "manifest.json")
+        manifest = {
+            "guild_id": guild.id,
+            "guild": guild.name,
+            "format": self.fmt,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+            "finished_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "summary": self.summary(),
+            "attachments": self.attachments.stats() if self.attachments is not None else None,
+            "channels": [t.to_dict() for t in self.tasks],
+            "failed": [t.to_dict() for t in self.tasks if t.state == "failed"],
+        }
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest_path
@@ -0,0 +1,134 @@
+# attachments.py
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+
+class AttachmentDownloader:
+    """添付ファイルの実体を保存する非同期ダウンローダ。
+
+    同時ダウンロード数は concurrency 本まで。ディスクへ逐次書き込みながら SHA-256 を
+    計算し、attachments/<先頭2文字>/<ハッシュ><拡張子> に保存する（同じ内容は1つだけ）。
+    中断した .part は Range 指定で続きから取得する。添付 ID → ハッシュの索引を持つので
+    再エクスポート時は取得し直さない。
+    """
+
+    def __init__(self, root: str, max_bytes: int = 25_000_000, concurrency: int = 4,
+                 timeout: float = 120, chunk_size: int = 1 << 16) -> None:
+        self.root = os.path.join(root, "attachments")
+        self.partial_dir = os.path.join(self.root, ".partial")
+        self.index_path = os.path.join(self.root, "index.jsonl")
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._sem = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._index: Dict[int, Dict[str, Any]] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.skipped = 0
+        os.makedirs(self.partial_dir, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                        self._index[int(rec["id"])] = rec
+                    except (ValueError, KeyError):
+                        continue
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _remember(self, rec: Dict[str, Any]) -> None:
+        self._index[int(rec["id"])] = rec
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def submit(self, attachment: Any) -> "asyncio.Task[Dict[str, Any]]":
+        """ダウンロードを予約して Task を返す（同じ添付の二重取得はしない）"""
+        task = self._inflight.get(attachment.id)
+        if task is None:
+            task = asyncio.create_task(self.fetch(attachment))
+            self._inflight[attachment.id] = task
+            task.add_done_callback(lambda _t, k=attachment.id: self._inflight.pop(k, None))
+        return task
+
+    async def fetch(self, attachment: Any) -> Dict[str, Any]:
+        """保存結果 {"sha256", "path", "size"} か {"error"} を返す"""
+        known = self._index.get(attachment.id)
+        if known and os.path.exists(os.path.join(self.root, known["path"])):
+            return {k: known[k] for k in ("sha256", "path", "size")}
+        if attachment.size and attachment.size > self.max_bytes:
+            self.skipped += 1
+            return {"error": f"too large ({attachment.size} bytes)"}
+        async with self._sem:
+            try:
+                return await self._download(attachment)
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                return {"error": f"{type(e).__name__}: {e}"}
+
+    async def _download(self, attachment: Any) -> Dict[str, Any]:
+        part = os.path.join(self.partial_dir, f"{attachment.id}.part")
+        hasher = hashlib.sha256()
+        have = 0
+        if os.path.exists(part):
+            # 途中まで落とした分をハッシュに取り込み、続きから取得する
+            with open(part, "rb") as f:
+                for block in iter(lambda: f.read(self.chunk_size), b""):
+                    hasher.update(block)
+                    have += len(block)
+        headers = {"Range": f"bytes={have}-"} if have else {}
+        session = await self._get_session()
+        async with session.get(attachment.url, headers=headers) as res:
+            if res.status == 200:
+                hasher, have = hashlib.sha256(), 0      # Range 非対応なら最初から
+                open(part, "wb").close()
+            elif not (have and res.status in (206, 416)):
+                return {"error": f"HTTP {res.status}"}
+            if res.status != 416:                       # 416 は取得済み分で全量
+                with open(part, "ab") as f:
+                    async for chunk in res.content.iter_chunked(self.chunk_size):
+                        have += len(chunk)
+                        if have > self.max_bytes:
+                            break
+                        hasher.update(chunk)
+                        f.write(chunk)
+                if have > self.max_bytes:
+                    os.remove(part)
+                    self.skipped += 1
+                    return {"error": f"too large (> {self.max_bytes} bytes)"}
+
+        digest = hasher.hexdigest()
+        ext = os.path.splitext(attachment.filename or "")[1].lower()[:16]
+        rel = os.path.join(digest[:2], digest + ext)
+        dest = os.path.join(self.root, rel)
+        if os.path.exists(dest):
+            os.remove(part)
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(part, dest)
+            self.downloaded += 1
+        rec = {"id": attachment.id, "sha256": digest, "path": rel, "size": have}
+        self._remember(rec)
+        return {"sha256": digest, "path": rel, "size": have}
+
+    def stats(self) -> Dict[str, int]:
+        return {"downloaded": self.downloaded, "deduplicated": self.deduplicated,
+                "skipped": self.skipped, "indexed": len(self._index)}
@@ -0,0 +1,102 @@
+# bulk_delete.py
+from __future__ import annotations
+import asyncio
+import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import discord
+
+# 一括削除 API は 14 日より古いメッセージを受け付けない（境界は少し余裕を取る）
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+BULK_DELETE_MAX = 100
+
+BatchCallback = Callable[[Any, List[discord.Message], int], Awaitable[None]]
+
+
+class _Pending:
+    __slots__ = ("channel", "items", "timer")
+
+    def __init__(self, channel: Any) -> None:
+        self.channel = channel
+        self.items: List[Tuple[discord.Message, asyncio.Future]] = []
+        self.timer: Optional[asyncio.Task] = None
+
+
+class BulkDeleter:
+    """削除対象をチャンネル毎に window 秒ためて一括削除する。
+
+    delete() はそのメッセージが消えるまで待ち、失敗時は message.delete() と
+    同じ例外（discord.Forbidden / discord.HTTPException）を送出する。
+    14 日より古いメッセージや一括削除できないチャンネルは1件ずつ削除する。
+    """
+
+    def __init__(self, window: float = 1.0, on_batch: Optional[BatchCallback] = None,
+                 max_batch: int = BULK_DELETE_MAX) -> None:
+        self.window = window
+        self.on_batch = on_batch
+        self.max_batch = min(max_batch, BULK_DELETE_MAX)
+        self._pending: Dict[int, _Pending] = {}
+        self.bulk_calls = 0
+        self.single_calls = 0
+
+    async def delete(self, message: discord.Message) -> None:
+        channel = message.channel
+        pending = self._pending.get(channel.id)
+        if pending is None:
+            pending = self._pending[channel.id] = _Pending(channel)
+            pending.timer = asyncio.create_task(self._flush_later(channel.id))
+        fut = asyncio.get_running_loop().create_future()
+        pending.items.append((message, fut))
+        if len(pending.items) >= self.max_batch:
+            self._pending.pop(channel.id, None)
+            pending.timer.cancel()
+            asyncio.create_task(self._flush(pending))
+        await fut
+
+    async def _flush_later(self, channel_id: int) -> None:
+        await asyncio.sleep(self.window)
+        pending = self._pending.pop(channel_id, None)
+        if pending is not None:
+            await self._flush(pending)
+
+    async def _flush(self, pending: _Pending) -> None:
+        channel = pending.channel
+        cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        bulk = [(m, f) for m, f in pending.items if m.created_at > cutoff]
+        single = [(m, f) for m, f in pending.items if m.created_at <= cutoff]
+        if len(bulk) < 2 or not hasattr(channel, "delete_messages"):
+            single, bulk = bulk + single, []
+
+        deleted: List[discord.Message] = []
+        failed = 0
+        if bulk:
+            try:
+                self.bulk_calls += 1
+                await channel.delete_messages([m for m, _ in bulk])
+                for m, f in bulk:
+                    deleted.append(m)
+                    if not f.done():
+                        f.set_result(None)
+            except discord.Forbidden as e:
+                for _, f in bulk:
+                    failed += 1
+                    if not f.done():
+                        f.set_exception(e)
+            except discord.HTTPException:
+                single = bulk + single      # 一括削除が通らなければ1件ずつ
+        for m, f in single:
+            try:
+                self.single_calls += 1
+                await m.delete()
+                deleted.append(m)
+                if not f.done():
+                    f.set_result(None)
+            except Exception as e:
+                failed += 1
+                if not f.done():
+                    f.set_exception(e)
+        if self.on_batch is not None:
+            try:
+                await self.on_batch(channel, deleted, failed)
+            except Exception as e:
+                print(f"(bulk delete summary failed): {e}")
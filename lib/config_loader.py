@@ -1,8 +1,10 @@
 # config_loader.py
 from __future__ import annotations
+import asyncio
 import os
+import threading
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 try:
     import yaml  # pip install pyyaml
@@ -10,9 +12,9 @@ except Exception:
     yaml = None
 
 try:
-    from dotenv import load_dotenv  # pip install python-dotenv
+    from dotenv import dotenv_values  # pip install python-dotenv
 except Exception:
-    load_dotenv = None
+    dotenv_values = None
 
 def _deep_merge(dst: dict, src: dict) -> dict:
     for k, v in (src or {}).items():
@@ -43,43 +45,199 @@ def _find_config_dir() -> Path:
             return cand
     return Path("./config").resolve()
 
+_MISSING = object()
+_TRUE = {"1", "true", "yes", "on"}
+_FALSE = {"0", "false", "no", "off", ""}
+
+Changes = Dict[str, Tuple[Any, Any]]
+Subscriber = Callable[[Changes], Any]
+
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """{"a": {"b": 1}} → {"a.b": 1}（リストはそのまま1つの値として扱う）"""
+    out: Dict[str, Any] = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict) and v:
+            out.update(_flatten(v, key + "."))
+        else:
+            out[key] = v
+    return out
+
+def _read_yaml(path: Path) -> Dict[str, Any]:
+    if not yaml or not path.exists():
+        return {}
+    with path.open(encoding="utf-8") as f:
+        d = yaml.safe_load(f) or {}
+    return d if isinstance(d, dict) else {}
+
 class Config:
-    def __init__(self) -> None:
-        self.config_dir: Path = _find_config_dir()
+    """config/.env・config.yaml・config.local.yaml の内容（プロセスで1つ、get_config() で取得）。
+
+    ドット区切りキーの参照結果はキャッシュし、reload() はファイルの mtime/サイズが
+    変わったときだけ読み直す。変わったキーは subscribe() した関数へ通知する。
+    watch() をイベントループで動かしておけば、再起動せずに設定を反映できる。
+    .env は起動時に未設定の環境変数だけを補い、読み直した内容は getenv() で返す
+    （実際の環境変数を上書きすることはない）。
+    """
+
+    FILES = (".env", "config.yaml", "config.local.yaml")
+
+    def __init__(self, config_dir: Optional[Path] = None) -> None:
+        self.config_dir: Path = Path(config_dir) if config_dir else _find_config_dir()
         self.data: Dict[str, Any] = {}
+        self.dotenv: Dict[str, str] = {}
+        self._dotenv_keys: set = set()        # 起動時に .env から os.environ へ補ったキー
+        self.version = 0
+        self.reloads = 0
+        self._stamp: Tuple[Any, ...] = ()
+        self._cache: Dict[str, Any] = {}
+        self._subscribers: List[Tuple[Tuple[str, ...], Subscriber]] = []
+        self._lock = threading.Lock()
+        self._watch_task: Optional["asyncio.Task"] = None
+        self.reload(force=True)
 
-        # 1) .env 読み込み
-        if load_dotenv:
-            dotenv_path = self.config_dir / ".env"
-            if dotenv_path.exists():
-                load_dotenv(dotenv_path.as_posix())
+    # ===== 読み込み =====
+    def _file_stamp(self) -> Tuple[Any, ...]:
+        stamp = []
+        for name in self.FILES:
+            try:
+                st = (self.config_dir / name).stat()
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
 
+    def _read_dotenv(self) -> Dict[str, str]:
+        path = self.config_dir / ".env"
+        if not dotenv_values or not path.exists():
+            return {}
+        return {k: v for k, v in dotenv_values(path.as_posix()).items() if v is not None}
+
+    def _load(self) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        # 1) .env 読み込み（os.environ へ入れるのは初回・未設定のキーだけ）
+        env = self._read_dotenv()
+        if self.version == 0:
+            for k, v in env.items():
+                if k not in os.environ:
+                    os.environ[k] = v
+                    self._dotenv_keys.add(k)
         # 2) YAML 読み込み（config.yaml → config.local.yaml で上書き）
-        base = self.config_dir / "config.yaml"
-        local = self.config_dir / "config.local.yaml"
-        if yaml:
-            if base.exists():
-                with base.open(encoding="utf-8") as f:
-                    d = yaml.safe_load(f) or {}
-                    if isinstance(d, dict):
-                        self.data = d
-            if local.exists():
-                with local.open(encoding="utf-8") as f:
-                    d = yaml.safe_load(f) or {}
-                    if isinstance(d, dict):
-                        _deep_merge(self.data, d)
+        data = _read_yaml(self.config_dir / "config.yaml")
+        return _deep_merge(data, _read_yaml(self.config_dir / "config.local.yaml")), env
+
+    def getenv(self, key: str) -> Optional[str]:
+        """環境変数の値。.env から来た（または .env にしか無い）キーは最新の .env の値"""
+        if key not in self._dotenv_keys:
+            v = os.environ.get(key)
+            if v is not None:
+                return v
+        return self.dotenv.get(key)
 
+    def reload(self, force: bool = False) -> bool:
+        """ファイルが変わっていれば読み直して True（読めなかったら前の内容のまま）"""
+        stamp = self._file_stamp()
+        if not force and stamp == self._stamp:
+            return False
+        with self._lock:
+            try:
+                data, env = self._load()
+            except Exception as e:          # 書きかけの YAML などは前の内容のまま、次に変わったら読み直す
+                self._stamp = stamp
+                print(f"(config) reload failed: {e}")
+                return False
+            old = _flatten(self.data)
+            self.data = data
+            self.dotenv = env
+            self._cache = {}
+            self._stamp = stamp
+            self.version += 1
+        if self.version > 1:
+            self.reloads += 1
+            new = _flatten(data)
+            changed = {k: (old.get(k), new.get(k)) for k in old.keys() | new.keys() if old.get(k) != new.get(k)}
+            if changed:
+                self._notify(changed)
+        return True
+
+    # ===== 参照 =====
     def get(self, dotted: str, default: Optional[Any] = None) -> Any:
-        cur: Any = self.data
-        for part in dotted.split("."):
-            if not isinstance(cur, dict) or part not in cur:
-                return default
-            cur = cur[part]
-        return cur
+        v = self._cache.get(dotted, _MISSING)
+        if v is _MISSING:
+            cur: Any = self.data
+            for part in dotted.split("."):
+                if not isinstance(cur, dict) or part not in cur:
+                    cur = _MISSING
+                    break
+                cur = cur[part]
+            self._cache[dotted] = v = cur
+        return default if v is _MISSING else v
+
+    def get_bool(self, dotted: str, default: bool = False, env_key: Optional[str] = None) -> bool:
+        """真偽値の設定（env_key を渡すと getenv_or_cfg と同じく環境変数を優先）"""
+        v = self.getenv(env_key) if env_key else None
+        if v is None or v == "":
+            v = self.get(dotted, default)
+        if isinstance(v, bool):
+            return v
+        s = str(v).strip().lower()
+        return True if s in _TRUE else False if s in _FALSE else default
+
+    # ===== 変更通知 =====
+    def subscribe(self, prefix: Union[str, Tuple[str, ...]], callback: Subscriber) -> Callable[[], None]:
+        """prefix（"ratelimit" や "ollama.concurrency"、複数ならタプル）以下が変わったら
+        callback({key: (old, new)}) を1回呼ぶ。戻り値を呼ぶと解除。
+        coroutine 関数ならイベントループ上でタスクとして動かす"""
+        entry = ((prefix,) if isinstance(prefix, str) else tuple(prefix), callback)
+        self._subscribers.append(entry)
+        return lambda: self._subscribers.remove(entry) if entry in self._subscribers else None
+
+    def _notify(self, changed: Changes) -> None:
+        for prefixes, callback in list(self._subscribers):
+            part = {k: v for k, v in changed.items()
+                    if any(not p or k == p or k.startswith(p + ".") for p in prefixes)}
+            if not part:
+                continue
+            try:
+                res = callback(part)
+                if asyncio.iscoroutine(res):
+                    asyncio.get_running_loop().create_task(res)
+            except Exception as e:
+                print(f"(config) subscriber for {prefixes!r} failed: {e}")
+
+    async def watch(self, interval: float = 5.0) -> None:
+        """interval 秒ごとに mtime を確かめ、変わっていれば読み直す（stat 3回だけ）"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.reload():
+                    print(f"(config) reloaded from {self.config_dir} (v{self.version})")
+            except Exception as e:
+                print(f"(config) watch error: {e}")
+
+    def start_watching(self, interval: float = 5.0) -> None:
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.get_running_loop().create_task(self.watch(interval))
+
+    def stop_watching(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+_CONFIG: Optional[Config] = None
+_CONFIG_LOCK = threading.Lock()
+
+def get_config() -> Config:
+    """プロセス共通の Config（初回だけファイルを探して読む）"""
+    global _CONFIG
+    if _CONFIG is None:
+        with _CONFIG_LOCK:
+            if _CONFIG is None:
+                _CONFIG = Config()
+    return _CONFIG
 
 def getenv_or_cfg(env_key: str, dotted: str, default: Optional[Any] = None) -> Any:
-    v = os.getenv(env_key)
+    cfg = get_config()          # 環境変数 → config/.env → YAML の順
+    v = cfg.getenv(env_key)
     if v is not None and v != "":
         return v
-    return Config().get(dotted, default)
-
+    return cfg.get(dotted, default)
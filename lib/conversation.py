@@ -0,0 +1,165 @@
+# conversation.py
+from __future__ import annotations
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+Summarize = Callable[[Hashable, str], Awaitable[Optional[str]]]
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（かな・漢字は1文字≒1トークン、英数字は4文字≒1トークン）"""
+    wide = sum(1 for ch in text if ord(ch) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+class _Turn:
+    __slots__ = ("user", "reply", "tokens")
+
+    def __init__(self, user: str, reply: str) -> None:
+        self.user = user
+        self.reply = reply
+        self.tokens = estimate_tokens(user) + estimate_tokens(reply) + 8
+
+
+class _Channel:
+    __slots__ = ("turns", "summary", "summary_tokens", "last_used", "task")
+
+    def __init__(self) -> None:
+        self.turns: Deque[_Turn] = deque()
+        self.summary = ""
+        self.summary_tokens = 0
+        self.last_used = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+    def tokens(self) -> int:
+        return self.summary_tokens + sum(t.tokens for t in self.turns)
+
+
+class ConversationMemory:
+    """チャンネル毎の会話履歴をトークン予算内でプロンプトに添える。
+
+    直近 keep_recent 往復はそのまま残し、それより古い分が予算を超えたら
+    バックグラウンドで要約に畳み込む（要約に失敗したら古い順に捨てる）。
+    idle_ttl 秒使われていないチャンネルと、max_channels を超えた古いチャンネルは破棄する。
+    """
+
+    def __init__(self, summarize: Summarize, budget: int = 1200, keep_recent: int = 4,
+                 summary_tokens: int = 300, idle_ttl: float = 1800.0, max_channels: int = 500) -> None:
+        self.summarize = summarize
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.summary_budget = summary_tokens
+        self.idle_ttl = idle_ttl
+        self.max_channels = max_channels
+        self._channels: "OrderedDict[Hashable, _Channel]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self.compactions = 0
+        self.compaction_failures = 0
+        self.evicted = 0
+        self.trimmed = 0
+
+    def _get(self, key: Hashable) -> _Channel:
+        self._sweep()
+        ch = self._channels.get(key)
+        if ch is None:
+            ch = self._channels[key] = _Channel()
+        self._channels.move_to_end(key)
+        ch.last_used = time.monotonic()
+        return ch
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for key in [k for k, ch in self._channels.items() if now - ch.last_used > self.idle_ttl]:
+            self._drop(key)
+
+    def _drop(self, key: Hashable) -> None:
+        ch = self._channels.pop(key, None)
+        if ch is not None:
+            if ch.task is not None:
+                ch.task.cancel()
+            self.evicted += 1
+
+    def build_prompt(self, key: Hashable, prompt: str) -> str:
+        """要約 + 直近の会話（新しい方から予算に収まるだけ）+ 今回の質問"""
+        ch = self._channels.get(key)
+        if ch is None or (not ch.turns and not ch.summary):
+            return prompt
+        ch = self._get(key)
+        room = self.budget - estimate_tokens(prompt) - 24     # 見出し（要約/直近の会話/ユーザー）の分
+        parts = []
+        for t in reversed(ch.turns):
+            if t.tokens > room:
+                break
+            parts.append(f"ユーザー: {t.user}\nアシスタント: {t.reply}")
+            room -= t.tokens
+        header = ""
+        if ch.summary and ch.summary_tokens <= room:
+            header = f"これまでの会話の要約:\n{ch.summary}\n\n"
+        if not parts and not header:
+            return prompt
+        history = "\n".join(reversed(parts))
+        return f"{header}直近の会話:\n{history}\n\nユーザー: {prompt}" if parts else f"{header}ユーザー: {prompt}"
+
+    def add_turn(self, key: Hashable, user: str, reply: str) -> None:
+        ch = self._get(key)
+        ch.turns.append(_Turn(user, reply))
+        while len(self._channels) > self.max_channels:
+            self._drop(next(iter(self._channels)))
+        if ch.tokens() > self.budget and len(ch.turns) > self.keep_recent:
+            if ch.task is None or ch.task.done():
+                ch.task = asyncio.get_running_loop().create_task(self._compact(key, ch))
+        # 要約待ちの間に膨らみすぎないよう、予算の3倍を超えた分は古い順に捨てる
+        while len(ch.turns) > 1 and ch.tokens() > self.budget * 3:
+            ch.turns.popleft()
+            self.trimmed += 1
+
+    async def _compact(self, key: Hashable, ch: _Channel) -> None:
+        old = list(ch.turns)[:-self.keep_recent]
+        if not old:
+            return
+        lines = "\n".join(f"ユーザー: {t.user}\nアシスタント: {t.reply}" for t in old)
+        prev = f"これまでの要約:\n{ch.summary}\n\n" if ch.summary else ""
+        prompt = (f"{prev}以下の会話を、後の質問に答えるための要点だけ日本語で簡潔にまとめてください"
+                  f"（{self.summary_budget} トークン以内）。\n\n{lines}")
+        try:
+            summary = await self.summarize(key, prompt)
+        except Exception as e:
+            print(f"(conversation compaction failed): {e}")
+            summary = None
+        if self._channels.get(key) is not ch:
+            return          # 待っている間に破棄された
+        if not summary:
+            self.compaction_failures += 1
+            summary = ch.summary        # 要約できなかった分は捨てて予算内に戻す
+        else:
+            self.compactions += 1
+        done = {id(t) for t in old}
+        while ch.turns and id(ch.turns[0]) in done:
+            ch.turns.popleft()
+        summary = summary.strip()
+        while summary and estimate_tokens(summary) > self.summary_budget:
+            summary = summary[:int(len(summary) * 0.9)]
+        ch.summary, ch.summary_tokens = summary, estimate_tokens(summary)
+
+    def reset(self, key: Hashable) -> bool:
+        if key in self._channels:
+            self._drop(key)
+            self.evicted -= 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {"channels": len(self._channels),
+                "turns": sum(len(ch.turns) for ch in self._channels.values()),
+                "compactions": self.compactions, "compaction_failures": self.compaction_failures,
+                "trimmed": self.trimmed, "evicted": self.evicted}
+
+    async def close(self) -> None:
+        for ch in self._channels.values():
+            if ch.task is not None:
+                ch.task.cancel()
@@ -0,0 +1,91 @@
+# discord_stream.py
+from __future__ import annotations
+import time
+from typing import Any, Callable, Optional
+
+
+class StreamingReply:
+    """生成途中のテキストを Discord メッセージの編集で逐次表示する。
+
+    編集は interval 秒に1回までに間引き（Discord のレート制限対策）、
+    limit 文字を超えたら現在のメッセージを確定して次のメッセージへ続ける。
+    prefix は最初のメッセージの先頭に常に表示する見出し（text には含めない）。
+    on_send には送信・編集1回ごとの所要秒数を渡す（メトリクス用）。
+    """
+
+    def __init__(self, channel: Any, limit: int = 1900, interval: float = 1.2,
+                 placeholder: str = "⌛ 生成中…", cursor: str = " ▌", prefix: str = "",
+                 on_send: Optional[Callable[[float], None]] = None) -> None:
+        self.channel = channel
+        self.on_send = on_send
+        self.prefix = prefix
+        self.limit = limit
+        self.interval = interval
+        self.placeholder = placeholder
+        self.cursor = cursor
+        self.messages: list = []
+        self._message: Optional[Any] = None
+        self._buf = prefix
+        self._shown = ""
+        self._last_edit = 0.0
+        self._fed = False
+        self.text = ""          # これまでに受け取った全文
+
+    async def start(self) -> None:
+        started = time.monotonic()
+        self._message = await self.channel.send(self.prefix + self.placeholder)
+        self.messages.append(self._message)
+        self._shown = self.prefix + self.placeholder
+        self._last_edit = time.monotonic()
+        if self.on_send:
+            self.on_send(self._last_edit - started)
+
+    async def status(self, text: str) -> None:
+        """まだ本文が届いていない間だけ、プレースホルダーを状態表示に差し替える"""
+        if self._fed or len(self.messages) != 1:
+            return
+        await self._show(self.prefix + text)
+
+    async def discard(self) -> None:
+        for msg in self.messages:
+            try:
+                await msg.delete()
+            except Exception:
+                pass
+        self.messages.clear()
+        self._message = None
+
+    async def _show(self, content: str) -> None:
+        started = time.monotonic()
+        sent = True
+        if self._message is None:
+            self._message = await self.channel.send(content)
+            self.messages.append(self._message)
+        elif content != self._shown:
+            await self._message.edit(content=content)
+        else:
+            sent = False
+        self._shown = content
+        self._last_edit = time.monotonic()
+        if sent and self.on_send:
+            self.on_send(self._last_edit - started)
+
+    async def feed(self, text: str) -> None:
+        if text:
+            self._fed = True
+        self.text += text
+        self._buf += text
+        # 上限を超えた分は現在のメッセージを確定し、新しいメッセージへ
+        while len(self._buf) > self.limit:
+            head, self._buf = self._buf[:self.limit], self._buf[self.limit:]
+            await self._show(head)
+            self._message = None
+            self._shown = ""
+        if self._buf and time.monotonic() - self._last_edit >= self.interval:
+            await self._show(self._buf + self.cursor)
+
+    async def finish(self, empty: str = "(出力なし)") -> None:
+        if not self._fed:
+            await self._show(self.prefix + empty)
+        elif self._buf:
+            await self._show(self._buf)
@@ -0,0 +1,136 @@
+# exporter.py
+from __future__ import annotations
+import gzip
+import json
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import discord
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+FORMATS = ("jsonl", "jsonl.gz")
+
+
+def sanitize(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]+', "_", name).strip()
+
+
+def message_record(msg: discord.Message) -> Dict[str, Any]:
+    return {
+        "id": msg.id,
+        "guild_id": msg.guild.id if msg.guild else None,
+        "channel_id": msg.channel.id,
+        "created_at": msg.created_at.isoformat(),
+        "edited_at": msg.edited_at.isoformat() if msg.edited_at else None,
+        "author_id": msg.author.id,
+        "author": msg.author.display_name,
+        "content": msg.content,
+        "reply_to": msg.reference.message_id if msg.reference else None,
+        "attachments": [
+            {"id": a.id, "filename": a.filename, "url": a.url,
+             "content_type": a.content_type, "size": a.size}
+            for a in msg.attachments
+        ],
+    }
+
+
+class ExportResult:
+    __slots__ = ("path", "count", "last_id", "resumed_from")
+
+    def __init__(self, path: str, count: int, last_id: Optional[int], resumed_from: Optional[int]) -> None:
+        self.path = path
+        self.count = count
+        self.last_id = last_id
+        self.resumed_from = resumed_from
+
+
+class ChannelExporter:
+    """チャンネル履歴を JSONL（gzip 可）へ追記で書き出す。
+
+    batch_size 件ごとにまとめて書き込み、書き込み後に最後のメッセージ ID を
+    チェックポイントへ保存する。次回は after=チェックポイント から取得するので
+    新しいメッセージだけを読む。
+    """
+
+    def __init__(self, save_dir: str, fmt: str = "jsonl", batch_size: int = 500,
+                 progress_interval: float = 5.0, attachments: Optional[Any] = None) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown export format: {fmt}")
+        self.save_dir = save_dir
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.attachments = attachments      # AttachmentDownloader（添付の実体も保存する場合）
+
+    def paths(self, channel: Any) -> Tuple[str, str]:
+        base = os.path.join(self.save_dir, f"{sanitize(channel.name)}_{channel.id}")
+        return f"{base}.{self.fmt}", f"{base}.checkpoint.json"
+
+    @staticmethod
+    def load_checkpoint(path: str) -> Dict[str, Any]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            return {"last_message_id": int(data["last_message_id"]),
+                    "exported": int(data.get("exported", 0))}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    @staticmethod
+    def save_checkpoint(path: str, last_id: int, count: int) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"last_message_id": last_id, "exported": count,
+                       "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+        os.replace(tmp, path)      # 書きかけのチェックポイントを残さない
+
+    def _open(self, path: str):
+        if self.fmt == "jsonl.gz":
+            return gzip.open(path, "ab")          # 追記ごとに gzip メンバーが増える（読み出しは通常どおり）
+        return open(path, "ab", buffering=1 << 20)
+
+    async def _write_batch(self, f, batch: List[Dict[str, Any]]) -> None:
+        # 添付のダウンロード結果（ハッシュ・保存先）を待ってからまとめて書く
+        for record in batch:
+            for rec in record["attachments"]:
+                task = rec.pop("_task", None)
+                if task is not None:
+                    rec.update(await task)
+        f.write(b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in batch))
+        f.flush()
+        batch.clear()
+
+    async def export(self, channel: Any, progress: Optional[ProgressCallback] = None) -> ExportResult:
+        os.makedirs(self.save_dir, exist_ok=True)
+        out_path, ckpt_path = self.paths(channel)
+        ckpt = self.load_checkpoint(ckpt_path)
+        resumed_from = ckpt.get("last_message_id")
+        prev = ckpt.get("exported", 0)
+        after = discord.Object(id=resumed_from) if resumed_from else None
+
+        count = 0
+        last_id = resumed_from
+        batch: List[Dict[str, Any]] = []
+        last_report = time.monotonic()
+        with self._open(out_path) as f:
+            async for msg in channel.history(limit=None, oldest_first=True, after=after):
+                record = message_record(msg)
+                if self.attachments is not None:
+                    for att, rec in zip(msg.attachments, record["attachments"]):
+                        rec["_task"] = self.attachments.submit(att)
+                batch.append(record)
+                count += 1
+                last_id = msg.id
+                if len(batch) >= self.batch_size:
+                    await self._write_batch(f, batch)
+                    self.save_checkpoint(ckpt_path, last_id, prev + count)
+                if progress and time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await progress(count)
+            if batch:
+                await self._write_batch(f, batch)
+        if last_id is not None:
+            self.save_checkpoint(ckpt_path, last_id, prev + count)
+        return ExportResult(out_path, count, last_id, resumed_from)
@@ -0,0 +1,187 @@
+# extract.py
+from __future__ import annotations
+import asyncio
+import re
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from html.parser import HTMLParser
+from importlib.util import find_spec
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# bs4 / selectolax は import だけで数十 ms かかるので、実際に使うときまで読み込まない
+# （stream 抽出で済むページがほとんどで、bs4 は段落構造の無いページの予備）
+_HAS_LEXBOR = find_spec("selectolax") is not None  # pip install selectolax
+
+
+@lru_cache(maxsize=None)
+def _bs4() -> Tuple[Any, str]:
+    """(BeautifulSoup, パーサ名)。bs4 が無ければ (None, "")"""
+    try:
+        from bs4 import BeautifulSoup  # pip install beautifulsoup4
+    except Exception:
+        return None, ""
+    # pip install lxml（あれば bs4 のパーサに使う）
+    return BeautifulSoup, "lxml" if find_spec("lxml") is not None else "html.parser"
+
+
+# 本文ではない要素（ナビ・広告枠・スクリプト等）
+_NOISE_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "form", "button",
+               "select", "nav", "header", "footer", "aside"}
+_MAIN_TAGS = {"article", "main"}
+_BLOCK_TAGS = {"p", "li", "h1", "h2", "h3", "h4", "pre", "blockquote", "td", "dd", "figcaption"}
+_MIN_MAIN_CHARS = 200
+_WS_RE = re.compile(r"\s+")
+
+Extractor = Callable[[str, int], str]
+EXTRACTORS: Dict[str, Extractor] = {}
+
+
+def register_extractor(name: str) -> Callable[[Extractor], Extractor]:
+    def deco(fn: Extractor) -> Extractor:
+        EXTRACTORS[name] = fn
+        return fn
+    return deco
+
+
+def _finish(text: str, maxlen: int) -> str:
+    text = _WS_RE.sub(" ", text).strip()
+    return text[:maxlen] + " ...（省略）" if len(text) > maxlen else text
+
+
+class _MainTextParser(HTMLParser):
+    """article/main 内のテキストと、それ以外の段落テキストを分けて集める"""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.noise = 0
+        self.main = 0
+        self.block = 0
+        self.seen_main = False
+        self.main_parts: List[str] = []
+        self.other_parts: List[str] = []
+        self.main_len = 0
+        self.other_len = 0
+
+    @property
+    def done(self) -> bool:
+        # 本文が十分に集まったら残りの HTML は読まない
+        if self.main_len > self.limit:
+            return True
+        return not self.seen_main and self.other_len > self.limit * 2
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _NOISE_TAGS:
+            self.noise += 1
+        elif tag in _MAIN_TAGS:
+            self.main += 1
+            self.seen_main = True
+        elif tag in _BLOCK_TAGS:
+            self.block += 1
+
+    def handle_endtag(self, tag):
+        if tag in _NOISE_TAGS:
+            self.noise = max(0, self.noise - 1)
+        elif tag in _MAIN_TAGS:
+            self.main = max(0, self.main - 1)
+        elif tag in _BLOCK_TAGS:
+            self.block = max(0, self.block - 1)
+
+    def handle_data(self, data):
+        if self.noise:
+            return
+        text = data.strip()
+        if not text:
+            return
+        if self.main:
+            self.main_parts.append(text)
+            self.main_len += len(text) + 1
+        elif self.block:
+            self.other_parts.append(text)
+            self.other_len += len(text) + 1
+
+
+@register_extractor("stream")
+def extract_stream(html: str, maxlen: int = 4000, chunk: int = 32_768) -> str:
+    """標準ライブラリの HTMLParser に少しずつ流し込み、本文が集まった時点で打ち切る"""
+    parser = _MainTextParser(maxlen)
+    for i in range(0, len(html), chunk):
+        parser.feed(html[i:i + chunk])
+        if parser.done:
+            break
+    if parser.main_len >= _MIN_MAIN_CHARS:
+        return _finish(" ".join(parser.main_parts), maxlen)
+    if parser.other_len >= _MIN_MAIN_CHARS:
+        return _finish(" ".join(parser.other_parts), maxlen)
+    # 段落構造が無いページは従来どおりページ全体のテキストへ
+    return extract_bs4(html, maxlen)
+
+
+@register_extractor("bs4")
+def extract_bs4(html: str, maxlen: int = 4000) -> str:
+    BeautifulSoup, parser = _bs4()
+    if BeautifulSoup is None:
+        return _finish(re.sub(r"<[^>]+>", " ", html), maxlen)
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(list(_NOISE_TAGS)):
+        tag.decompose()
+    root = soup.find("article") or soup.find("main") or soup.find(attrs={"role": "main"}) or soup
+    parts: List[str] = []
+    total = 0
+    for s in root.stripped_strings:
+        parts.append(s)
+        total += len(s) + 1
+        if total > maxlen:
+            break
+    return _finish(" ".join(parts), maxlen)
+
+
+if _HAS_LEXBOR:
+    @register_extractor("lexbor")
+    def extract_lexbor(html: str, maxlen: int = 4000) -> str:
+        from selectolax.lexbor import LexborHTMLParser
+        tree = LexborHTMLParser(html)
+        tree.strip_tags(list(_NOISE_TAGS))
+        root = (tree.css_first("article") or tree.css_first("main")
+                or tree.css_first("[role=main]") or tree.body or tree.root)
+        if root is None:
+            return ""
+        return _finish(root.text(separator=" "), maxlen)
+
+
+def _default_backend() -> str:
+    return "lexbor" if "lexbor" in EXTRACTORS else "stream"
+
+
+def extract_main_text(html: str, maxlen: int = 4000, backend: Optional[str] = None) -> str:
+    fn = EXTRACTORS.get(backend or _default_backend()) or EXTRACTORS["stream"]
+    return fn(html, maxlen)
+
+
+class ContentExtractor:
+    """HTML→本文テキスト変換をイベントループ外（スレッド/プロセスプール）で実行する"""
+
+    def __init__(self, backend: str = "auto", executor: str = "thread", workers: int = 2) -> None:
+        self.backend = None if backend in ("", "auto") else backend
+        self.kind = executor
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="extract")
+        return self._executor
+
+    async def extract(self, html: str, maxlen: int = 4000) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), extract_main_text,
+                                          html, maxlen, self.backend)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
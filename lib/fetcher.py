@@ -0,0 +1,79 @@
+# fetcher.py
+from __future__ import annotations
+import asyncio
+from typing import Mapping, Optional
+
+import aiohttp
+
+
+class FetchResult:
+    __slots__ = ("status", "body", "headers", "truncated")
+
+    def __init__(self, status: int, body: bytes, headers: Mapping[str, str], truncated: bool) -> None:
+        self.status = status
+        self.body = body
+        self.headers = headers
+        self.truncated = truncated
+
+    def text(self) -> str:
+        return self.body.decode(errors="ignore")
+
+
+class UrlFetcher:
+    """Bot の生存期間中ずっと使い回す URL 取得器。
+
+    共有コネクタ（ホスト毎の接続数上限・DNS キャッシュ）と全体の同時取得数上限、
+    ストリーミング読み込みでのサイズ上限・リダイレクト上限をまとめて持つ。
+    """
+
+    def __init__(self, max_bytes: int = 2_000_000, max_redirects: int = 3, timeout: float = 15,
+                 concurrency: int = 8, limit_per_host: int = 2, dns_ttl: int = 300,
+                 truncate_marker: bytes = "cut big size...".encode("utf-8")) -> None:
+        self.max_bytes = max_bytes
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.truncate_marker = truncate_marker
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.concurrency * 2,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, raise_for_status=True)
+            self._sem = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def fetch(self, url: str, headers: Optional[Mapping[str, str]] = None) -> FetchResult:
+        """本文を max_bytes まで読む。304 のときは body が空。失敗時は aiohttp の例外を送出"""
+        session = await self._get_session()
+        async with self._sem:
+            async with session.get(url, headers=headers, max_redirects=self.max_redirects,
+                                   timeout=aiohttp.ClientTimeout(total=self.timeout)) as res:
+                if res.status == 304:
+                    return FetchResult(res.status, b"", res.headers, False)
+                total = 0
+                chunks = []
+                truncated = False
+                async for chunk, _ in res.content.iter_chunks():
+                    if not chunk:
+                        continue
+                    total += len(chunk)
+                    if total > self.max_bytes:
+                        chunks.append(self.truncate_marker)
+                        truncated = True
+                        break
+                    chunks.append(chunk)
+                return FetchResult(res.status, b"".join(chunks), res.headers, truncated)
@@ -0,0 +1,169 @@
+# llm_cache.py
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from lib.scheduler import JobCancelled
+
+Produce = Callable[[], AsyncIterator[str]]
+
+
+class _Flight:
+    """実行中の生成1本分（届いたチャンクを後から来た呼び出しにも配る）"""
+    __slots__ = ("chunks", "done", "error", "changed", "task", "subscribers", "dropped")
+
+    def __init__(self) -> None:
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Dict[Any, int] = {}      # 受け取り中の呼び出しのジョブ ID → 数
+        self.dropped: Set[Any] = set()             # 取り消されたジョブ ID（受け取りをやめる）
+
+
+def _in_group(k: Any, job_id: Any) -> bool:
+    return k is not None and (k == job_id or (isinstance(k, tuple) and bool(k) and k[0] == job_id))
+
+
+class LLMCache:
+    """LLM 呼び出しの single-flight 合流 + 完全一致プロンプトの LRU/TTL キャッシュ。
+
+    同じキー（モデル・プロンプト・オプション）の生成が実行中なら新たに走らせず、
+    同じ生成のチャンクを受け取る。生成は呼び出し元とは別タスクで動くので、
+    最初の呼び出し元が居なくなっても合流した側には最後まで届く。
+    取り消し（cancel_group）も受け取りをやめるだけで、生成を止めるのは誰も待っていないときだけ。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 600.0,
+                 is_ok: Callable[[str], bool] = bool) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.is_ok = is_ok
+        self._lru: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(model: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+        raw = json.dumps([model, prompt, options or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        stored_at, text = item
+        if time.monotonic() - stored_at > self.ttl:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        self._lru[key] = (time.monotonic(), text)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    async def _produce(self, key: str, flight: _Flight, produce: Produce) -> None:
+        try:
+            async for chunk in produce():
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except BaseException as e:      # 取り消し（CancelledError / JobCancelled）も合流側へ伝える
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.changed.set()
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+        text = "".join(flight.chunks)
+        if flight.error is None and self.is_ok(text):
+            self.put(key, text)
+
+    async def stream(self, key: str, produce: Produce, job_id: Any = None) -> AsyncIterator[str]:
+        """キャッシュ命中なら全文を1回、そうでなければ生成中のチャンクを順に yield する。
+
+        job_id を渡すと cancel_group で取り消せる（取り消されたら JobCancelled）。
+        """
+        text = self.get(key)
+        if text is not None:
+            self.hits += 1
+            yield text
+            return
+        while True:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = _Flight()
+                flight.task = asyncio.get_running_loop().create_task(self._produce(key, flight, produce))
+            else:
+                self.coalesced += 1
+            flight.subscribers[job_id] = flight.subscribers.get(job_id, 0) + 1
+            i = 0
+            try:
+                while True:
+                    if job_id in flight.dropped:
+                        raise JobCancelled(job_id)
+                    while i < len(flight.chunks):
+                        yield flight.chunks[i]
+                        i += 1
+                    if flight.done:
+                        break
+                    flight.changed.clear()
+                    await flight.changed.wait()
+            finally:
+                left = flight.subscribers.pop(job_id) - 1
+                if left:
+                    flight.subscribers[job_id] = left
+                else:
+                    flight.dropped.discard(job_id)
+            err = flight.error
+            if err is None:
+                return
+            cancelled = isinstance(err, (JobCancelled, asyncio.CancelledError))
+            if leader or not cancelled:
+                raise JobCancelled(key) if isinstance(err, asyncio.CancelledError) else err
+            if i:
+                yield "\n❌ 共有していた生成が取り消されました。"
+                return
+            # 合流先が何も出さずに取り消されたので、自分で生成し直す
+
+    async def run(self, key: str, produce: Produce, job_id: Any = None) -> str:
+        return "".join([chunk async for chunk in self.stream(key, produce, job_id)])
+
+    def cancel_group(self, job_id: Any) -> int:
+        """job_id と、(job_id, ...) のタプルを ID に持つ子ジョブ（1メッセージ分）の受け取りをやめる。
+
+        生成を取り消すのは、ほかに受け取っている呼び出しが残らないときだけ
+        （最初に頼んだ人が消しても、合流した人には最後まで届ける）。取り消した受け取りの数を返す。
+        """
+        count = 0
+        for key, flight in list(self._inflight.items()):
+            ids = [k for k in flight.subscribers if _in_group(k, job_id) and k not in flight.dropped]
+            if not ids:
+                continue
+            flight.dropped.update(ids)
+            count += len(ids)
+            if all(k in flight.dropped for k in flight.subscribers):
+                # 誰も待っていない。次の同じ依頼は新しく生成する
+                del self._inflight[key]
+                if flight.task is not None:
+                    flight.task.cancel()
+            flight.changed.set()
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses + self.coalesced
+        return {"hits": self.hits, "coalesced": self.coalesced, "misses": self.misses,
+                "saved_calls": self.hits + self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / total, 3) if total else 0.0,
+                "entries": len(self._lru), "inflight": len(self._inflight)}
@@ -0,0 +1,80 @@
+# log_channels.py
+from __future__ import annotations
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class LogChannelIndex:
+    """ギルド毎のログ送信先チャンネルの索引。
+
+    起動時に1回だけ全ギルドを走査し、以降はチャンネルの作成/更新/削除イベントで
+    該当ギルドの候補だけを更新する。参照は dict 1回（再走査なし）。
+    優先順位: 設定名と完全一致 > 設定名を含む > “bot” を含む（それぞれ名前が短い方）。
+    """
+
+    def __init__(self, name: str = "bot") -> None:
+        self.name = (name or "bot").lower()
+        self._candidates: Dict[int, Dict[int, Tuple[int, int, int]]] = {}  # guild -> ch -> rank
+        self._best: Dict[int, Optional[int]] = {}
+
+    def _rank(self, channel: Any) -> Optional[Tuple[int, int, int]]:
+        name = (getattr(channel, "name", "") or "").lower()
+        if name == self.name:
+            tier = 0
+        elif self.name in name:
+            tier = 1
+        elif "bot" in name:
+            tier = 2
+        else:
+            return None
+        return (tier, len(name), getattr(channel, "position", 0) or 0)
+
+    def _recompute(self, guild_id: int) -> None:
+        cands = self._candidates.get(guild_id) or {}
+        self._best[guild_id] = min(cands, key=cands.__getitem__) if cands else None
+
+    def add_guild(self, guild: Any) -> None:
+        cands: Dict[int, Tuple[int, int, int]] = {}
+        for ch in guild.text_channels:
+            rank = self._rank(ch)
+            if rank is not None:
+                cands[ch.id] = rank
+        self._candidates[guild.id] = cands
+        self._recompute(guild.id)
+
+    def build(self, guilds: Iterable[Any]) -> None:
+        for g in guilds:
+            self.add_guild(g)
+
+    def remove_guild(self, guild_id: int) -> None:
+        self._candidates.pop(guild_id, None)
+        self._best.pop(guild_id, None)
+
+    def upsert_channel(self, channel: Any) -> None:
+        """テキストチャンネルの作成・名前変更を反映する"""
+        guild = getattr(channel, "guild", None)
+        if guild is None:
+            return
+        if guild.id not in self._candidates:
+            self.add_guild(guild)
+            return
+        cands = self._candidates[guild.id]
+        rank = self._rank(channel)
+        if rank is None:
+            if cands.pop(channel.id, None) is None:
+                return
+        else:
+            cands[channel.id] = rank
+        self._recompute(guild.id)
+
+    def remove_channel(self, channel: Any) -> None:
+        guild = getattr(channel, "guild", None)
+        if guild is None or channel.id not in self._candidates.get(guild.id, {}):
+            return
+        del self._candidates[guild.id][channel.id]
+        self._recompute(guild.id)
+
+    def get(self, guild: Any) -> Optional[Any]:
+        if guild.id not in self._best:
+            self.add_guild(guild)
+        chan_id = self._best.get(guild.id)
+        return guild.get_channel(chan_id) if chan_id else None
@@ -0,0 +1,126 @@
+# log_sink.py
+from __future__ import annotations
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+Deliver = Callable[[Hashable, str], Awaitable[None]]
+
+
+def pack_entries(entries: List[str], limit: int = 2000, sep: str = "\n") -> List[str]:
+    """ログ行を limit 文字以内のメッセージに詰め合わせる（長すぎる行は分割）"""
+    out: List[str] = []
+    cur = ""
+    for entry in entries:
+        while len(entry) > limit:
+            if cur:
+                out.append(cur)
+                cur = ""
+            out.append(entry[:limit])
+            entry = entry[limit:]
+        if not entry:
+            continue
+        if cur and len(cur) + len(sep) + len(entry) <= limit:
+            cur += sep + entry
+        else:
+            if cur:
+                out.append(cur)
+            cur = entry
+    if cur:
+        out.append(cur)
+    return out
+
+
+class _GuildQueue:
+    __slots__ = ("entries", "chars", "dropped", "wake", "full", "task")
+
+    def __init__(self) -> None:
+        self.entries: Deque[str] = deque()
+        self.chars = 0
+        self.dropped = 0
+        self.wake = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+
+class LogSink:
+    """ギルド毎にログをためて、まとめて送る非同期シンク。
+
+    最初の1件から interval 秒経つか、たまった文字数が flush_chars を超えたら
+    2000 文字以内のメッセージに詰めて deliver へ渡す（同時送信は concurrency 本まで）。
+    キューが max_pending 件を超えた分は捨て、次の送信時に破棄件数を添える。
+    """
+
+    def __init__(self, deliver: Deliver, interval: float = 2.0, flush_chars: int = 1500,
+                 max_pending: int = 200, limit: int = 2000, concurrency: int = 4) -> None:
+        self.deliver = deliver
+        self.interval = interval
+        self.flush_chars = flush_chars
+        self.max_pending = max_pending
+        self.limit = limit
+        self._queues: Dict[Hashable, _GuildQueue] = {}
+        self._send_sem = asyncio.Semaphore(concurrency)   # 全ギルド合計の同時送信数
+        self.submitted = 0
+        self.sent_messages = 0
+        self.dropped = 0
+
+    def submit(self, key: Hashable, text: str) -> bool:
+        gq = self._queues.get(key)
+        if gq is None:
+            gq = self._queues[key] = _GuildQueue()
+        if gq.task is None or gq.task.done():
+            gq.task = asyncio.get_running_loop().create_task(self._run(key, gq))
+        if len(gq.entries) >= self.max_pending:
+            gq.dropped += 1
+            self.dropped += 1
+            return False
+        gq.entries.append(text)
+        gq.chars += len(text) + 1
+        self.submitted += 1
+        gq.wake.set()
+        if gq.chars >= self.flush_chars:
+            gq.full.set()
+        return True
+
+    async def _run(self, key: Hashable, gq: _GuildQueue) -> None:
+        while True:
+            await gq.wake.wait()
+            try:
+                await asyncio.wait_for(gq.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush(key, gq)
+
+    async def _flush(self, key: Hashable, gq: _GuildQueue) -> None:
+        entries = list(gq.entries)
+        gq.entries.clear()
+        gq.chars = 0
+        gq.wake.clear()
+        gq.full.clear()
+        if gq.dropped:
+            entries.append(f"⚠️ ログが多すぎるため {gq.dropped} 件を破棄しました")
+            gq.dropped = 0
+        for text in pack_entries(entries, self.limit):
+            try:
+                async with self._send_sem:
+                    await self.deliver(key, text)
+                self.sent_messages += 1
+            except Exception as e:
+                print(f"(log sink deliver failed): {e}\n{text}")
+
+    async def flush(self) -> None:
+        for key, gq in list(self._queues.items()):
+            if gq.entries or gq.dropped:
+                await self._flush(key, gq)
+
+    async def close(self) -> None:
+        for gq in self._queues.values():
+            if gq.task is not None:
+                gq.task.cancel()
+        await self.flush()
+        self._queues.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"submitted": self.submitted, "sent_messages": self.sent_messages,
+                "dropped": self.dropped,
+                "pending": sum(len(gq.entries) for gq in self._queues.values())}
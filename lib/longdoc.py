@@ -0,0 +1,108 @@
+# longdoc.py
+from __future__ import annotations
+import asyncio
+import re
+import zlib
+from typing import Awaitable, Callable, List, Optional
+
+from lib.conversation import estimate_tokens
+from lib.summary_cache import SummaryCache, content_hash
+
+# 文の区切り（抽出済みテキストは改行が潰れているので句点・終止符で切る）
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?])\s*|(?<=\.)\s+")
+
+Generate = Callable[[str, int], Awaitable[str]]
+
+
+def split_chunks(text: str, max_tokens: int, min_tokens: Optional[int] = None) -> List[str]:
+    """文単位で max_tokens 以内の断片に分ける。
+
+    min_tokens を超えたあとは文のハッシュで区切り位置を決める（内容依存の区切り）ので、
+    一部を書き換えても離れた断片の区切りは変わらず、要約キャッシュがそのまま効く。
+    """
+    min_tokens = max_tokens // 2 if min_tokens is None else min_tokens
+    chunks: List[str] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for sent in _SENTENCE_RE.split(text):
+        if not sent:
+            continue
+        t = estimate_tokens(sent)
+        while t > max_tokens:           # 1文が長すぎる場合は文字数で割る
+            if cur:
+                chunks.append(" ".join(cur))
+                cur, cur_tokens = [], 0
+            cut = max(1, len(sent) * max_tokens // t)
+            chunks.append(sent[:cut])
+            sent = sent[cut:]
+            t = estimate_tokens(sent)
+        if not sent:
+            continue
+        if cur and cur_tokens + t > max_tokens:
+            chunks.append(" ".join(cur))
+            cur, cur_tokens = [], 0
+        cur.append(sent)
+        cur_tokens += t
+        if cur_tokens >= min_tokens and zlib.crc32(sent.encode("utf-8")) % 4 == 0:
+            chunks.append(" ".join(cur))
+            cur, cur_tokens = [], 0
+    if cur:
+        chunks.append(" ".join(cur))
+    return chunks
+
+
+class LongDocSummarizer:
+    """長い本文を分割して要約し（map）、部分要約をまとめて最終プロンプトにする（reduce）。
+
+    断片の要約は本文ハッシュをキーに SummaryCache へ保存するので、ページの一部が
+    変わっても変わった断片だけを要約し直す。generate の同時実行数は呼び出し側で絞る。
+    """
+
+    def __init__(self, cache: SummaryCache, max_tokens: int = 1400, max_chunks: int = 24,
+                 is_ok: Callable[[str], bool] = bool) -> None:
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.max_chunks = max_chunks
+        self.is_ok = is_ok
+
+    @staticmethod
+    def _map_prompt(chunk: str) -> str:
+        return f"次の文章は長い文書の一部です。要点を日本語で簡潔に要約:\n\n{chunk}"
+
+    async def _summarize_chunk(self, chunk: str, index: int, generate: Generate) -> Optional[str]:
+        digest = content_hash(chunk)
+        cached = self.cache.get_chunk(digest)
+        if cached is not None:
+            return cached
+        out = (await generate(self._map_prompt(chunk), index)).strip()
+        if not self.is_ok(out):
+            return None
+        self.cache.put_chunk(digest, out)
+        return out
+
+    async def _map(self, chunks: List[str], generate: Generate, offset: int = 0) -> List[str]:
+        results = await asyncio.gather(*(self._summarize_chunk(c, offset + i, generate)
+                                         for i, c in enumerate(chunks)))
+        return [r for r in results if r]
+
+    async def build_prompt(self, url: str, text: str, generate: Generate) -> str:
+        """最終要約用のプロンプトを返す（短い本文なら分割せずそのまま）"""
+        chunks = split_chunks(text, self.max_tokens)
+        if len(chunks) <= 1:
+            return f"以下の内容を要約:\nURL:{url}\n\n{text}"
+        note = ""
+        if len(chunks) > self.max_chunks:
+            note = f"（長すぎるため先頭 {self.max_chunks}/{len(chunks)} 区間のみ）\n"
+            chunks = chunks[:self.max_chunks]
+        partials = await self._map(chunks, generate)
+        offset = len(chunks)
+        # 部分要約の合計がまだ収まらなければ、まとめ直して段数を増やす
+        while len(partials) > 1 and estimate_tokens("\n".join(partials)) > self.max_tokens:
+            groups = split_chunks("\n".join(partials), self.max_tokens)
+            if len(groups) >= len(partials):
+                break
+            partials = await self._map(groups, generate, offset)
+            offset += len(groups)
+        body = "\n".join(f"[{i}] {p}" for i, p in enumerate(partials, 1)) or text[:2000]
+        return (f"以下は長い文書を分割して要約したものです。重複をまとめて全体の要約を作成:\n"
+                f"URL:{url}\n{note}\n{body}")
@@ -0,0 +1,229 @@
+# metrics.py
+from __future__ import annotations
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from aiohttp import web      # 実行時は MetricsServer.start で読み込む（aiohttp.web は重い）
+
+# 秒単位の既定バケット（連投判定の1ms 未満から LLM 生成の数分まで）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180, 600)
+
+Labels = Tuple[str, ...]
+_INF_LE = 'le="+Inf"'
+
+
+def _fmt_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Metric:
+    """名前・説明・ラベル名と、ラベル値タプル毎の値。fn を渡すと出力時に呼んで値を得る
+    （数値、または {ラベル値タプル: 値}。既存の stats() をそのまま公開する用）"""
+    kind = "untyped"
+    __slots__ = ("name", "help", "labelnames", "fn", "_values")
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 fn: Optional[Callable[[], Any]] = None) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values: Dict[Labels, float] = {}
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def values(self) -> Dict[Labels, float]:
+        if self.fn is None:
+            return dict(self._values)
+        got = self.fn()
+        return got if isinstance(got, dict) else {(): got}
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_num(v)}" for k, v in self.values().items()]
+
+
+class Counter(_Metric):
+    """単調増加のカウンタ"""
+    kind = "counter"
+    __slots__ = ()
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+
+class Gauge(_Metric):
+    """現在値（キューの長さ・処理中の数など）"""
+    kind = "gauge"
+    __slots__ = ()
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def add(self, value: float, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n: int) -> None:
+        self.counts = [0] * n
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "started")
+
+    def __init__(self, hist: "Histogram", labels: Labels) -> None:
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.hist.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram:
+    """固定バケットのヒストグラム。observe は二分探索1回と加算だけ"""
+    kind = "histogram"
+    __slots__ = ("name", "help", "labelnames", "buckets", "_series")
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, _Series] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = _Series(len(self.buckets) + 1)
+        s.counts[bisect_left(self.buckets, value)] += 1
+        s.sum += value
+        s.count += 1
+
+    def counts(self) -> Dict[Labels, int]:
+        return {k: s.count for k, s in self._series.items()}
+
+    def time(self, *labels: str) -> _Timer:
+        """with METRICS_X.time("fetch"): ... の所要時間を記録する（async 関数内でも可）"""
+        return _Timer(self, labels)
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """バケット境界から求めた近似分位点（!metrics 表示用）"""
+        s = self._series.get(labels)
+        if s is None or not s.count:
+            return 0.0
+        rank = q * s.count
+        seen = 0
+        for i, c in enumerate(s.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def samples(self) -> List[str]:
+        out = []
+        les = [f'le="{_num(b)}"' for b in self.buckets]
+        for k, s in self._series.items():
+            acc = 0
+            for le, c in zip(les, s.counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, k, _INF_LE)} {s.count}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, k)} {_num(round(s.sum, 6))}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, k)} {s.count}")
+        return out
+
+
+class MetricsRegistry:
+    """メトリクスの置き場。render() で Prometheus のテキスト形式 (0.0.4) を返す"""
+
+    def __init__(self, prefix: str = "") -> None:
+        self.prefix = prefix
+        self._metrics: Dict[str, Any] = {}
+
+    def _get(self, cls: type, name: str, *args: Any, **kw: Any) -> Any:
+        name = self.prefix + name
+        m = self._metrics.get(name)
+        if m is None:
+            m = self._metrics[name] = cls(name, *args, **kw)
+        elif not isinstance(m, cls):
+            raise ValueError(f"metric {name} already registered as {m.kind}")
+        return m
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (),
+                fn: Optional[Callable[[], Any]] = None) -> Counter:
+        return self._get(Counter, name, help, labelnames, fn=fn)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              fn: Optional[Callable[[], Any]] = None) -> Gauge:
+        return self._get(Gauge, name, help, labelnames, fn=fn)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            try:
+                samples = m.samples()
+            except Exception as e:      # 値の取得に失敗したゲージは飛ばす
+                lines.append(f"# {m.name} unavailable: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {m.name} {_escape(m.help)}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """GET /metrics で registry を返すだけの HTTP サーバー（Prometheus の scrape 先）"""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        from aiohttp import web
+        return web.Response(body=self.registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self) -> None:
+        if self._runner is not None:
+            return
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"📈 metrics: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
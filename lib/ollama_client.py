@@ -0,0 +1,175 @@
+# ollama_client.py
+from __future__ import annotations
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+
+class OllamaError(Exception):
+    """Ollama API がエラーを返した（モデル未取得・不正リクエスト等）"""
+
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class OllamaConnectionError(OllamaError):
+    """Ollama サーバーに接続できない（CLI フォールバック対象）"""
+
+
+class OllamaClient:
+    """ローカル Ollama HTTP API (/api/generate, /api/chat) の非同期クライアント。
+
+    セッションは初回リクエスト時に生成し、keep-alive 接続をプールして使い回す。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 11434,
+                 pool_size: int = 4, keepalive_timeout: float = 60.0) -> None:
+        self.base_url = f"http://{host}:{port}"
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _post(self, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        session = await self._get_session()
+        try:
+            async with session.post(
+                self.base_url + path,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as res:
+                try:
+                    data = await res.json(content_type=None)
+                except ValueError:
+                    data = {"error": (await res.text()).strip()}
+                if res.status != 200 or "error" in data:
+                    raise OllamaError(str(data.get("error") or f"HTTP {res.status}"), res.status)
+                return data
+        except aiohttp.ClientConnectionError as e:
+            raise OllamaConnectionError(str(e) or type(e).__name__) from e
+
+    @staticmethod
+    def _payload(model: str, options: Optional[Dict[str, Any]],
+                 keep_alive: Optional[str], stream: bool = False, **fields: Any) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": model, "stream": stream, **fields}
+        if options:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return payload
+
+    async def generate(self, model: str, prompt: str, *,
+                       system: Optional[str] = None,
+                       options: Optional[Dict[str, Any]] = None,
+                       keep_alive: Optional[str] = None,
+                       timeout: float = 1800) -> str:
+        fields: Dict[str, Any] = {"prompt": prompt}
+        if system:
+            fields["system"] = system
+        data = await self._post("/api/generate", self._payload(model, options, keep_alive, **fields), timeout)
+        return data.get("response", "")
+
+    async def generate_stream(self, model: str, prompt: str, *,
+                              system: Optional[str] = None,
+                              options: Optional[Dict[str, Any]] = None,
+                              keep_alive: Optional[str] = None,
+                              timeout: float = 1800) -> AsyncIterator[str]:
+        """生成されたトークンを届いた順に yield する（NDJSON ストリーム）"""
+        fields: Dict[str, Any] = {"prompt": prompt}
+        if system:
+            fields["system"] = system
+        payload = self._payload(model, options, keep_alive, stream=True, **fields)
+        session = await self._get_session()
+        try:
+            async with session.post(
+                self.base_url + "/api/generate",
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as res:
+                if res.status != 200:
+                    body = (await res.text()).strip()
+                    try:
+                        body = json.loads(body).get("error") or body
+                    except ValueError:
+                        pass
+                    raise OllamaError(body or f"HTTP {res.status}", res.status)
+                async for line in res.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError as e:
+                        raise OllamaError(f"invalid stream line: {line[:200]!r}", res.status) from e
+                    if not isinstance(data, dict):
+                        raise OllamaError(f"invalid stream line: {line[:200]!r}", res.status)
+                    if "error" in data:
+                        raise OllamaError(str(data["error"]), res.status)
+                    chunk = data.get("response")
+                    if chunk:
+                        yield chunk
+                    if data.get("done"):
+                        break
+        except aiohttp.ClientConnectionError as e:
+            raise OllamaConnectionError(str(e) or type(e).__name__) from e
+
+    async def chat(self, model: str, messages: List[Dict[str, str]], *,
+                   options: Optional[Dict[str, Any]] = None,
+                   keep_alive: Optional[str] = None,
+                   timeout: float = 1800) -> str:
+        payload = self._payload(model, options, keep_alive, messages=messages)
+        data = await self._post("/api/chat", payload, timeout)
+        return (data.get("message") or {}).get("content", "")
+
+    async def embed(self, model: str, inputs: List[str], *,
+                    keep_alive: Optional[str] = None,
+                    timeout: float = 120) -> List[List[float]]:
+        """複数テキストを1リクエストでベクトル化（/api/embed。古いサーバーは /api/embeddings を1件ずつ）"""
+        try:
+            data = await self._post("/api/embed", self._payload(model, None, keep_alive, input=inputs), timeout)
+            return data.get("embeddings") or []
+        except OllamaError as e:
+            if e.status != 404 or "model" in str(e).lower():
+                raise
+        out: List[List[float]] = []
+        for text in inputs:
+            data = await self._post("/api/embeddings", self._payload(model, None, keep_alive, prompt=text), timeout)
+            out.append(data.get("embedding") or [])
+        return out
+
+    async def ps(self, timeout: float = 5) -> Optional[List[str]]:
+        """メモリに載っているモデル名の一覧（取得できなければ None）"""
+        session = await self._get_session()
+        try:
+            async with session.get(self.base_url + "/api/ps",
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+                data = await res.json(content_type=None)
+                return [m.get("name") or m.get("model") for m in data.get("models") or []]
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def version(self, timeout: float = 5) -> Optional[str]:
+        session = await self._get_session()
+        try:
+            async with session.get(self.base_url + "/api/version",
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+                data = await res.json(content_type=None)
+                return data.get("version")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
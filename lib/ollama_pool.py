@@ -0,0 +1,281 @@
+# ollama_pool.py
+from __future__ import annotations
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, TypeVar
+
+import aiohttp
+
+from lib.ollama_client import OllamaClient, OllamaConnectionError, OllamaError
+from lib.ollama_supervisor import OllamaSupervisor
+
+T = TypeVar("T")
+_LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+
+class CircuitBreaker:
+    """連続 threshold 回失敗したら cooldown 秒は使わない。明けたら1件だけ試す（half-open）"""
+    __slots__ = ("threshold", "cooldown", "failures", "opened_at", "probing", "trips")
+
+    def __init__(self, threshold: int = 3, cooldown: float = 30.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        st = self.state
+        return st == "closed" or (st == "half-open" and not self.probing)
+
+    def begin(self) -> None:
+        if self.state == "half-open":
+            self.probing = True
+
+    def release(self) -> None:
+        """成否を判定しないまま終わった（取り消し等）"""
+        self.probing = False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+
+class Backend:
+    """プール内の Ollama サーバー1台（重み・提供モデル・統計）"""
+    __slots__ = ("name", "host", "port", "weight", "models", "client", "breaker", "supervisor",
+                 "outstanding", "requests", "errors", "_latency")
+
+    def __init__(self, name: str, host: str, port: int, weight: float = 1.0,
+                 models: Optional[Iterable[str]] = None, pool_size: int = 4,
+                 breaker_threshold: int = 3, breaker_cooldown: float = 30.0) -> None:
+        self.name = name
+        self.host = host
+        self.port = port
+        self.weight = max(float(weight), 0.01)
+        self.models = {m for m in (models or []) if m}
+        self.client = OllamaClient(host, port, pool_size=pool_size)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.supervisor: Optional[OllamaSupervisor] = None
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self._latency: Deque[float] = deque(maxlen=200)
+
+    @property
+    def is_local(self) -> bool:
+        return self.host in _LOCAL_HOSTS
+
+    def serves(self, model: Optional[str]) -> bool:
+        return not self.models or model is None or model in self.models
+
+    def available(self) -> bool:
+        if self.supervisor is not None and not self.supervisor.serving:
+            return False
+        return self.breaker.allow()
+
+    def load(self) -> float:
+        return (self.outstanding + 1) / self.weight
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self._latency)
+
+        def pct(p: float) -> float:
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else 0.0
+
+        return {"name": self.name, "endpoint": f"{self.host}:{self.port}", "weight": self.weight,
+                "outstanding": self.outstanding, "requests": self.requests, "errors": self.errors,
+                "error_rate": round(self.errors / self.requests, 3) if self.requests else 0.0,
+                "latency_p50": pct(0.5), "latency_p95": pct(0.95), "breaker": self.breaker.state,
+                "state": self.supervisor.state if self.supervisor else None}
+
+
+def parse_backends(spec: Any, default_host: str = "127.0.0.1", default_port: int = 11434,
+                   breaker_threshold: int = 3, breaker_cooldown: float = 30.0) -> List[Backend]:
+    """設定の backends（dict のリスト、または "host:port*weight,..." の文字列）から Backend を作る"""
+    breaker = {"breaker_threshold": breaker_threshold, "breaker_cooldown": breaker_cooldown}
+    if isinstance(spec, str):
+        items = []
+        for part in spec.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            addr, _, weight = part.partition("*")
+            host, _, port = addr.rpartition(":") if ":" in addr else (addr, "", "")
+            items.append({"host": host or addr, "port": int(port or default_port), "weight": float(weight or 1)})
+        spec = items
+    backends = []
+    for item in spec or []:
+        host = item.get("host", default_host)
+        port = int(item.get("port", default_port))
+        backends.append(Backend(item.get("name") or f"{host}:{port}", host, port,
+                                weight=item.get("weight", 1), models=item.get("models"), **breaker))
+    return backends or [Backend("local", default_host, default_port, **breaker)]
+
+
+class OllamaPool:
+    """複数の Ollama サーバーへ振り分ける（OllamaClient と同じメソッドを持つ）。
+
+    モデルを提供していて回路が閉じている中から「処理中の数 / 重み」が最小の台を選び、
+    接続できなかったときだけ別の台で再試行する（タイムアウトや 5xx はそのまま呼び出し元へ。
+    遅い生成を台の数だけ繰り返さない）。タイムアウト・5xx も失敗として数え、連続で失敗した台は
+    CircuitBreaker でしばらく外す。ストリームは最初のチャンク前の失敗だけ切り替える。
+    """
+
+    def __init__(self, backends: List[Backend], max_attempts: int = 3) -> None:
+        if not backends:
+            raise ValueError("OllamaPool needs at least one backend")
+        self.backends = backends
+        self.max_attempts = max_attempts
+        self.failovers = 0
+
+    # ===== 選択 =====
+    def _pick(self, model: Optional[str], tried: List[Backend]) -> Optional[Backend]:
+        cands = [b for b in self.backends if b not in tried and b.serves(model) and b.available()]
+        if not cands:
+            return None
+        best = min(b.load() for b in cands)
+        return random.choice([b for b in cands if b.load() == best])
+
+    def serving(self, model: Optional[str] = None) -> bool:
+        return any(b.serves(model) and (b.supervisor is None or b.supervisor.serving) for b in self.backends)
+
+    @staticmethod
+    def _retryable(e: BaseException) -> bool:
+        return isinstance(e, (OllamaConnectionError, aiohttp.ClientConnectionError))
+
+    @staticmethod
+    def _server_fault(e: BaseException) -> bool:
+        """台の不調として回路の失敗に数えるもの"""
+        if isinstance(e, (OllamaConnectionError, aiohttp.ClientError, asyncio.TimeoutError)):
+            return True
+        return isinstance(e, OllamaError) and (e.status or 0) >= 500
+
+    async def _call(self, model: Optional[str], fn: Callable[[OllamaClient], Awaitable[T]]) -> T:
+        tried: List[Backend] = []
+        last: Optional[BaseException] = None
+        for _ in range(self.max_attempts):
+            b = self._pick(model, tried)
+            if b is None:
+                break
+            if tried:
+                self.failovers += 1
+            tried.append(b)
+            b.breaker.begin()
+            b.outstanding += 1
+            b.requests += 1
+            started = time.monotonic()
+            try:
+                out = await fn(b.client)
+            except BaseException as e:
+                if not self._server_fault(e):
+                    # 不正リクエスト等はサーバーの不調ではない（取り消しは判定しない）
+                    b.breaker.success() if isinstance(e, Exception) else b.breaker.release()
+                    raise
+                b.errors += 1
+                b.breaker.failure()
+                if not self._retryable(e):
+                    raise
+                last = e
+                continue
+            finally:
+                b.outstanding -= 1
+            b.breaker.success()
+            b._latency.append(time.monotonic() - started)
+            return out
+        if last is not None:
+            raise last
+        raise OllamaConnectionError(f"no Ollama backend available for {model}")
+
+    # ===== OllamaClient 互換 API =====
+    async def generate(self, model: str, prompt: str, **kw: Any) -> str:
+        return await self._call(model, lambda c: c.generate(model, prompt, **kw))
+
+    async def chat(self, model: str, messages: List[Dict[str, str]], **kw: Any) -> str:
+        return await self._call(model, lambda c: c.chat(model, messages, **kw))
+
+    async def embed(self, model: str, inputs: List[str], **kw: Any) -> List[List[float]]:
+        return await self._call(model, lambda c: c.embed(model, inputs, **kw))
+
+    async def generate_stream(self, model: str, prompt: str, **kw: Any) -> AsyncIterator[str]:
+        tried: List[Backend] = []
+        last: Optional[BaseException] = None
+        for _ in range(self.max_attempts):
+            b = self._pick(model, tried)
+            if b is None:
+                break
+            if tried:
+                self.failovers += 1
+            tried.append(b)
+            b.breaker.begin()
+            b.outstanding += 1
+            b.requests += 1
+            started = time.monotonic()
+            first = True
+            try:
+                async for chunk in b.client.generate_stream(model, prompt, **kw):
+                    if first:
+                        first = False
+                        b._latency.append(time.monotonic() - started)   # 最初のトークンまでの時間
+                    yield chunk
+            except BaseException as e:
+                if not self._server_fault(e):
+                    b.breaker.success() if isinstance(e, Exception) else b.breaker.release()
+                    raise
+                b.errors += 1
+                b.breaker.failure()
+                if not first or not self._retryable(e):
+                    raise                       # 途中まで送った後は切り替えない
+                last = e
+                continue
+            finally:
+                b.outstanding -= 1
+            b.breaker.success()
+            return
+        if last is not None:
+            raise last
+        raise OllamaConnectionError(f"no Ollama backend available for {model}")
+
+    async def version(self, timeout: float = 5) -> Optional[str]:
+        for b in self.backends:
+            v = await b.client.version(timeout)
+            if v:
+                return v
+        return None
+
+    # ===== 監視・後始末 =====
+    def supervise(self, model: str, autostart: bool = True, **kw: Any) -> List[OllamaSupervisor]:
+        """model を提供する各台に監視を付ける（起動し直すのはローカルの台だけ）"""
+        sups = []
+        for b in self.backends:
+            if b.serves(model):
+                b.supervisor = OllamaSupervisor(b.client, model, autostart=autostart and b.is_local, **kw)
+                sups.append(b.supervisor)
+        return sups
+
+    async def close(self) -> None:
+        for b in self.backends:
+            if b.supervisor is not None:
+                await b.supervisor.stop()
+            await b.client.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"failovers": self.failovers, "backends": [b.stats() for b in self.backends]}
@@ -0,0 +1,173 @@
+# ollama_supervisor.py
+from __future__ import annotations
+import asyncio
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from lib.ollama_client import OllamaClient, OllamaError
+
+
+def _same_model(loaded: str, model: str) -> bool:
+    # /api/ps は "name:tag" で返すので、タグ省略時の ":latest" を補って比べる
+    norm = lambda m: m if ":" in m else m + ":latest"   # noqa: E731
+    return norm(loaded) == norm(model)
+
+
+class OllamaSupervisor:
+    """Ollama サーバーを見張るバックグラウンドタスク。
+
+    interval 秒ごとに /api/version で死活確認し、fail_threshold 回続けて応答が
+    無ければ start_cmd でサーバーを起動し直す（autostart 時）。応答があれば
+    /api/ps で model が載っているか確かめ、外れていたら keep_alive 付きの空生成で
+    読み込み直す。state / serving は要求処理側が即座に失敗させる判断に使う。
+    """
+
+    def __init__(self, client: OllamaClient, model: str, *, interval: float = 15.0,
+                 keep_alive: str = "30m", autostart: bool = True,
+                 start_cmd: Sequence[str] = ("ollama", "serve"), start_timeout: float = 20.0,
+                 fail_threshold: int = 2, warm_timeout: float = 300.0) -> None:
+        self.client = client
+        self.model = model
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self.autostart = autostart
+        self.start_cmd: List[str] = list(start_cmd)
+        self.start_timeout = start_timeout
+        self.fail_threshold = fail_threshold
+        self.warm_timeout = warm_timeout
+        self.state = "starting"         # starting（初回確認前）/ down / loading（モデル読み込み中）/ ready
+        self.version: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_check = 0.0
+        self.failures = 0
+        self.restarts = 0
+        self.warmups = 0
+        self.warm_seconds = 0.0
+        self._proc: Optional[subprocess.Popen] = None
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    # ===== 状態 =====
+    @property
+    def serving(self) -> bool:
+        """要求を送ってよいか（未確認の間は送ってみる）"""
+        return self.state != "down"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _set(self, state: str, error: Optional[str] = None) -> None:
+        if state != self.state:
+            print(f"(ollama supervisor) {self.state} -> {state}" + (f": {error}" if error else ""))
+        self.state = state
+        if error:
+            self.last_error = error
+        self._changed.set()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self.ready:
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                return False
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), remain)
+            except asyncio.TimeoutError:
+                return self.ready
+        return True
+
+    # ===== 起動・読み込み =====
+    def _spawn(self) -> None:
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()           # 応答しないまま残っている自前のサーバーは落としてから
+        self._proc = subprocess.Popen(self.start_cmd, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL, start_new_session=True)
+        self.restarts += 1
+
+    async def start_server(self) -> bool:
+        print(f"🚀 starting {' '.join(self.start_cmd)}…")
+        try:
+            self._spawn()
+        except OSError as e:
+            self._set("down", f"start failed: {e}")
+            return False
+        started = time.monotonic()
+        while time.monotonic() - started < self.start_timeout:
+            await asyncio.sleep(1)
+            self.version = await self.client.version(timeout=2)
+            if self.version:
+                print(f"✅ ollama ready ({time.monotonic() - started:.0f}s)")
+                return True
+        return False
+
+    async def warm(self) -> bool:
+        """空プロンプトの生成でモデルを読み込み、keep_alive の間メモリに留める"""
+        self._set("loading")
+        started = time.monotonic()
+        try:
+            await self.client.generate(self.model, "", keep_alive=self.keep_alive, timeout=self.warm_timeout)
+        except (OllamaError, asyncio.TimeoutError) as e:
+            self._set("down" if self.version is None else "loading", f"warm failed: {e}")
+            return False
+        self.warmups += 1
+        self.warm_seconds = time.monotonic() - started
+        return True
+
+    # ===== 監視ループ =====
+    async def check_once(self) -> str:
+        self.last_check = time.time()
+        crashed = self._proc is not None and self._proc.poll() is not None
+        if crashed:
+            self._proc = None           # 自前で起動したサーバーが終了した（別のサーバーが居ればそれを使う）
+        self.version = await self.client.version(timeout=3)
+        if self.version is None:
+            self.failures += 1
+            # 一時的な無応答1回では落ちた扱いにしない（起動直後・プロセス終了は即判定）
+            confirmed = crashed or self.state == "starting" or self.failures >= self.fail_threshold
+            if not confirmed:
+                return self.state
+            self._set("down", "process exited" if crashed else "no response")
+            if self.autostart:
+                if await self.start_server():
+                    self.failures = 0
+                else:
+                    return self.state
+            else:
+                return self.state
+        self.failures = 0
+        loaded = await self.client.ps(timeout=3)
+        if loaded is not None and any(_same_model(m, self.model) for m in loaded if m):
+            self._set("ready")
+        elif await self.warm():
+            self._set("ready")
+        return self.state
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check_once()
+            except Exception as e:
+                self._set("down", f"{type(e).__name__}: {e}")
+            # 落ちている間は短い間隔で確認する
+            await asyncio.sleep(min(self.interval, 3.0) if self.state == "down" else self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "version": self.version, "model": self.model,
+                "keep_alive": self.keep_alive, "restarts": self.restarts, "warmups": self.warmups,
+                "warm_seconds": round(self.warm_seconds, 1), "last_error": self.last_error}
@@ -0,0 +1,71 @@
+# plugins.py
+from __future__ import annotations
+import time
+from typing import Any, Dict, Iterable, List
+
+# Bot 本体（konnichiwaDbot.py）に組み込みの機能。features.enabled に書いたものだけ動く
+CORE_FEATURES = ("moderation", "chat")
+
+# features.enabled の短い名前 → discord.py の extension（async def setup(bot) を持つモジュール）。
+# ここに無い名前はモジュール名（例: "feauture.my_feature"）としてそのまま読み込む
+EXTENSIONS: Dict[str, str] = {
+    "archive": "feauture.get_message_discord",     # /getch /archive /search
+}
+
+
+def parse_features(value: Any) -> List[str]:
+    """設定値（リスト、または "a,b" 形式の文字列）を順序を保った重複なしのリストにする"""
+    if value is None:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    out: List[str] = []
+    for item in items:
+        name = str(item).strip()
+        if name and name not in out:
+            out.append(name)
+    return out
+
+
+def extension_name(feature: str) -> str:
+    return EXTENSIONS.get(feature, feature)
+
+
+class FeatureLoader:
+    """有効な機能の一覧と、本体に無い機能の extension 読み込み。
+
+    extension のモジュール（と discord.app_commands・sqlite 索引などの依存）は load_all まで
+    import しないので、使わない機能は起動時間にもメモリにも影響しない。
+    1つ失敗しても残りは読み込み、失敗理由は stats() で確認できる。
+    """
+
+    def __init__(self, features: Iterable[str]) -> None:
+        self.features = list(features)
+        self.loaded: Dict[str, float] = {}      # 機能名 → 読み込みにかかった秒数
+        self.failed: Dict[str, str] = {}
+
+    def enabled(self, feature: str) -> bool:
+        return feature in self.features
+
+    @property
+    def extensions(self) -> List[str]:
+        return [f for f in self.features if f not in CORE_FEATURES]
+
+    async def load_all(self, bot: Any) -> None:
+        for feature in self.extensions:
+            if feature in self.loaded:
+                continue
+            started = time.perf_counter()
+            try:
+                await bot.load_extension(extension_name(feature))
+            except Exception as e:
+                self.failed[feature] = f"{type(e).__name__}: {e}"
+                print(f"(feature {feature} failed to load): {e}")
+                continue
+            self.loaded[feature] = time.perf_counter() - started
+            self.failed.pop(feature, None)
+            print(f"🧩 feature loaded: {feature} ({self.loaded[feature] * 1000:.0f}ms)")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": list(self.features),
+                "loaded": {k: round(v * 1000, 1) for k, v in self.loaded.items()},
+                "failed": dict(self.failed)}
@@ -0,0 +1,172 @@
+# rate_limiter.py
+from __future__ import annotations
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+Clock = Callable[[], float]
+
+
+class _Ring:
+    """直近 limit 件の許可時刻だけを持つ固定長リングバッファ"""
+    __slots__ = ("pos", "times")
+
+    def __init__(self, limit: int) -> None:
+        self.pos = 0
+        self.times = array("d", [float("-inf")] * limit)
+
+    @property
+    def newest(self) -> float:
+        return self.times[self.pos - 1]
+
+
+class SlidingWindowLimiter:
+    """スライディングウィンドウ方式の連投制限（1回の判定が O(1)）。
+
+    「window 秒以内に許可済みの投稿が limit 件あれば拒否、拒否した投稿は数えない」
+    という従来のリスト実装と同じ判定を、ユーザー毎 limit 個の時刻だけで行う。
+    最後の許可から idle_after 秒経ったユーザーは状態ごと捨てる（判定は変わらない）。
+    """
+
+    def __init__(self, limit: int, window: float, idle_after: Optional[float] = None,
+                 clock: Clock = time.time) -> None:
+        self.limit = limit
+        self.window = window
+        self.idle_after = max(window, idle_after or window)
+        self.clock = clock
+        self._users: "OrderedDict[Hashable, _Ring]" = OrderedDict()
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """True なら制限超過（記録しない）、False なら許可して記録する"""
+        now = self.clock() if now is None else now
+        self.evict_idle(now)
+        ring = self._users.get(key)
+        if ring is None:
+            ring = self._users[key] = _Ring(self.limit)
+        # limit 件前の許可がまだウィンドウ内なら、ウィンドウ内に limit 件ある
+        if now - ring.times[ring.pos] <= self.window:
+            return True
+        ring.times[ring.pos] = now
+        ring.pos = (ring.pos + 1) % self.limit
+        self._users.move_to_end(key)
+        return False
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = self.clock() if now is None else now
+        evicted = 0
+        while self._users:
+            key, ring = next(iter(self._users.items()))
+            if now - ring.newest <= self.idle_after:
+                break
+            del self._users[key]
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def memory_bytes(self) -> int:
+        total = sys.getsizeof(self._users)
+        for ring in self._users.values():
+            total += sys.getsizeof(ring) + sys.getsizeof(ring.times)
+        return total
+
+
+class TokenBucketLimiter:
+    """トークンバケット方式（limit 個まで溜まり、window 秒で limit 個回復）。
+
+    平均レートは同じだがバースト後の回復が連続的になるため、判定は従来と完全一致しない。
+    """
+
+    def __init__(self, limit: int, window: float, idle_after: Optional[float] = None,
+                 clock: Clock = time.time) -> None:
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+        self.idle_after = max(window, idle_after or window)
+        self.clock = clock
+        # key -> array('d', [tokens, updated_at])
+        self._users: "OrderedDict[Hashable, array]" = OrderedDict()
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = self.clock() if now is None else now
+        self.evict_idle(now)
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = array("d", [float(self.limit), now])
+        tokens = min(float(self.limit), state[0] + (now - state[1]) * self.rate)
+        state[1] = now
+        self._users.move_to_end(key)
+        if tokens < 1.0:
+            state[0] = tokens
+            return True
+        state[0] = tokens - 1.0
+        return False
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = self.clock() if now is None else now
+        evicted = 0
+        while self._users:
+            key, state = next(iter(self._users.items()))
+            if now - state[1] <= self.idle_after:
+                break
+            del self._users[key]
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self._users) + sum(sys.getsizeof(s) for s in self._users.values())
+
+
+class ViolationCounter:
+    """window 秒以内の違反回数を数える（古い記録は先頭から捨てる）"""
+
+    def __init__(self, window: float, clock: Clock = time.time) -> None:
+        self.window = window
+        self.clock = clock
+        self._users: "OrderedDict[Hashable, Deque[float]]" = OrderedDict()
+
+    def record(self, key: Hashable, now: Optional[float] = None) -> int:
+        """違反を1件記録し、ウィンドウ内の違反数を返す"""
+        now = self.clock() if now is None else now
+        self.evict_idle(now)
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = deque()
+        while bucket and now - bucket[0] > self.window:
+            bucket.popleft()
+        bucket.append(now)
+        self._users.move_to_end(key)
+        return len(bucket)
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = self.clock() if now is None else now
+        evicted = 0
+        while self._users:
+            key, bucket = next(iter(self._users.items()))
+            if now - bucket[-1] <= self.window:
+                break
+            del self._users[key]
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self._users) + sum(sys.getsizeof(b) for b in self._users.values())
+
+
+LIMITERS: Dict[str, type] = {
+    "sliding": SlidingWindowLimiter,
+    "token_bucket": TokenBucketLimiter,
+}
+
+
+def make_limiter(kind: str, limit: int, window: float, **kwargs):
+    return LIMITERS.get(kind, SlidingWindowLimiter)(limit, window, **kwargs)
@@ -0,0 +1,128 @@
+# rate_state.py
+from __future__ import annotations
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Hashable, Optional
+
+from lib.rate_limiter import Clock, ViolationCounter, make_limiter
+
+
+class MemoryRateState:
+    """プロセス内だけで持つ連投制限・違反状態（既定）"""
+
+    def __init__(self, limit: int, window: float, violation_window: float,
+                 algorithm: str = "sliding", clock: Clock = time.time) -> None:
+        self.algorithm = algorithm
+        self.clock = clock
+        self.limiter = make_limiter(algorithm, limit, window, clock=clock)
+        self.violations = ViolationCounter(violation_window, clock=clock)
+
+    def reconfigure(self, limit: int, window: float, violation_window: float) -> None:
+        """設定変更を反映（連投の判定状態は作り直し、違反の記録は残す）"""
+        if (limit, window) != (self.limiter.limit, self.limiter.window):
+            self.limiter = make_limiter(self.algorithm, limit, window, clock=self.clock)
+        self.violations.window = violation_window
+
+    def hit(self, key: Hashable) -> bool:
+        return self.limiter.hit(key)
+
+    def record_violation(self, key: Hashable) -> int:
+        return self.violations.record(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory",
+                "users": len(self.limiter), "mem": self.limiter.memory_bytes(),
+                "violation_users": len(self.violations), "violation_mem": self.violations.memory_bytes()}
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteRateState:
+    """複数プロセス（シャード）で共有する連投制限・違反状態。
+
+    WAL モードの SQLite に時刻を記録し、判定と記録は BEGIN IMMEDIATE の
+    トランザクション内で行うので、同じユーザーへの同時アクセスでも数え漏れない。
+    判定は MemoryRateState の sliding と同じ。
+    """
+
+    def __init__(self, path: str, limit: int, window: float, violation_window: float,
+                 clock: Clock = time.time, busy_timeout: float = 5.0, sweep_every: int = 500) -> None:
+        self.limit = limit
+        self.window = window
+        self.violation_window = violation_window
+        self.clock = clock
+        self.sweep_every = sweep_every
+        self._ops = 0
+        p = Path(path).expanduser()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(p.as_posix(), timeout=busy_timeout, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS posts (user_id INTEGER NOT NULL, ts REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS posts_user_ts ON posts(user_id, ts)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS violations (user_id INTEGER NOT NULL, ts REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS violations_user_ts ON violations(user_id, ts)")
+
+    def _sweep(self, now: float) -> None:
+        # しばらく投稿の無いユーザーの行をまとめて削除（判定には影響しない）
+        self._ops += 1
+        if self._ops % self.sweep_every:
+            return
+        self._db.execute("DELETE FROM posts WHERE ts < ?", (now - self.window,))
+        self._db.execute("DELETE FROM violations WHERE ts < ?", (now - self.violation_window,))
+
+    def hit(self, key: Hashable, now: Optional[float] = None) -> bool:
+        now = self.clock() if now is None else now
+        cur = self._db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("DELETE FROM posts WHERE user_id = ? AND ts < ?", (key, now - self.window))
+            (count,) = cur.execute("SELECT COUNT(*) FROM posts WHERE user_id = ?", (key,)).fetchone()
+            limited = count >= self.limit
+            if not limited:
+                cur.execute("INSERT INTO posts VALUES (?, ?)", (key, now))
+            self._sweep(now)
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        return limited
+
+    def reconfigure(self, limit: int, window: float, violation_window: float) -> None:
+        """設定変更を反映（記録済みの時刻はそのまま新しい条件で数え直される）"""
+        self.limit = limit
+        self.window = window
+        self.violation_window = violation_window
+
+    def record_violation(self, key: Hashable, now: Optional[float] = None) -> int:
+        now = self.clock() if now is None else now
+        cur = self._db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("DELETE FROM violations WHERE user_id = ? AND ts < ?",
+                        (key, now - self.violation_window))
+            cur.execute("INSERT INTO violations VALUES (?, ?)", (key, now))
+            (count,) = cur.execute("SELECT COUNT(*) FROM violations WHERE user_id = ?", (key,)).fetchone()
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        (users,) = self._db.execute("SELECT COUNT(DISTINCT user_id) FROM posts").fetchone()
+        (vusers,) = self._db.execute("SELECT COUNT(DISTINCT user_id) FROM violations").fetchone()
+        return {"backend": "sqlite", "users": users, "violation_users": vusers}
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def make_rate_state(backend: str, limit: int, window: float, violation_window: float,
+                    algorithm: str = "sliding", path: str = "data/ratelimit.sqlite3",
+                    clock: Clock = time.time):
+    if backend == "sqlite":
+        return SQLiteRateState(path, limit, window, violation_window, clock=clock)
+    return MemoryRateState(limit, window, violation_window, algorithm, clock=clock)
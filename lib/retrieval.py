@@ -0,0 +1,450 @@
+# retrieval.py
+from __future__ import annotations
+import asyncio
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+from importlib.util import find_spec
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from lib.ollama_client import OllamaClient, OllamaError
+
+# numpy は import に 100ms 近くかかるので、索引を初めて作るときに読み込む
+HAS_NUMPY = find_spec("numpy") is not None
+np: Any = None
+
+
+def _load_numpy() -> Any:
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+class VectorIndex:
+    """正規化済み float32 ベクトルを1枚の行列に詰めた検索索引（numpy 必須）。
+
+    容量は倍々で確保し、検索は行列×ベクトル1回 + argpartition で上位 k 件を取る。
+    行ごとにギルドとチャンネルを持ち、検索は閲覧できるチャンネルに絞れる。
+    削除は最終行を空いた行へ移すだけ（O(次元数)）。
+    <path>.npz にベクトルと ID、<path>.json に本文を保存する。
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        if not HAS_NUMPY:
+            raise RuntimeError("numpy が必要です（pip install numpy）")
+        _load_numpy()
+        self.path = path
+        self._vecs = np.zeros((0, 0), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._guilds = np.zeros(0, dtype=np.int64)
+        self._channels = np.zeros(0, dtype=np.int64)      # 0 = 不明（チャンネルを記録する前の索引）
+        self._texts: List[str] = []
+        self._row: Dict[int, int] = {}
+        self.size = 0
+        if path and os.path.exists(path + ".npz"):
+            try:
+                self.load()
+            except (OSError, ValueError, KeyError) as e:
+                # 壊れた索引は使わない（次の保存で作り直し、!ragindex で戻せる）
+                print(f"(retrieval) ignoring broken index {path}: {e}")
+
+    @property
+    def dim(self) -> int:
+        return self._vecs.shape[1]
+
+    def __contains__(self, msg_id: int) -> bool:
+        return msg_id in self._row
+
+    def _reserve(self, n: int, dim: int) -> None:
+        if self.dim and dim != self.dim:
+            raise ValueError(f"embedding dim mismatch: {dim} != {self.dim}")
+        cap = self._vecs.shape[0]
+        if self.size + n <= cap and self.dim:
+            return
+        new_cap = max(1024, cap)
+        while new_cap < self.size + n:
+            new_cap *= 2
+        vecs = np.zeros((new_cap, dim), dtype=np.float32)
+        if self.size:
+            vecs[:self.size] = self._vecs[:self.size]
+        ids = np.zeros(new_cap, dtype=np.int64)
+        ids[:self.size] = self._ids[:self.size]
+        guilds = np.zeros(new_cap, dtype=np.int64)
+        guilds[:self.size] = self._guilds[:self.size]
+        channels = np.zeros(new_cap, dtype=np.int64)
+        channels[:self.size] = self._channels[:self.size]
+        self._vecs, self._ids, self._guilds, self._channels = vecs, ids, guilds, channels
+
+    def add(self, ids: List[int], guild_ids: List[int], channel_ids: List[int],
+            vectors: List[List[float]], texts: List[str]) -> int:
+        keep = [i for i, (mid, v) in enumerate(zip(ids, vectors)) if v and mid not in self._row]
+        if not keep:
+            return 0
+        mat = np.asarray([vectors[i] for i in keep], dtype=np.float32)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        mat /= np.maximum(norms, 1e-12)          # 内積 = コサイン類似度
+        self._reserve(len(keep), mat.shape[1])
+        start = self.size
+        self._vecs[start:start + len(keep)] = mat
+        for j, i in enumerate(keep):
+            self._ids[start + j] = ids[i]
+            self._guilds[start + j] = guild_ids[i] or 0
+            self._channels[start + j] = channel_ids[i] or 0
+            self._row[ids[i]] = start + j
+            self._texts.append(texts[i])
+        self.size += len(keep)
+        return len(keep)
+
+    def remove(self, msg_id: int) -> bool:
+        """削除されたメッセージを索引から外す（最終行を空いた行へ詰める）"""
+        r = self._row.pop(msg_id, None)
+        if r is None:
+            return False
+        last = self.size - 1
+        if r != last:
+            self._vecs[r] = self._vecs[last]
+            self._ids[r] = self._ids[last]
+            self._guilds[r] = self._guilds[last]
+            self._channels[r] = self._channels[last]
+            self._texts[r] = self._texts[last]
+            self._row[int(self._ids[r])] = r
+        self._texts.pop()
+        self.size = last
+        return True
+
+    def fill_channel(self, msg_id: int, channel_id: int) -> bool:
+        """チャンネル不明（旧形式の索引）の行にチャンネルを記録する"""
+        r = self._row.get(msg_id)
+        if r is None or self._channels[r] or not channel_id:
+            return False
+        self._channels[r] = channel_id
+        return True
+
+    def search(self, vector: List[float], k: int = 5, guild_id: Optional[int] = None,
+               min_score: float = 0.0, exclude: Tuple[int, ...] = (),
+               channel_ids: Optional[Iterable[int]] = None) -> List[Tuple[float, int, str]]:
+        if not self.size or not vector or len(vector) != self.dim:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        scores = self._vecs[:self.size] @ q
+        if guild_id is not None:
+            scores = np.where(self._guilds[:self.size] == guild_id, scores, -np.inf)
+        if channel_ids is not None:
+            allowed = np.fromiter(channel_ids, dtype=np.int64)
+            scores = np.where(np.isin(self._channels[:self.size], allowed), scores, -np.inf)
+        want, k = k, min(k + len(exclude), self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        out = []
+        for r in top:
+            s, mid = float(scores[r]), int(self._ids[r])
+            if s < min_score or mid in exclude:     # -inf（対象外のギルド/チャンネル）もここで落ちる
+                continue
+            out.append((s, mid, self._texts[r]))
+        return out[:want]
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """保存する中身のコピー（イベントループ上で取り、書き込みだけスレッドへ回す）"""
+        if not self.path or (not self.size and not os.path.exists(self.path + ".npz")):
+            return None
+        n = self.size
+        return {"vecs": self._vecs[:n].copy(), "ids": self._ids[:n].copy(), "guilds": self._guilds[:n].copy(),
+                "channels": self._channels[:n].copy(), "texts": list(self._texts)}
+
+    def write(self, snap: Optional[Dict[str, Any]]) -> None:
+        if snap is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, vecs=snap["vecs"], ids=snap["ids"], guilds=snap["guilds"], channels=snap["channels"])
+        with open(tmp + ".json", "w", encoding="utf-8") as f:
+            json.dump(snap["texts"], f, ensure_ascii=False)
+        os.replace(tmp, self.path + ".npz")
+        os.replace(tmp + ".json", self.path + ".json")
+
+    def load(self) -> None:
+        with np.load(self.path + ".npz") as data:
+            vecs, ids, guilds = data["vecs"], data["ids"], data["guilds"]
+            channels = data["channels"] if "channels" in data.files else np.zeros_like(ids)
+        with open(self.path + ".json", encoding="utf-8") as f:
+            texts = json.load(f)
+        if not (len(vecs) == len(ids) == len(guilds) == len(channels) == len(texts)):
+            raise ValueError(f"rows do not match: vecs={len(vecs)} ids={len(ids)} texts={len(texts)}")
+        self._vecs, self._ids, self._guilds, self._channels, self._texts = vecs, ids, guilds, channels, texts
+        self.size = len(ids)
+        self._row = {int(mid): i for i, mid in enumerate(ids)}
+
+    def memory_bytes(self) -> int:
+        return int(self._vecs.nbytes + self._ids.nbytes + self._guilds.nbytes + self._channels.nbytes)
+
+
+class Retriever:
+    """サーバーの過去ログを埋め込み検索し、関連発言をプロンプトに添える。
+
+    新着メッセージは observe() でためて batch_size 件か interval 秒ごとに
+    まとめて埋め込み、索引へ追加する。埋め込みモデルが無いなどで失敗したら
+    cooldown 秒は検索・追加を止めて元のプロンプトのまま返す。
+    索引（numpy と保存済みベクトル）は初めて使うときか warm() で読み込む。
+    削除されたメッセージは forget() で索引から外し、ID を <path>.deleted.json に
+    残して（max_tombstones 件まで）再起動後やエクスポートの取り込みでも戻さない。
+    """
+
+    def __init__(self, client: OllamaClient, model: str, path: Optional[str] = None, *,
+                 k: int = 4, min_score: float = 0.35, batch_size: int = 32, interval: float = 5.0,
+                 min_chars: int = 8, save_every: int = 1000, cooldown: float = 300.0,
+                 max_tombstones: int = 100_000) -> None:
+        self.client = client
+        self.model = model
+        self.path = path
+        self._index: Optional[VectorIndex] = None
+        self._index_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_seq = 0
+        self._saved_seq = 0
+        self.k = k
+        self.min_score = min_score
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_chars = min_chars
+        self.save_every = save_every
+        self.cooldown = cooldown
+        self.max_tombstones = max_tombstones
+        self._tombstones: Dict[int, None] = {}     # 削除済みの ID（挿入順 = 古い順に捨てる）
+        self._removed = 0                           # 未保存の削除数（次の flush ですぐ保存する）
+        self._pending: Deque[Tuple[int, int, int, str]] = deque()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._unsaved = 0
+        self._disabled_until = 0.0
+        self.embedded = 0
+        self.embed_seconds = 0.0
+        self.errors = 0
+        self._query_ms: Deque[float] = deque(maxlen=200)
+        self._search_ms: Deque[float] = deque(maxlen=200)
+
+    @property
+    def index(self) -> VectorIndex:
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._load_tombstones()
+                    self._index = VectorIndex(self.path)
+        return self._index
+
+    def _load_tombstones(self) -> None:
+        if not self.path or not os.path.exists(self.path + ".deleted.json"):
+            return
+        try:
+            with open(self.path + ".deleted.json", encoding="utf-8") as f:
+                for mid in json.load(f):
+                    self._tombstones.setdefault(int(mid), None)
+        except (OSError, ValueError, TypeError) as e:
+            print(f"(retrieval) could not read tombstones: {e}")
+
+    async def warm(self) -> None:
+        """索引の読み込みをイベントループの外で済ませておく（起動直後に呼ぶ）"""
+        await asyncio.to_thread(lambda: self.index)
+
+    @staticmethod
+    def format_entry(author: str, created_at: str, content: str) -> str:
+        return f"[{created_at[:10]}] {author}: {content}"
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._disabled_until
+
+    async def _embed(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        try:
+            vecs = await self.client.embed(self.model, texts)
+        except (OllamaError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            self._disabled_until = time.monotonic() + self.cooldown
+            print(f"(retrieval disabled for {self.cooldown:.0f}s: {e})")
+            return []
+        self.embed_seconds += time.perf_counter() - started
+        self.embedded += len(texts)
+        return vecs
+
+    # ===== 索引の追加 =====
+    def observe(self, msg_id: int, guild_id: int, channel_id: int, author: str, created_at: str,
+                content: str) -> None:
+        """新着メッセージを索引待ちに積む（埋め込みはバックグラウンドでまとめて行う）"""
+        content = content.strip()
+        if (len(content) < self.min_chars or msg_id in self.index or msg_id in self._tombstones
+                or not self._available()):
+            return
+        self._pending.append((msg_id, guild_id, channel_id, self.format_entry(author, created_at, content)))
+        self._ensure_task()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def forget(self, msg_id: int) -> None:
+        """削除されたメッセージを索引・索引待ちから外し、以後は取り込まない"""
+        self._tombstones.pop(msg_id, None)
+        self._tombstones[msg_id] = None
+        while len(self._tombstones) > self.max_tombstones:
+            del self._tombstones[next(iter(self._tombstones))]
+        if any(p[0] == msg_id for p in self._pending):
+            self._pending = deque(p for p in self._pending if p[0] != msg_id)
+        self.index.remove(msg_id)
+        self._removed += 1
+        self._ensure_task()
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        added = 0
+        while self._pending and self._available():
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            added += await self._add_batch(batch)
+        if not self._available():
+            self._pending.clear()       # 埋め込みが使えない間の分は捨てる（再起動時に溜め込まない）
+        if self._unsaved >= self.save_every or self._removed:
+            await self._save_async()
+        return added
+
+    async def _add_batch(self, batch: List[Tuple[int, int, int, str]]) -> int:
+        vecs = await self._embed([b[3] for b in batch])
+        if len(vecs) != len(batch):
+            return 0
+        # 埋め込み中に削除されたものは入れない
+        keep = [i for i, b in enumerate(batch) if b[0] not in self._tombstones]
+        batch, vecs = [batch[i] for i in keep], [vecs[i] for i in keep]
+        n = self.index.add([b[0] for b in batch], [b[1] for b in batch], [b[2] for b in batch],
+                           vecs, [b[3] for b in batch])
+        self._unsaved += n
+        return n
+
+    async def ingest_export(self, path: str, guild_id: Optional[int] = None) -> int:
+        """エクスポート済み JSONL(.gz) を読み、未登録のメッセージをまとめて埋め込む"""
+        opener = gzip.open if path.endswith(".gz") else open
+        added = 0
+        batch: List[Tuple[int, int, int, str]] = []
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    msg_id = int(rec["id"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                content = (rec.get("content") or "").strip()
+                if msg_id in self.index:
+                    # 旧形式の索引にはチャンネルが無い（不明な行は検索で使われない）ので補う
+                    self._unsaved += self.index.fill_channel(msg_id, rec.get("channel_id") or 0)
+                    continue
+                if len(content) < self.min_chars or msg_id in self._tombstones:
+                    continue
+                text = self.format_entry(rec.get("author") or "?", rec.get("created_at") or "", content)
+                batch.append((msg_id, rec.get("guild_id") or guild_id or 0, rec.get("channel_id") or 0, text))
+                if len(batch) >= self.batch_size:
+                    if not self._available():
+                        return added
+                    added += await self._add_batch(batch)
+                    batch = []
+        if batch and self._available():
+            added += await self._add_batch(batch)
+        return added
+
+    async def ingest_dir(self, root: str) -> int:
+        added = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != "attachments"]
+            for name in sorted(filenames):
+                if name.endswith((".jsonl", ".jsonl.gz")):
+                    added += await self.ingest_export(os.path.join(dirpath, name))
+        await self._save_async()
+        return added
+
+    # ===== 検索 =====
+    async def search(self, text: str, guild_id: Optional[int], exclude: Tuple[int, ...] = (),
+                     channel_ids: Optional[Iterable[int]] = None) -> List[Tuple[float, int, str]]:
+        if not self.index.size or not self._available():
+            return []
+        started = time.perf_counter()
+        vecs = await self._embed([text])
+        if not vecs:
+            return []
+        t1 = time.perf_counter()
+        hits = self.index.search(vecs[0], self.k, guild_id, self.min_score, exclude, channel_ids)
+        t2 = time.perf_counter()
+        self._query_ms.append((t2 - started) * 1000)
+        self._search_ms.append((t2 - t1) * 1000)
+        return hits
+
+    async def augment(self, prompt: str, guild_id: Optional[int], exclude: Tuple[int, ...] = (),
+                      channel_ids: Optional[Iterable[int]] = None) -> str:
+        """関連する過去の発言があればプロンプトの前に添える（channel_ids を渡すとそのチャンネルの発言だけ）"""
+        hits = await self.search(prompt, guild_id, exclude, channel_ids)
+        if not hits:
+            return prompt
+        context = "\n".join(f"- {text[:300]}" for _, _, text in hits)
+        return f"以下はこのサーバーでの過去の発言です（必要なら参考にしてください）:\n{context}\n\n質問: {prompt}"
+
+    # ===== 保存 =====
+    def _snapshot(self) -> Tuple[int, Optional[Dict[str, Any]], Optional[List[int]]]:
+        """索引と削除済み ID のコピーを取る（ループ上で呼ぶ。以後の変更は次の保存に回る）"""
+        self._save_seq += 1
+        snap = self._index.snapshot() if self._index is not None else None
+        tombstones = list(self._tombstones) if self.path and self._removed else None
+        self._unsaved = 0
+        self._removed = 0
+        return self._save_seq, snap, tombstones
+
+    def _write(self, seq: int, snap: Optional[Dict[str, Any]], tombstones: Optional[List[int]]) -> None:
+        with self._save_lock:
+            if seq < self._saved_seq:
+                return          # 後から取ったコピーを先に書き終えていた
+            self._saved_seq = seq
+            if self._index is not None:
+                self._index.write(snap)
+            if tombstones is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                tmp = self.path + ".deleted.json.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(tombstones, f)
+                os.replace(tmp, self.path + ".deleted.json")
+
+    async def _save_async(self) -> None:
+        await asyncio.to_thread(self._write, *self._snapshot())
+
+    def save(self) -> None:
+        self._write(*self._snapshot())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        rate = self.embedded / self.embed_seconds if self.embed_seconds else 0.0
+        return {"vectors": self.index.size, "dim": self.index.dim,
+                "memory_mb": round(self.index.memory_bytes() / 1e6, 1),
+                "pending": len(self._pending), "deleted": len(self._tombstones), "embed_per_sec": round(rate, 1), "errors": self.errors,
+                "query_p50_ms": round(_percentile(list(self._query_ms), 0.5), 1),
+                "query_p95_ms": round(_percentile(list(self._query_ms), 0.95), 1),
+                "search_p50_ms": round(_percentile(list(self._search_ms), 0.5), 2)}
@@ -0,0 +1,226 @@
+# scheduler.py
+from __future__ import annotations
+import asyncio
+import itertools
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional
+
+
+class QueueFull(Exception):
+    """キューが上限に達したため受付を拒否した（ロードシェディング）"""
+
+
+class JobCancelled(Exception):
+    """ジョブが取り消された（元メッセージ削除など。LLMCache.cancel_group から届く）"""
+
+
+class _Job:
+    __slots__ = ("job_id", "guild_id", "user_id", "enqueued", "fut", "moved")
+
+    def __init__(self, job_id: Any, guild_id: int, user_id: int) -> None:
+        self.job_id = job_id
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.enqueued = time.monotonic()
+        self.fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.moved = asyncio.Event()
+
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class FairScheduler:
+    """LLM ジョブの公平スケジューラ。
+
+    ギルド間を（重み付き）ラウンドロビンで、同じギルド内ではユーザー間を
+    ラウンドロビンで回し、同じユーザーのジョブは到着順に処理する。
+    """
+
+    def __init__(self, concurrency: int = 1, max_queue: int = 50, max_per_user: int = 3,
+                 guild_weights: Optional[Dict[int, int]] = None, history: int = 1000) -> None:
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.guild_weights: Dict[int, int] = dict(guild_weights or {})
+        # guild_id -> user_id -> [jobs]（OrderedDict の先頭が次の順番）
+        self._queues: "OrderedDict[int, OrderedDict[int, Deque[_Job]]]" = OrderedDict()
+        self._credits: Dict[int, int] = {}
+        self._jobs: Dict[Any, _Job] = {}
+        self._running = 0
+        self._queued = 0
+        self._ids = itertools.count(1)
+        self._waits: Deque[float] = deque(maxlen=history)
+        self.served = 0
+        self.shed = 0
+        self.cancelled = 0
+
+    # ----- キュー操作 -----
+    def _weight(self, guild_id: int) -> int:
+        return max(1, self.guild_weights.get(guild_id, 1))
+
+    def _order(self) -> Iterator[_Job]:
+        """現在のキューを、実際にディスパッチされる順に列挙する（非破壊）"""
+        guilds = [[g, self._credits.get(g, self._weight(g)), [deque(q) for q in users.values()]]
+                  for g, users in self._queues.items()]
+        while guilds:
+            entry = guilds[0]
+            g, credit, users = entry
+            user_q = users.pop(0)
+            yield user_q.popleft()
+            if user_q:
+                users.append(user_q)
+            entry[1] = credit - 1
+            if not users:
+                guilds.pop(0)
+            elif entry[1] <= 0:
+                entry[1] = self._weight(g)
+                guilds.append(guilds.pop(0))
+
+    def _pop_next(self) -> Optional[_Job]:
+        if not self._queues:
+            return None
+        guild_id, users = next(iter(self._queues.items()))
+        user_id, q = next(iter(users.items()))
+        job = q.popleft()
+        users.pop(user_id)
+        if q:
+            users[user_id] = q          # ユーザーを末尾へ回す
+        credit = self._credits.get(guild_id, self._weight(guild_id)) - 1
+        if not users:
+            self._queues.pop(guild_id)
+            self._credits.pop(guild_id, None)
+        elif credit <= 0:
+            self._queues.move_to_end(guild_id)   # ギルドを末尾へ回す
+            self._credits[guild_id] = self._weight(guild_id)
+        else:
+            self._credits[guild_id] = credit
+        self._queued -= 1
+        return job
+
+    def _remove(self, job: _Job) -> None:
+        users = self._queues.get(job.guild_id)
+        q = users.get(job.user_id) if users else None
+        if not q or job not in q:
+            return
+        q.remove(job)
+        self._queued -= 1
+        if not q:
+            users.pop(job.user_id)
+        if not users:
+            self._queues.pop(job.guild_id)
+            self._credits.pop(job.guild_id, None)
+
+    def _notify_moved(self) -> None:
+        for users in self._queues.values():
+            for q in users.values():
+                for job in q:
+                    job.moved.set()
+
+    def _dispatch(self) -> None:
+        while self._running < self.concurrency:
+            job = self._pop_next()
+            if job is None:
+                break
+            if job.fut.done():
+                continue
+            self._running += 1
+            self._waits.append(time.monotonic() - job.enqueued)
+            job.fut.set_result(None)
+        self._notify_moved()
+
+    # ----- 公開 API -----
+    def position(self, job_id: Any) -> int:
+        """待ち順（1始まり）。実行中・未登録なら 0"""
+        job = self._jobs.get(job_id)
+        if job is None or job.fut.done():
+            return 0
+        for i, queued in enumerate(self._order(), 1):
+            if queued is job:
+                return i
+        return 0
+
+    def reconfigure(self, concurrency: int, max_queue: int, max_per_user: int) -> None:
+        """上限を変更（増やした分はすぐ待機中のジョブへ回す。減らした分は実行中が終わるのを待つ）"""
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, guild_id: int = 0, user_id: int = 0, *, job_id: Any = None,
+                   on_position: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        if job_id is None:
+            job_id = ("auto", next(self._ids))
+        user_q = self._queues.get(guild_id, {}).get(user_id)
+        if self._running >= self.concurrency:
+            if self._queued >= self.max_queue or (user_q and len(user_q) >= self.max_per_user):
+                self.shed += 1
+                raise QueueFull(f"queued={self._queued}")
+
+        job = _Job(job_id, guild_id, user_id)
+        self._jobs[job_id] = job
+        self._queues.setdefault(guild_id, OrderedDict()).setdefault(user_id, deque()).append(job)
+        self._queued += 1
+        self._dispatch()
+        try:
+            last = 0
+            while not job.fut.done():
+                pos = self.position(job_id)
+                if on_position and pos and pos != last:
+                    last = pos
+                    await on_position(pos)
+                job.moved.clear()
+                if job.fut.done():
+                    break
+                mover = asyncio.ensure_future(job.moved.wait())
+                try:
+                    await asyncio.wait({job.fut, mover}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    mover.cancel()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                self.cancelled += 1
+            if job.fut.done():
+                self._running -= 1      # 順番が来た直後に取り消された
+                self._dispatch()
+            else:
+                self._remove(job)
+                job.fut.cancel()
+                self._notify_moved()
+            self._jobs.pop(job_id, None)
+            raise
+
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._running -= 1
+            if cancelled:                # 取り消しは served に数えない
+                self.cancelled += 1
+            else:
+                self.served += 1
+            self._jobs.pop(job_id, None)
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        waits: List[float] = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "concurrency": self.concurrency,
+            "running": self._running,
+            "queued": self._queued,
+            "served": self.served,
+            "shed": self.shed,
+            "cancelled": self.cancelled,
+            "wait_p50": pct(0.50),
+            "wait_p95": pct(0.95),
+            "wait_max": waits[-1] if waits else 0.0,
+        }
@@ -0,0 +1,211 @@
+# search_index.py
+from __future__ import annotations
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MIN_TRIGRAM = 3        # trigram トークナイザで索引を引ける最短の語長
+RANK_WINDOW = 5000     # bm25 で順位付けする候補数（新しい方から。ありふれた語でも速度を保つ）
+_BATCH = 5000
+
+
+class SearchHit:
+    __slots__ = ("message_id", "guild_id", "channel_id", "author", "created_at", "snippet", "score")
+
+    def __init__(self, message_id: int, guild_id: Optional[int], channel_id: int, author: str,
+                 created_at: str, snippet: str, score: float) -> None:
+        self.message_id = message_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.author = author
+        self.created_at = created_at
+        self.snippet = snippet
+        self.score = score
+
+    @property
+    def jump_url(self) -> str:
+        guild = self.guild_id if self.guild_id else "@me"
+        return f"https://discord.com/channels/{guild}/{self.channel_id}/{self.message_id}"
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+class SearchIndex:
+    """エクスポート済み JSONL を SQLite FTS5（trigram）へ取り込む全文検索索引。
+
+    trigram は分かち書き不要なので日本語もそのまま部分一致で引ける。
+    ファイル毎に読み込み済みの位置を覚えておき、追記された行だけを取り込む。
+    3文字未満の語は索引を使えないため LIKE で絞り込む。
+    """
+
+    def __init__(self, path: str) -> None:
+        p = Path(path).expanduser()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()      # 取り込みはスレッドで回すので接続を共有して直列化
+        self._db = sqlite3.connect(p.as_posix(), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY, guild_id INTEGER, channel_id INTEGER NOT NULL,"
+            " author_id INTEGER, author TEXT, created_at TEXT, content TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS messages_channel ON messages(channel_id);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            " content, content='messages', content_rowid='id', tokenize='trigram');"
+            "CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN"
+            " INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END;"
+            "CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN"
+            " INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END;"
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " path TEXT PRIMARY KEY, offset INTEGER NOT NULL, messages INTEGER NOT NULL DEFAULT 0);"
+        )
+        self._db.commit()
+
+    # ===== 取り込み =====
+    @staticmethod
+    def _row(rec: Dict[str, Any], guild_id: Optional[int]) -> Optional[Tuple]:
+        content = rec.get("content") or ""
+        names = " ".join(a.get("filename") or "" for a in rec.get("attachments") or [])
+        if names:
+            content = f"{content}\n{names}" if content else names
+        if not content:
+            return None
+        return (int(rec["id"]), rec.get("guild_id") or guild_id, int(rec["channel_id"]),
+                rec.get("author_id"), rec.get("author"), rec.get("created_at"), content)
+
+    def ingest_file(self, path: str, guild_id: Optional[int] = None) -> int:
+        """前回の続きから JSONL(.gz) を読み、取り込んだ件数を返す"""
+        key = os.path.abspath(path)
+        with self._lock:
+            row = self._db.execute("SELECT offset, messages FROM sources WHERE path=?", (key,)).fetchone()
+        offset, total = row if row else (0, 0)
+        if not path.endswith(".gz") and os.path.getsize(path) < offset:
+            offset = 0          # 書き直されたファイルは最初から
+
+        opener = gzip.open if path.endswith(".gz") else open
+        added = 0
+        rows: List[Tuple] = []
+        with opener(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break       # 書きかけの最終行は次回に回す
+                offset += len(line)
+                try:
+                    r = self._row(json.loads(line), guild_id)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if r is not None:
+                    rows.append(r)
+                if len(rows) >= _BATCH:
+                    added += self._insert(rows, key, offset, total + added)
+                    rows.clear()
+        added += self._insert(rows, key, offset, total + added)
+        return added
+
+    def _insert(self, rows: List[Tuple], key: str, offset: int, total: int) -> int:
+        with self._lock:
+            with self._db:
+                cur = self._db.executemany(
+                    "INSERT OR IGNORE INTO messages(id, guild_id, channel_id, author_id, author, created_at, content)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                added = max(cur.rowcount, 0)
+                self._db.execute(
+                    "INSERT INTO sources(path, offset, messages) VALUES (?, ?, ?)"
+                    " ON CONFLICT(path) DO UPDATE SET offset=excluded.offset, messages=excluded.messages",
+                    (key, offset, total + added))
+        return added
+
+    def ingest_dir(self, root: str) -> int:
+        """root 以下のエクスポートを全部取り込む（manifest.json があればそのギルド ID を使う）"""
+        added = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != "attachments"]
+            guild_id = None
+            if "manifest.json" in filenames:
+                try:
+                    with open(os.path.join(dirpath, "manifest.json"), encoding="utf-8") as f:
+                        guild_id = json.load(f).get("guild_id")
+                except (OSError, ValueError):
+                    pass
+            for name in sorted(filenames):
+                if name.endswith((".jsonl", ".jsonl.gz")):
+                    added += self.ingest_file(os.path.join(dirpath, name), guild_id)
+        return added
+
+    # ===== 検索 =====
+    def search(self, query: str, guild_id: Optional[int] = None, channel_id: Optional[int] = None,
+               limit: int = 10, channel_ids: Optional[Iterable[int]] = None) -> List[SearchHit]:
+        """channel_ids を渡すとそのチャンネルの発言だけを返す（閲覧権限のあるチャンネルに絞る用）"""
+        terms = [t for t in query.split() if t]
+        if not terms:
+            return []
+        allowed = None
+        if channel_ids is not None:
+            allowed = sorted(set(channel_ids))
+            if not allowed:
+                return []
+        long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM]
+        short_terms = [t for t in terms if len(t) < MIN_TRIGRAM]
+
+        where: List[str] = []
+        params: List[Any] = []
+        for t in short_terms:
+            where.append("m.content LIKE ? ESCAPE '\\'")
+            params.append("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if guild_id is not None:
+            where.append("m.guild_id = ?")
+            params.append(guild_id)
+        if channel_id is not None:
+            where.append("m.channel_id = ?")
+            params.append(channel_id)
+        if allowed is not None:
+            # 件数が多くても1つのパラメータで渡せるよう JSON 配列で（SQLite の変数上限を避ける）
+            where.append("m.channel_id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(allowed))
+
+        if long_terms:
+            return self._search_fts(" ".join(_fts_phrase(t) for t in long_terms), where, params, limit)
+        # 短い語だけのときは索引が効かないので新しい順に走査
+        sql = ("SELECT m.id, m.guild_id, m.channel_id, m.author, m.created_at, substr(m.content, 1, 120), 0"
+               " FROM messages m WHERE " + " AND ".join(where) + " ORDER BY m.id DESC LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit]).fetchall()
+        return [SearchHit(*r) for r in rows]
+
+    def _search_fts(self, match: str, where: List[str], params: List[Any], limit: int) -> List[SearchHit]:
+        # 一致する新しい方から RANK_WINDOW 件だけ bm25 で採点し、上位にだけ抜粋を付ける
+        cand_sql = ("SELECT m.id, bm25(messages_fts) FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+                    " WHERE messages_fts MATCH ?" + "".join(" AND " + w for w in where) +
+                    " ORDER BY messages_fts.rowid DESC LIMIT ?")
+        with self._lock:
+            cand = self._db.execute(cand_sql, [match] + params + [RANK_WINDOW]).fetchall()
+            top = sorted(cand, key=lambda r: (r[1], -r[0]))[:limit]
+            if not top:
+                return []
+            score = dict(top)
+            rows = self._db.execute(
+                "SELECT m.id, m.guild_id, m.channel_id, m.author, m.created_at,"
+                " snippet(messages_fts, 0, '**', '**', '…', 16)"
+                " FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid"
+                " WHERE messages_fts MATCH ? AND messages_fts.rowid IN (%s)" % ",".join("?" * len(top)),
+                [match] + list(score)).fetchall()
+        hits = [SearchHit(*r, score[r[0]]) for r in rows]
+        hits.sort(key=lambda h: (h.score, -h.message_id))
+        return hits
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            messages = self._db.execute("SELECT count(*) FROM messages").fetchone()[0]
+            sources = self._db.execute("SELECT count(*) FROM sources").fetchone()[0]
+        return {"messages": messages, "sources": sources}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
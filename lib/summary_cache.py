@@ -0,0 +1,174 @@
+# summary_cache.py
+from __future__ import annotations
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# 追跡用パラメータ（要約内容に影響しないので正規化で落とす）
+_TRACKING_PREFIXES = ("utm_",)
+_TRACKING_KEYS = {"fbclid", "gclid", "si", "ref", "ref_src"}
+
+
+def normalize_url(url: str) -> str:
+    """スキーム/ホストの小文字化・フラグメント除去・追跡パラメータ除去・クエリ整列"""
+    parts = urlsplit(url.strip().rstrip(">)]」』"))
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((parts.scheme == "http" and parts.port == 80) or
+                           (parts.scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k not in _TRACKING_KEYS and not k.startswith(_TRACKING_PREFIXES))
+    return urlunsplit((parts.scheme.lower(), host, parts.path or "/", urlencode(query), ""))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class SummaryEntry:
+    __slots__ = ("url", "summary", "content_hash", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, url: str, summary: str, content_hash: str, etag: Optional[str],
+                 last_modified: Optional[str], fetched_at: float) -> None:
+        self.url = url
+        self.summary = summary
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+
+class SummaryCache:
+    """URL 要約キャッシュ（メモリ上の LRU + SQLite 永続化）。
+
+    TTL 内ならそのまま返し、期限切れなら ETag / Last-Modified で再検証する。
+    本文ハッシュが同じなら別 URL でも要約を使い回す。
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 24 * 3600,
+                 max_entries: int = 1000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, SummaryEntry]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._chunks: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.chunk_hits = 0
+        self.chunk_misses = 0
+        if path:
+            p = Path(path).expanduser()
+            p.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(p.as_posix())
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " url TEXT PRIMARY KEY, summary TEXT NOT NULL, content_hash TEXT NOT NULL,"
+                " etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS summaries_hash ON summaries(content_hash)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_summaries ("
+                " digest TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _remember(self, entry: SummaryEntry) -> None:
+        self._lru[entry.url] = entry
+        self._lru.move_to_end(entry.url)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, url: str) -> Optional[SummaryEntry]:
+        entry = self._lru.get(url)
+        if entry is not None:
+            self._lru.move_to_end(url)
+            return entry
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT url, summary, content_hash, etag, last_modified, fetched_at"
+            " FROM summaries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        entry = SummaryEntry(*row)
+        self._remember(entry)
+        return entry
+
+    def get_by_hash(self, digest: str) -> Optional[str]:
+        for entry in self._lru.values():
+            if entry.content_hash == digest:
+                return entry.summary
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT summary FROM summaries WHERE content_hash = ? LIMIT 1", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, entry: SummaryEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def put(self, url: str, summary: str, digest: str,
+            etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        entry = SummaryEntry(url, summary, digest, etag, last_modified, time.time())
+        self._remember(entry)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+                (entry.url, entry.summary, entry.content_hash, entry.etag,
+                 entry.last_modified, entry.fetched_at))
+            self._db.execute(
+                "DELETE FROM summaries WHERE url NOT IN"
+                " (SELECT url FROM summaries ORDER BY fetched_at DESC LIMIT ?)",
+                (self.max_entries,))
+            self._db.commit()
+
+    def touch(self, entry: SummaryEntry, etag: Optional[str] = None,
+              last_modified: Optional[str] = None) -> None:
+        """再検証で変更なしと分かったエントリの鮮度を更新する"""
+        self.revalidated += 1
+        self.put(entry.url, entry.summary, entry.content_hash,
+                 etag or entry.etag, last_modified or entry.last_modified)
+
+    # ----- 長文の分割要約（本文の断片ハッシュ → 断片の要約）-----
+    def get_chunk(self, digest: str) -> Optional[str]:
+        summary = self._chunks.get(digest)
+        if summary is None and self._db is not None:
+            row = self._db.execute("SELECT summary FROM chunk_summaries WHERE digest = ?", (digest,)).fetchone()
+            summary = row[0] if row else None
+        if summary is None:
+            self.chunk_misses += 1
+            return None
+        self.chunk_hits += 1
+        self._chunks[digest] = summary
+        self._chunks.move_to_end(digest)
+        return summary
+
+    def put_chunk(self, digest: str, summary: str) -> None:
+        self._chunks[digest] = summary
+        self._chunks.move_to_end(digest)
+        while len(self._chunks) > self.max_entries:
+            self._chunks.popitem(last=False)
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO chunk_summaries VALUES (?, ?, ?)",
+                             (digest, summary, time.time()))
+            self._db.execute(
+                "DELETE FROM chunk_summaries WHERE digest NOT IN"
+                " (SELECT digest FROM chunk_summaries ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries * 20,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses,
+                "revalidated": self.revalidated, "entries": len(self._lru),
+                "chunk_hits": self.chunk_hits, "chunk_misses": self.chunk_misses}
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,113 @@
+# traffic_trace.py
+from __future__ import annotations
+import gzip
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, IO, Iterator, List, Optional
+
+# 1行 = 1イベント。キーは短く（荒らし1回で数万行になるため）:
+#   t: 受信時刻（UNIX 秒） g: ギルド c: チャンネル u: 投稿者 m: メッセージ
+#   n: 本文の文字数 a: 添付数 k: メンション付きか d: ライブでの連投判定（ok / limited）
+# 本文そのものは残さない（個人情報を trace に持ち込まない）。
+
+
+def _open(path: Path, mode: str) -> IO[str]:
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TraceRecorder:
+    """on_message の受信イベントを JSONL（.gz 可）へ追記する。
+
+    record() はメモリ上のリストへ積むだけで、flush_every 件ごとか flush_interval 秒
+    ごと（と close 時）にまとめて書く。max_bytes（非圧縮）を超えたら以降は記録しない。
+    """
+
+    def __init__(self, path: str, flush_every: int = 200, flush_interval: float = 5.0,
+                 max_bytes: int = 200_000_000) -> None:
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self._last_flush = time.monotonic()
+        self._buf: List[str] = []
+        self._fh: Optional[IO[str]] = None
+        self.written = 0
+        self.bytes = self.path.stat().st_size if self.path.exists() else 0
+        self.full = self.bytes >= max_bytes
+
+    def record(self, message: Any, decision: str, mentioned: bool = False) -> None:
+        if self.full:
+            return
+        ev = {"t": round(time.time(), 3), "g": message.guild.id if message.guild else 0,
+              "c": message.channel.id, "u": message.author.id, "m": message.id,
+              "n": len(message.content or ""), "d": decision}
+        if getattr(message, "attachments", None):
+            ev["a"] = len(message.attachments)
+        if mentioned:
+            ev["k"] = 1
+        self._buf.append(json.dumps(ev, separators=(",", ":")))
+        if len(self._buf) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buf:
+            return
+        if self._fh is None:
+            self._fh = _open(self.path, "a")
+        data = "\n".join(self._buf) + "\n"
+        self._fh.write(data)
+        self._fh.flush()
+        self.written += len(self._buf)
+        self.bytes += len(data.encode("utf-8"))
+        self._buf.clear()
+        if self.bytes >= self.max_bytes:
+            self.full = True
+            print(f"(trace) {self.path} reached {self.max_bytes} bytes; recording stopped")
+
+    def close(self) -> None:
+        self.flush()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": str(self.path), "written": self.written, "buffered": len(self._buf),
+                "bytes": self.bytes, "full": self.full}
+
+
+def read_trace(path: str) -> Iterator[Dict[str, Any]]:
+    """trace を時刻順に返す（壊れた行は飛ばす。記録は受信順なのでほぼ整列済み）"""
+    events = []
+    with _open(Path(path).expanduser(), "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                continue
+            if "t" in ev and "u" in ev:
+                events.append(ev)
+    events.sort(key=lambda e: e["t"])
+    return iter(events)
+
+
+class VirtualClock:
+    """replay 用の時計。RATE_STATE などの clock に渡し、イベントの時刻へ進める"""
+    __slots__ = ("t",)
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.t = start
+
+    def __call__(self) -> float:
+        return self.t
+
+    def advance_to(self, t: float) -> None:
+        if t > self.t:
+            self.t = t
@@ -0,0 +1,58 @@
+# test_rate_state.py
+"""SQLiteRateState を複数プロセスから同時に使っても数え漏れ・数えすぎが無いことを確かめる"""
+from __future__ import annotations
+import multiprocessing as mp
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lib.rate_state import SQLiteRateState
+
+WORKERS = 6
+USERS = 4
+HITS = 20       # 1ワーカーが1ユーザーに投稿する回数
+LIMIT = 7
+NOW = 1_000.0   # 全員同じ時刻にして窓から外れる投稿を無くす
+
+
+def _worker(path: str, start, out) -> None:
+    state = SQLiteRateState(path, LIMIT, 60.0, 600.0, clock=lambda: NOW, sweep_every=3)
+    accepted = {u: 0 for u in range(USERS)}
+    violations = {u: [] for u in range(USERS)}
+    start.wait()
+    for _ in range(HITS):
+        for u in range(USERS):
+            if state.hit(u):
+                violations[u].append(state.record_violation(u))
+            else:
+                accepted[u] += 1
+    state.close()
+    out.put((accepted, violations))
+
+
+def test_shared_across_processes(tmp_path):
+    path = str(tmp_path / "ratelimit.sqlite3")
+    SQLiteRateState(path, LIMIT, 60.0, 600.0).close()   # 表の作成を先に済ませる
+    ctx = mp.get_context("spawn")
+    start, out = ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(path, start, out)) for _ in range(WORKERS)]
+    for p in procs:
+        p.start()
+    start.set()
+    results = [out.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+
+    for u in range(USERS):
+        # 受け付けた投稿は全ワーカー合計でちょうど limit 件
+        assert sum(acc[u] for acc, _ in results) == LIMIT
+        # 違反はどのワーカーで数えても同じ通し番号になり、1..件数 が1回ずつ現れる
+        counts = sorted(c for _, vio in results for c in vio[u])
+        assert counts == list(range(1, WORKERS * HITS - LIMIT + 1))
+
+    state = SQLiteRateState(path, LIMIT, 60.0, 600.0, clock=lambda: NOW)
+    try:
+        assert state.record_violation(0) == WORKERS * HITS - LIMIT + 1
+    finally:
+        state.close()